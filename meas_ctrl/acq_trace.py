@@ -0,0 +1,131 @@
+################################################################################
+#
+#  Description:
+#      Low-overhead span recorder for the acquisition loop. Instrumented code
+#      wraps each stage in
+#
+#          with acq_trace.span('vna.read'):
+#              ...
+#
+#      Spans go into a fixed-size in-memory ring buffer (the oldest are
+#      overwritten once it is full). While tracing is off span() returns a
+#      shared no-op context, so the instrumentation costs one attribute
+#      lookup. A recorded trace can be exported as Chrome trace JSON (open in
+#      chrome://tracing or Perfetto) and summarized per stage.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import json
+import os
+import threading
+import time
+
+
+class null_span:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class active_span:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class span_recorder:
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.spans = [None] * capacity   # [name, start_ns, duration_ns, thread id]
+        self.count = 0
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.origin = time.perf_counter_ns()
+
+    def record(self, name, start, duration):
+        with self.lock:
+            self.spans[self.count % self.capacity] = (name, start, duration, threading.get_ident())
+            self.count = self.count + 1
+
+    def reset(self):
+        with self.lock:
+            self.spans = [None] * self.capacity
+            self.count = 0
+            self.origin = time.perf_counter_ns()
+
+    def recorded(self):  # spans still in the buffer, oldest first
+        with self.lock:
+            if self.count <= self.capacity:
+                return list(self.spans[:self.count])
+            i = self.count % self.capacity
+            return self.spans[i:] + self.spans[:i]
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for [name, start, duration, tid] in self.recorded():
+            events.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': (start - self.origin) / 1000.0, 'dur': duration / 1000.0})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+    def summary(self):
+        """Per stage [name, count, total s, mean ms, max ms], largest total first.
+        Nested spans are counted in their parent as well as on their own.
+        """
+        stages = {}
+        for [name, start, duration, tid] in self.recorded():
+            stage = stages.setdefault(name, [0, 0, 0])
+            stage[0] = stage[0] + 1
+            stage[1] = stage[1] + duration
+            stage[2] = max(stage[2], duration)
+        table = [[name, s[0], s[1] / 1e9, s[1] / s[0] / 1e6, s[2] / 1e6] for name, s in stages.items()]
+        return sorted(table, key=lambda row: -row[2])
+
+    def summary_table(self):
+        lines = ['{:<28}{:>8}{:>12}{:>12}{:>12}'.format('stage', 'count', 'total (s)', 'mean (ms)', 'max (ms)')]
+        for [name, count, total, mean, peak] in self.summary():
+            lines.append('{:<28}{:>8}{:>12.3f}{:>12.2f}{:>12.2f}'.format(name, count, total, mean, peak))
+        if self.count > self.capacity:
+            lines.append('({} oldest spans were overwritten)'.format(self.count - self.capacity))
+        return '\n'.join(lines)
+
+
+recorder = span_recorder()
+_NULL = null_span()
+
+
+def span(name):
+    if recorder.enabled:
+        return active_span(recorder, name)
+    return _NULL
+
+
+def enable(capacity=None):
+    if capacity is not None and capacity != recorder.capacity:
+        recorder.capacity = capacity
+    recorder.reset()
+    recorder.enabled = True
+
+
+def disable():
+    recorder.enabled = False
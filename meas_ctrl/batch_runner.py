@@ -0,0 +1,154 @@
+################################################################################
+#
+#  Description:
+#      Headless batch runner. Takes a queue of pivot.json style configuration
+#      files and executes them back to back on one set of instruments. The
+#      VISA sessions, the positioner stats and a still valid calibration are
+#      reused between jobs, and jobs are reordered so that jobs sharing a
+#      frequency plan run consecutively. A per-job timing summary is printed
+#      and written as CSV at the end of the batch.
+#
+#      usage: batch_runner.py [-o OUT_DIR] [-s SUMMARY] config.json [config.json ...]
+#
+#  Dependencies:
+#      PyVISA Version: 1.10.1
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import argparse
+import json
+import os
+import sys
+import time
+from measurement_ctrl import meas_ctrl
+import cal_store
+import ctrl_signals
+import vna_comms
+
+
+class job:
+    def __init__(self, config_file, args, data_file, position):
+        self.config_file = config_file
+        self.args = args
+        self.data_file = data_file
+        self.position = position    # position in the queue as submitted
+        self.setup_time = 0
+        self.run_time = 0
+        self.cal_reused = False
+        self.status = 'pending'
+
+    def instrument_key(self):
+        return (self.args['gpib_addr'], self.args['alias'], self.args['baud_rate'])
+
+    def plan_key(self):
+        if len(self.args['list']) != 0:
+            freq = self.args['list']
+        else:
+            freq = vna_comms.lin_freq(self.args['linear']['start'], self.args['linear']['end'],
+                                      self.args['linear']['points'])
+        return vna_comms.plan_key(freq)
+
+    def sort_key(self):
+        # same instruments first, then same frequency plan (shared calibration), then same averaging
+        return (str(self.instrument_key()), str(self.plan_key()), self.args['averaging'], self.position)
+
+
+def load_jobs(config_files, out_dir):
+    """Output files are named after the config files. Configs sharing a name
+    (e.g. the same file name in different folders, or one file queued twice)
+    get their queue position appended so no job overwrites another's data.
+    """
+    names = [os.path.splitext(os.path.basename(c))[0] for c in config_files]
+    counts = {}
+    for name in names:
+        counts[name.lower()] = counts.get(name.lower(), 0) + 1  # Windows file names ignore case
+    jobs = []
+    for i in range(0, len(config_files)):
+        with open(config_files[i], 'r') as file:
+            args = json.load(file)
+        name = names[i]
+        if counts[name.lower()] > 1:
+            name = '{}_{}'.format(name, i)
+        jobs.append(job(config_files[i], args, os.path.join(out_dir, name + '.csv'), i))
+    files = {}
+    for j in jobs:  # e.g. a config named p_1 next to a second p
+        key = os.path.normcase(j.data_file)
+        if key in files:
+            raise Exception('Jobs {} and {} would both write {}'.format(files[key].config_file, j.config_file,
+                                                                        j.data_file))
+        files[key] = j
+    return jobs
+
+
+def order_jobs(jobs):
+    return sorted(jobs, key=lambda j: j.sort_key())
+
+
+def run_batch(jobs):
+    ctrl = None
+    instruments = None
+    jobs = order_jobs(jobs)
+    for j in jobs:
+        try:
+            start = time.time()
+            if ctrl is None or j.instrument_key() != instruments:
+                ctrl = meas_ctrl(j.args, j.data_file, ctrl_signals.plain_signals())
+                ctrl.signals.cal_verified.connect(lambda *result: print(cal_store.verification_text(*result)))
+                instruments = j.instrument_key()
+            else:
+                ctrl.configure(j.args, j.data_file)
+            ctrl.setup()
+            j.cal_reused = ctrl.cal_reused
+            j.setup_time = time.time() - start
+            start = time.time()
+            ctrl.run()
+            j.run_time = time.time() - start
+            if ctrl.interrupted is not None:
+                j.status = 'interrupted ({})'.format(ctrl.interrupted)
+            else:
+                j.status = 'done'
+        except Exception as err:
+            j.status = 'failed: {}'.format(err)  # setup() and run() have closed the job's file and stream
+            if ctrl is not None:
+                ctrl.release_instruments()  # the sessions may be in an unknown state, reopen them for the next job
+            ctrl = None
+        print_job(j)
+    return jobs
+
+
+def print_job(j):
+    print('{:<30} setup {:8.1f} s   run {:8.1f} s   cal {:<8} {}'.format(
+        os.path.basename(j.config_file), j.setup_time, j.run_time,
+        'reused' if j.cal_reused else '-', j.status))
+
+
+def write_summary(filename, jobs):
+    with open(filename, 'w') as file:
+        file.write('order,config,data_file,setup_time,run_time,total_time,cal_reused,status\n')
+        for j in jobs:
+            file.write('{},{},{},{:.3f},{:.3f},{:.3f},{},{}\n'.format(
+                j.position, j.config_file, j.data_file, j.setup_time, j.run_time,
+                j.setup_time + j.run_time, j.cal_reused, j.status.replace(',', ';')))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run a queue of measurement configurations back to back.')
+    parser.add_argument('configs', nargs='+', help='configuration files in pivot.json format')
+    parser.add_argument('-o', '--out-dir', default='data', help='directory for the output data files')
+    parser.add_argument('-s', '--summary', default=None, help='CSV file for the per-job timing summary')
+    opts = parser.parse_args(argv[1:])
+
+    jobs = load_jobs(opts.configs, opts.out_dir)
+    start = time.time()
+    order = run_batch(jobs)
+    print('Batch of {} jobs finished in {:.1f} s'.format(len(jobs), time.time() - start))
+    if opts.summary is not None:
+        write_summary(opts.summary, order)
+    if any(j.status != 'done' for j in jobs):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
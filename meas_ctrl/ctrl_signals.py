@@ -0,0 +1,45 @@
+################################################################################
+#
+#  Description:
+#      Signals meas_ctrl reports progress and position through. GUI code gets
+#      Qt signals (gui_signals.meas_ctrl_signals, which needs PyQt5), headless
+#      runs get plain_signals, which offer the same connect()/emit() interface
+#      with direct calls and no Qt import at all.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+
+
+class signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+    def emit(self, *args):  # calls the slots in the emitting thread
+        for slot in list(self.slots):
+            slot(*args)
+
+
+class plain_signals:
+    def __init__(self):
+        self.finished = signal()
+        self.paused = signal()
+        self.stopped = signal()
+        self.progress = signal()
+        self.current_pan = signal()
+        self.current_tilt = signal()
+        self.cal_verified = signal()    # source, age (h), S11 deviation (dB), accepted
+
+
+def qt_signals():
+    from gui_signals import meas_ctrl_signals
+    return meas_ctrl_signals()
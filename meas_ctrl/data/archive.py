@@ -0,0 +1,236 @@
+################################################################################
+#
+#  Description:
+#      Compressed long-term archive format for measurement runs. Every run and
+#      S-parameter (a cut) is laid out as an [angle, freq] grid, magnitude and
+#      phase are quantized to a configurable step, delta encoded along
+#      frequency and then along angle, and compressed with zlib in
+#      independent chunks of FREQ_BLOCK frequencies. The chunk index sits in a
+#      footer, so a reader only seeks to and decompresses the chunks of the
+#      cuts and frequencies it asks for.
+#
+#          file   = MAGIC, version (u16), chunk, chunk, ..., index (JSON),
+#                   index offset (u64), index length (u32)
+#          chunk  = zlib(int32 magnitude deltas [angle, freq] +
+#                        int32 phase deltas [angle, freq])
+#
+#      usage: archive.py pack data0.csv data0.mca [--mag-step DB] [--phase-step DEG]
+#             archive.py report data0.mca
+#
+#  Status:
+#      Cuts must be complete grids (every angle measured at every frequency).
+#
+#  Dependencies:
+#      NumPy
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+import numpy as np
+import binary_storage
+import csv_loader
+
+MAGIC = b'MCAR'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sH')
+FOOTER = struct.Struct('<QI')
+FREQ_BLOCK = 64
+S_PARAMS = binary_storage.S_PARAMS
+
+
+def load_columns(filename):  # columns of a .mcb or legacy CSV file as NumPy arrays
+    if binary_storage.is_binary(filename):
+        [header, columns] = binary_storage.load(filename)
+        return {k: np.asarray(columns[k]) for k in ['run', 's_param', 'freq', 'theta', 'phi',
+                                                   'magnitude', 'phase']}
+    table = csv_loader.load(filename, use_cache=False)  # packing must not leave a .npz behind
+    return {'run': table.run, 's_param': table.s_param, 'freq': table.freq, 'theta': table.theta,
+            'phi': table.phi, 'magnitude': table.magnitude, 'phase': table.phase}
+
+
+def grids(columns):
+    """Yields [run, s_code, theta, phi, freqs, magnitude, phase] for every cut,
+    with magnitude and phase as [angle, freq] grids. Angles keep the order
+    they were measured in.
+    """
+    for run in np.unique(columns['run']):
+        for s_code in np.unique(columns['s_param'][columns['run'] == run]):
+            rows = np.nonzero((columns['run'] == run) & (columns['s_param'] == s_code))[0]
+            angles = np.stack([columns['theta'][rows], columns['phi'][rows]], axis=1)
+            [unique_angles, first, angle_index] = np.unique(angles, axis=0, return_index=True,
+                                                            return_inverse=True)
+            order = np.argsort(first)                   # measurement order of the angles
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            angle_index = rank[angle_index.reshape(-1)]
+            [freqs, freq_index] = np.unique(columns['freq'][rows], return_inverse=True)
+            freq_index = freq_index.reshape(-1)
+            if len(rows) != len(order) * len(freqs) or \
+                    len(np.unique(angle_index * len(freqs) + freq_index)) != len(rows):
+                raise Exception('Run {} {} is not a complete angle/frequency grid'.format(run, S_PARAMS[s_code]))
+            magnitude = np.empty((len(order), len(freqs)))
+            phase = np.empty((len(order), len(freqs)))
+            magnitude[angle_index, freq_index] = columns['magnitude'][rows]
+            phase[angle_index, freq_index] = columns['phase'][rows]
+            yield [int(run), int(s_code), unique_angles[order, 0], unique_angles[order, 1], freqs,
+                   magnitude, phase]
+
+
+def delta_encode(q, modulus=None):  # deltas along frequency, then along angle
+    d = np.diff(q, axis=1, prepend=0)
+    d = np.diff(d, axis=0, prepend=0)
+    if modulus is not None:
+        d = (d + modulus // 2) % modulus - modulus // 2
+    return d.astype(np.int32)
+
+
+def delta_decode(d, modulus=None):
+    q = np.cumsum(np.cumsum(d.astype(np.int64), axis=0), axis=1)
+    if modulus is not None:
+        q = q % modulus
+    return q
+
+
+def pack(src, dst, mag_step=.01, phase_step=.1):
+    """Archives src (.mcb or CSV) into dst. Magnitudes are kept to mag_step dB
+    and phases to phase_step degrees. Returns the archive index.
+    """
+    columns = load_columns(src)
+    modulus = int(round(360 / phase_step))
+    index = {'mag_step': mag_step, 'phase_step': phase_step, 'source': os.path.basename(src),
+             'source_size': os.path.getsize(src), 'cuts': []}
+    with open(dst, 'wb') as file:
+        file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        for [run, s_code, theta, phi, freqs, magnitude, phase] in grids(columns):
+            cut = {'run': run, 's_param': S_PARAMS[s_code], 'theta': theta.tolist(), 'phi': phi.tolist(),
+                   'freq': freqs.tolist(), 'chunks': []}
+            q_mag = np.round(magnitude / mag_step).astype(np.int64)
+            q_phase = np.round(phase / phase_step).astype(np.int64) % modulus
+            for start in range(0, len(freqs), FREQ_BLOCK):
+                block = slice(start, start + FREQ_BLOCK)
+                payload = delta_encode(q_mag[:, block]).astype('<i4').tobytes() + \
+                    delta_encode(q_phase[:, block], modulus).astype('<i4').tobytes()
+                compressed = zlib.compress(payload, 9)
+                cut['chunks'].append([start, min(start + FREQ_BLOCK, len(freqs)), file.tell(), len(compressed)])
+                file.write(compressed)
+            index['cuts'].append(cut)
+        encoded = json.dumps(index).encode('utf-8')
+        offset = file.tell()
+        file.write(encoded)
+        file.write(FOOTER.pack(offset, len(encoded)))
+    return index
+
+
+class archive_reader:
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        magic, version = FILE_HEADER.unpack(self.file.read(FILE_HEADER.size))
+        if magic != MAGIC or version > VERSION:
+            raise Exception('Not a supported measurement archive: {}'.format(filename))
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        offset, length = FOOTER.unpack(self.file.read(FOOTER.size))
+        self.file.seek(offset)
+        self.index = json.loads(self.file.read(length).decode('utf-8'))
+        self.cuts = self.index['cuts']
+        self.modulus = int(round(360 / self.index['phase_step']))
+
+    def close(self):
+        self.file.close()
+
+    def find(self, run, s_param):
+        for cut in self.cuts:
+            if cut['run'] == run and cut['s_param'] == s_param:
+                return cut
+        raise Exception('The archive holds no run {} {}'.format(run, s_param))
+
+    def read_chunk(self, cut, chunk):
+        [start, stop, offset, length] = chunk
+        self.file.seek(offset)
+        payload = np.frombuffer(zlib.decompress(self.file.read(length)), dtype='<i4')
+        shape = (len(cut['theta']), stop - start)
+        count = shape[0] * shape[1]
+        magnitude = delta_decode(payload[:count].reshape(shape)) * self.index['mag_step']
+        phase = delta_decode(payload[count:].reshape(shape), self.modulus) * self.index['phase_step']
+        phase = (phase + 180) % 360 - 180
+        return [magnitude, phase]
+
+    def read(self, run, s_param, fmin=None, fmax=None):
+        """Decompresses the part of one cut between fmin and fmax (MHz, inclusive).
+        Returns [theta, phi, freqs, magnitude, phase] with [angle, freq] grids.
+        """
+        cut = self.find(run, s_param)
+        freqs = np.asarray(cut['freq'])
+        lo = 0 if fmin is None else int(np.searchsorted(freqs, fmin, side='left'))
+        hi = len(freqs) if fmax is None else int(np.searchsorted(freqs, fmax, side='right'))
+        magnitude = []
+        phase = []
+        for chunk in cut['chunks']:
+            if chunk[1] <= lo or chunk[0] >= hi:
+                continue      # never decompressed
+            [m, p] = self.read_chunk(cut, chunk)
+            keep = slice(max(lo - chunk[0], 0), min(hi, chunk[1]) - chunk[0])
+            magnitude.append(m[:, keep])
+            phase.append(p[:, keep])
+        if len(magnitude) == 0:
+            empty = np.empty((len(cut['theta']), 0))
+            return [np.asarray(cut['theta']), np.asarray(cut['phi']), freqs[lo:hi], empty, empty]
+        return [np.asarray(cut['theta']), np.asarray(cut['phi']), freqs[lo:hi],
+                np.concatenate(magnitude, axis=1), np.concatenate(phase, axis=1)]
+
+    def stream(self, run=None, s_param=None, fmin=None, fmax=None):  # yields read() of every matching cut
+        for cut in self.cuts:
+            if (run is None or cut['run'] == run) and (s_param is None or cut['s_param'] == s_param):
+                yield [cut['run'], cut['s_param']] + self.read(cut['run'], cut['s_param'], fmin, fmax)
+
+
+def report(filename):
+    """Returns the compression ratio against the source file and against
+    float64 columns, and the decode throughput over the whole archive.
+    """
+    reader = archive_reader(filename)
+    points = sum(len(c['theta']) * len(c['freq']) for c in reader.cuts)
+    start = time.perf_counter()
+    for item in reader.stream():
+        pass
+    elapsed = time.perf_counter() - start
+    reader.close()
+    size = os.path.getsize(filename)
+    return {
+        'points': points,
+        'archive_bytes': size,
+        'ratio_vs_source': reader.index['source_size'] / size,
+        'ratio_vs_float64': points * 8 * 5 / size,  # run, freq, angle, magnitude and phase columns
+        'decode_points_per_s': points / elapsed if elapsed > 0 else float('inf'),
+        'decode_mb_per_s': size / elapsed / 1e6 if elapsed > 0 else float('inf'),
+    }
+
+
+def main(argv):
+    if len(argv) >= 4 and argv[1] == 'pack':
+        mag_step = .01
+        phase_step = .1
+        if '--mag-step' in argv:
+            mag_step = float(argv[argv.index('--mag-step') + 1])
+        if '--phase-step' in argv:
+            phase_step = float(argv[argv.index('--phase-step') + 1])
+        pack(argv[2], argv[3], mag_step, phase_step)
+        argv = [argv[0], 'report', argv[3]]
+    if len(argv) == 3 and argv[1] == 'report':
+        r = report(argv[2])
+        print('{} points in {} bytes, ratio {:.1f}x vs source, {:.1f}x vs float64 columns, '
+              'decode {:.2f} Mpoints/s ({:.1f} MB/s compressed)'.format(
+                  r['points'], r['archive_bytes'], r['ratio_vs_source'], r['ratio_vs_float64'],
+                  r['decode_points_per_s'] / 1e6, r['decode_mb_per_s']))
+        return 0
+    print('usage: archive.py pack src dst.mca [--mag-step DB] [--phase-step DEG] | archive.py report dst.mca')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,288 @@
+################################################################################
+#
+#  Description:
+#      Binary, append-friendly columnar storage for measurement data. A file
+#      starts with a header holding the sweep plan, followed by one chunk per
+#      angle and S-parameter:
+#
+#          file   = MAGIC, version (u16), header length (u32), header (JSON)
+#                   chunk, chunk, ...
+#          chunk  = 'CHNK', s-param (u8), pad (3), theta (f8), phi (f8), n (u32)
+#                   freq[n] (f8), magnitude[n] (f8), phase[n] (f8)
+#                   'CMIT', crc32 of everything from 'CHNK' up to 'CMIT' (u32)
+#          end    = 'ENDR' chunk with n = 0, marks the end of a run (the
+#                   'null' row of the CSV files)
+#
+#      Raw files (header 'raw': true) hold the traces exactly as the VNA sent
+#      them instead, the frequencies of the plan are kept in the header:
+#          raw    = 'RAWC', s-param (u8), pad (3), theta (f8), phi (f8), n (u32)
+#                   timestamp (f8), FORM2 payload (n big endian f4 real/imag
+#                   pairs), 'CMIT', crc32
+#
+#      All values apart from the FORM2 payloads are little endian. A chunk only counts once its commit
+#      marker is on disk, so a run killed in the middle of a write leaves a
+#      readable file. The reader loads whole columns at once.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b'MCTB'
+VERSION = 1
+CHUNK = b'CHNK'
+RAW = b'RAWC'
+END_RUN = b'ENDR'
+COMMIT = b'CMIT'
+CHUNK_HEADER = struct.Struct('<4sB3xddI')
+COMMIT_MARKER = struct.Struct('<4sI')
+FILE_HEADER = struct.Struct('<4sHI')
+COLUMNS = 3  # freq, magnitude, phase
+RAW_TIMESTAMP = struct.Struct('<d')
+
+S_PARAMS = ['S11', 'S21', 'S12', 'S22']
+S_CODE = {'S11': 0, 'S21': 1, 'S12': 2, 'S22': 3}
+
+
+def is_binary(filename):
+    return filename.lower().endswith('.mcb')
+
+
+class raw_trace:
+    def __init__(self, s_param, theta, phi, timestamp, payload):
+        self.s_param = s_param
+        self.theta = theta
+        self.phi = phi
+        self.timestamp = timestamp
+        self.payload = payload  # FORM2 payload as returned by vna_comms.session.get_raw()
+
+
+def create_file(filename, plan=None, freqs=None, raw=False):
+    header = json.dumps({'plan': plan, 'freqs': freqs, 'raw': raw}).encode('utf-8')
+    with open(filename, 'wb') as file:
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, len(header)))
+        file.write(header)
+
+
+def encode_chunk(tag, s_code, theta, phi, freq, mag, phase):
+    n = len(freq)
+    columns = array('d', freq)
+    columns.extend(mag)
+    columns.extend(phase)
+    if sys.byteorder != 'little':
+        columns.byteswap()
+    body = CHUNK_HEADER.pack(tag, s_code, theta, phi, n) + columns.tobytes()
+    return body + COMMIT_MARKER.pack(COMMIT, zlib.crc32(body))
+
+
+# data is a list of vna_comms.data, consecutive points of the same angle and S-parameter share a chunk
+def encode_data(data):
+    chunks = []
+    i = 0
+    while i < len(data):
+        j = i
+        while j < len(data) and data[j].measurement_type == data[i].measurement_type \
+                and data[j].theta == data[i].theta and data[j].phi == data[i].phi:
+            j = j + 1
+        chunks.append(encode_chunk(CHUNK, S_CODE[data[i].measurement_type], data[i].theta, data[i].phi,
+                                   [d.freq for d in data[i:j]],
+                                   [d.value_mag for d in data[i:j]],
+                                   [d.value_phase for d in data[i:j]]))
+        i = j
+    return b''.join(chunks)
+
+
+def encode_raw(trace):
+    """Encodes a raw_trace as a list of buffers; the payload is passed through
+    as is, so it is never decoded or copied on the acquisition side.
+    """
+    header = CHUNK_HEADER.pack(RAW, S_CODE[trace.s_param], trace.theta, trace.phi, len(trace.payload) // 8) \
+        + RAW_TIMESTAMP.pack(trace.timestamp)
+    crc = zlib.crc32(trace.payload, zlib.crc32(header))
+    return [header, trace.payload, COMMIT_MARKER.pack(COMMIT, crc)]
+
+
+def encode_end_run():
+    return encode_chunk(END_RUN, 0, 0, 0, [], [], [])
+
+
+def append_data(filename, data):
+    with open(filename, 'ab') as file:
+        if isinstance(data, raw_trace):
+            file.writelines(encode_raw(data))
+        else:
+            file.write(encode_data(data))
+
+
+def end_run(filename):
+    with open(filename, 'ab') as file:
+        file.write(encode_end_run())
+
+
+def read_header(buffer):
+    magic, version, length = FILE_HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise Exception('Not a binary measurement file (bad magic: {})'.format(magic))
+    if version > VERSION:
+        raise Exception('Unsupported binary measurement file version: {}'.format(version))
+    header = json.loads(bytes(buffer[FILE_HEADER.size:FILE_HEADER.size + length]).decode('utf-8'))
+    return [header, FILE_HEADER.size + length]
+
+
+def payload_size(tag, n):
+    if tag == RAW:
+        return RAW_TIMESTAMP.size + 8 * n
+    elif tag == CHUNK or tag == END_RUN:
+        return 8 * COLUMNS * n
+    return None
+
+
+def chunks(buffer, offset):
+    """Yields [tag, s_code, theta, phi, n, data_offset, next_offset] for every
+    committed chunk in buffer, stopping at the first torn or corrupt chunk.
+    """
+    while offset + CHUNK_HEADER.size <= len(buffer):
+        tag, s_code, theta, phi, n = CHUNK_HEADER.unpack_from(buffer, offset)
+        data_offset = offset + CHUNK_HEADER.size
+        size = payload_size(tag, n)
+        if size is None or data_offset + size + COMMIT_MARKER.size > len(buffer):
+            return
+        end = data_offset + size
+        marker, crc = COMMIT_MARKER.unpack_from(buffer, end)
+        if marker != COMMIT or crc != zlib.crc32(buffer[offset:end]):
+            return
+        yield [tag, s_code, theta, phi, n, data_offset, end + COMMIT_MARKER.size]
+        offset = end + COMMIT_MARKER.size
+
+
+def column(buffer, offset, n):
+    values = array('d')
+    values.frombytes(buffer[offset:offset + 8 * n])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class raw_columns(dict):
+    """Columns of a raw file. 'real' and 'imag' are decoded on load,
+    'magnitude' (dB) and 'phase' (degrees) are only derived from them the
+    first time they are asked for.
+    """
+    def __missing__(self, key):
+        if key == 'magnitude':
+            self['magnitude'] = array('d', [20 * math.log10(math.hypot(re, im) + 1e-60)
+                                            for re, im in zip(self['real'], self['imag'])])
+        elif key == 'phase':
+            self['phase'] = array('d', [math.degrees(math.atan2(im, re))
+                                        for re, im in zip(self['real'], self['imag'])])
+        else:
+            raise KeyError(key)
+        return self[key]
+
+
+def raw_column(buffer, offset, n):  # FORM2 payload -> [real, imag] float32 arrays
+    values = array('f')
+    values.frombytes(buffer[offset:offset + 8 * n])
+    if sys.byteorder != 'big':
+        values.byteswap()
+    return [values[0::2], values[1::2]]
+
+
+def load(filename):
+    """Loads a binary measurement file. Returns [header, columns] where columns
+    is a dict of equally long arrays: 'run', 's_param' (codes into S_PARAMS),
+    'freq', 'theta', 'phi', 'magnitude' and 'phase'. Raw files additionally
+    have 'real', 'imag' and 'timestamp', their magnitude and phase are
+    computed lazily.
+    """
+    with open(filename, 'rb') as file:
+        buffer = memoryview(file.read())
+    [header, offset] = read_header(buffer)
+    columns = {
+        'run': array('I'),
+        's_param': array('B'),
+        'freq': array('d'),
+        'theta': array('d'),
+        'phi': array('d'),
+    }
+    if header.get('raw'):
+        columns = raw_columns(columns)
+        columns['real'] = array('f')
+        columns['imag'] = array('f')
+        columns['timestamp'] = array('d')
+        freqs = array('d', header['freqs'])
+    else:
+        columns['magnitude'] = array('d')
+        columns['phase'] = array('d')
+    run = 0
+    for [tag, s_code, theta, phi, n, data_offset, next_offset] in chunks(buffer, offset):
+        if tag == END_RUN:
+            run = run + 1
+            continue
+        columns['run'].extend(array('I', [run]) * n)
+        columns['s_param'].extend(array('B', [s_code]) * n)
+        columns['theta'].extend(array('d', [theta]) * n)
+        columns['phi'].extend(array('d', [phi]) * n)
+        if tag == RAW:
+            columns['freq'].extend(freqs[0:n])
+            columns['timestamp'].extend(array('d', [RAW_TIMESTAMP.unpack_from(buffer, data_offset)[0]]) * n)
+            [real, imag] = raw_column(buffer, data_offset + RAW_TIMESTAMP.size, n)
+            columns['real'].extend(real)
+            columns['imag'].extend(imag)
+        else:
+            columns['freq'].extend(column(buffer, data_offset, n))
+            columns['magnitude'].extend(column(buffer, data_offset + 8 * n, n))
+            columns['phase'].extend(column(buffer, data_offset + 16 * n, n))
+    return [header, columns]
+
+
+def convert_csv(csv_file, out_file, plan=None):
+    """Converts a data0.csv style file, 'null' end-of-run rows become run end
+    chunks. Returns the number of data rows converted.
+    """
+    create_file(out_file, plan)
+    rows = 0
+    with open(csv_file, 'r') as src, open(out_file, 'ab') as dst:
+        key = None
+        freq = []
+        mag = []
+        phase = []
+        for line in src:
+            fields = line.strip().split(',')
+            if len(fields) < 6 or fields[0] == 'measurement_type':
+                continue
+            if fields[0] == 'null':
+                new_key = None
+            else:
+                new_key = (fields[0], float(fields[2]), float(fields[3]))
+            if new_key != key and key is not None:
+                dst.write(encode_chunk(CHUNK, S_CODE[key[0]], key[1], key[2], freq, mag, phase))
+                freq = []
+                mag = []
+                phase = []
+            key = new_key
+            if key is None:
+                dst.write(encode_end_run())
+                continue
+            freq.append(float(fields[1]))
+            mag.append(float(fields[4]))
+            phase.append(float(fields[5]))
+            rows = rows + 1
+        if key is not None:
+            dst.write(encode_chunk(CHUNK, S_CODE[key[0]], key[1], key[2], freq, mag, phase))
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: binary_storage.py data0.csv data0.mcb')
+        sys.exit(1)
+    print('Converted {} rows.'.format(convert_csv(sys.argv[1], sys.argv[2])))
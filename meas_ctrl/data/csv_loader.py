@@ -0,0 +1,167 @@
+################################################################################
+#
+#  Description:
+#      Fast loader for legacy data0.csv style measurement files. The file is
+#      read in one go, split into runs at the 'null,null,...' sentinel rows
+#      and the numeric columns of every run are parsed in bulk by NumPy. An
+#      index of the runs, S-parameters, frequencies and angles is built and
+#      the result is cached next to the file (<file>.npz), later loads of an
+#      unchanged file only read the cache.
+#      A torn last row, as left by a run that died while writing, is dropped
+#      with a warning; any other malformed row raises naming its line.
+#
+#  Status:
+#
+#
+#  Dependencies:
+#      NumPy
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import os
+import numpy as np
+
+CACHE_VERSION = 1
+S_PARAMS = ['S11', 'S21', 'S12', 'S22']  # codes match binary_storage.S_PARAMS
+KEY = np.dtype([('run', np.int64), ('s', np.int64), ('freq', np.float64)])
+
+
+class measurement_table:
+    def __init__(self, columns):
+        self.run = columns['run']               # int32, run number of every row
+        self.s_param = columns['s_param']       # uint8, code into S_PARAMS
+        self.freq = columns['freq']             # float64 columns, one entry per row
+        self.theta = columns['theta']
+        self.phi = columns['phi']
+        self.magnitude = columns['magnitude']
+        self.phase = columns['phase']
+        self.order = columns['order']           # rows sorted by (run, S-param, freq, theta, phi)
+        self.runs = np.unique(self.run)
+        self.freqs = np.unique(self.freq)
+        self.keys = np.empty(len(self.order), dtype=KEY)    # (run, S-param, freq) in index order
+        self.keys['run'] = self.run[self.order]
+        self.keys['s'] = self.s_param[self.order]
+        self.keys['freq'] = self.freq[self.order]
+
+    def __len__(self):
+        return len(self.freq)
+
+    def rows(self, run, s_param, freq):
+        """Row numbers of one run, S-parameter and frequency, ordered by angle.
+        Uses the sorted index, so only a binary search is needed.
+        """
+        key = np.array((run, S_PARAMS.index(s_param), freq), dtype=KEY)
+        lo = np.searchsorted(self.keys, key, side='left')
+        hi = np.searchsorted(self.keys, key, side='right')
+        return self.order[lo:hi]
+
+    def cut(self, run, s_param, freq):  # [theta, phi, magnitude, phase] of one frequency of one run
+        rows = self.rows(run, s_param, freq)
+        return [self.theta[rows], self.phi[rows], self.magnitude[rows], self.phase[rows]]
+
+
+def cache_name(filename):
+    return filename + '.npz'
+
+
+def parse_row(line):  # one data row as 6 numbers, None if it is malformed
+    fields = line.replace(b'S', b'').split(b',')
+    if len(fields) != 6:
+        return None
+    try:
+        return np.array(fields, dtype=np.float64)
+    except ValueError:
+        return None
+
+
+def parse_run(lines, filename, numbers):
+    """Parses the data rows of one run in bulk. The S-parameter names are
+    turned into numbers ('S21' -> 21) so the whole run can be handed to
+    NumPy's text parser at once. numbers holds the file line number of
+    every row, for the error message.
+    """
+    if len(lines) == 0:
+        return np.empty((0, 6))
+    text = b','.join(lines).replace(b'S', b'')
+    try:
+        values = np.array(text.split(b','), dtype=np.float64)
+    except ValueError:
+        for i in range(0, len(lines)):  # only on failure, find the row NumPy choked on
+            if parse_row(lines[i]) is None:
+                raise Exception('Malformed row in {} line {}: {}'.format(
+                    filename, numbers[i], lines[i].decode('ascii', 'replace')))
+        raise
+    return values.reshape(-1, 6)
+
+
+def parse(filename):
+    with open(filename, 'rb') as file:
+        lines = file.read().replace(b'\r', b'').split(b'\n')
+    last = len(lines) - 1
+    while last >= 0 and len(lines[last]) == 0:
+        last = last - 1
+    runs = [[]]
+    numbers = [[]]
+    for i in range(0, last + 1):
+        line = lines[i]
+        if len(line) == 0 or line.startswith(b'measurement_type'):
+            continue
+        if line.startswith(b'null'):
+            runs.append([])
+            numbers.append([])
+            continue
+        line = line.rstrip(b',')
+        if i == last and parse_row(line) is None:
+            print('WARNING: dropped the incomplete last row of {} (line {})'.format(filename, i + 1))
+            continue
+        if line.count(b',') != 5:
+            raise Exception('Malformed row in {} line {}: {}'.format(filename, i + 1, line.decode('ascii', 'replace')))
+        runs[-1].append(line)
+        numbers[-1].append(i + 1)
+    if len(runs[-1]) == 0:
+        runs.pop()   # nothing after the last sentinel
+        numbers.pop()
+    tables = [parse_run(runs[i], filename, numbers[i]) for i in range(0, len(runs))]
+    run = np.concatenate([np.full(len(tables[i]), i, dtype=np.int32) for i in range(0, len(tables))] or
+                         [np.empty(0, dtype=np.int32)])
+    table = np.concatenate(tables or [np.empty((0, 6))])
+    codes = {11: 0, 21: 1, 12: 2, 22: 3}
+    s_param = np.zeros(len(table), dtype=np.uint8)
+    for number in codes:
+        s_param[table[:, 0] == number] = codes[number]
+    columns = {
+        'run': run,
+        's_param': s_param,
+        'freq': table[:, 1].copy(),
+        'theta': table[:, 2].copy(),
+        'phi': table[:, 3].copy(),
+        'magnitude': table[:, 4].copy(),
+        'phase': table[:, 5].copy(),
+    }
+    columns['order'] = np.lexsort((columns['phi'], columns['theta'], columns['freq'], columns['s_param'],
+                                   columns['run']))
+    return columns
+
+
+def load(filename, use_cache=True):
+    """Loads a legacy CSV measurement file into a measurement_table, from the
+    cache if it is still valid (same size and modification time).
+    """
+    stat = os.stat(filename)
+    stamp = np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    if use_cache:
+        try:
+            with np.load(cache_name(filename)) as cache:
+                if np.array_equal(cache['stamp'], stamp):
+                    return measurement_table({k: cache[k] for k in cache.files if k != 'stamp'})
+        except (OSError, KeyError, ValueError):
+            pass
+    columns = parse(filename)
+    if use_cache:
+        try:
+            with open(cache_name(filename), 'wb') as file:
+                np.savez(file, stamp=stamp, **columns)
+        except OSError:
+            pass  # read-only location, just don't cache
+    return measurement_table(columns)
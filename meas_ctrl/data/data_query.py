@@ -0,0 +1,193 @@
+################################################################################
+#
+#  Description:
+#      Query layer over binary (.mcb) measurement files. A sidecar index
+#      (<file>.idx) lists every committed chunk with its run, S-parameter,
+#      angles and byte offset, and keeps the chunks' frequency tables sorted,
+#      so a query such as "S21 at 2400 MHz for tilt 0" only reads the few
+#      bytes of each matching chunk that hold the requested frequencies.
+#      The index follows a file that is still being written: chunks appended
+#      since the index was saved are added on the next open. The index keeps
+#      the last bytes of the file it covers (the commit marker and CRC of the
+#      last chunk), a file rewritten below that point (a resume rolling back
+#      and appending again) no longer matches them and is indexed anew.
+#
+#      q = data_query('data\\run0.mcb')
+#      cut = q.select('S21', freq=2400, tilt=(0, 0))
+#      cut['phi'], cut['magnitude']
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import bisect
+import json
+import math
+import mmap
+import os
+from array import array
+import binary_storage
+
+INDEX_VERSION = 2
+TAIL_BYTES = binary_storage.COMMIT_MARKER.size  # bytes before index['size'] the index checks the file against
+
+
+def index_name(filename):
+    return filename + '.idx'
+
+
+class data_query:
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = None
+        self.refresh()
+
+    def refresh(self):
+        """Loads the sidecar index and brings it up to date with the file, the
+        index is rebuilt if the file no longer holds the data it was built
+        from (shrank, or was rolled back and grew again).
+        """
+        size = os.path.getsize(self.filename)
+        index = None
+        try:
+            with open(index_name(self.filename), 'r') as file:
+                index = json.load(file)
+            if index['version'] != INDEX_VERSION or index['size'] > size:
+                index = None
+            else:
+                with open(self.filename, 'rb') as file:
+                    file.seek(index['size'] - TAIL_BYTES)
+                    if file.read(TAIL_BYTES).hex() != index['tail']:
+                        index = None
+        except (OSError, ValueError, KeyError):
+            index = None
+        if index is not None and index['size'] == size:
+            self.index = index
+            return
+        with open(self.filename, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if index is None:
+                    [header, offset] = binary_storage.read_header(buffer)
+                    index = {'version': INDEX_VERSION, 'size': offset, 'raw': bool(header.get('raw')),
+                             'run': 0, 'tables': [], 'chunks': []}
+                    if index['raw']:
+                        index['tables'].append(sorted_table(header['freqs']))
+                self.scan(index, buffer)
+                index['tail'] = buffer[index['size'] - TAIL_BYTES:index['size']].hex()
+            finally:
+                buffer.close()
+        self.index = index
+        try:
+            with open(index_name(self.filename), 'w') as file:
+                json.dump(index, file)
+        except OSError:
+            pass  # read-only location, keep the index in memory
+
+    def scan(self, index, buffer):
+        for [tag, s_code, theta, phi, n, data_offset, next_offset] in binary_storage.chunks(buffer, index['size']):
+            if tag == binary_storage.END_RUN:
+                index['run'] = index['run'] + 1
+            else:
+                if tag == binary_storage.RAW:
+                    table = 0
+                else:
+                    freqs = binary_storage.column(buffer, data_offset, n).tolist()
+                    table = find_table(index['tables'], freqs)
+                index['chunks'].append([index['run'], s_code, theta, phi, n, data_offset, table])
+            index['size'] = next_offset
+
+    def frequencies(self):  # every frequency present in the file, sorted
+        freqs = set()
+        for table in self.index['tables']:
+            freqs.update(table['freqs'])
+        return sorted(freqs)
+
+    def select(self, s_param=None, freq=None, fmin=None, fmax=None, pan=None, tilt=None, run=None):
+        """Returns the matching points as a dict of columns ('run', 'theta',
+        'phi', 'freq', 'magnitude', 'phase'), in file order.
+            s_param:    'S11', 'S21', ... or None for all
+            freq:       nearest frequency to this value (MHz) in each chunk
+            fmin, fmax: frequency range in MHz, inclusive (ignored if freq is given)
+            pan, tilt:  (min, max) angle range in degrees, inclusive
+            run:        run number, None for all runs
+        """
+        result = {'run': array('I'), 'theta': array('d'), 'phi': array('d'), 'freq': array('d'),
+                  'magnitude': array('d'), 'phase': array('d')}
+        with open(self.filename, 'rb') as file:
+            for [c_run, s_code, theta, phi, n, data_offset, table] in self.index['chunks']:
+                if run is not None and c_run != run:
+                    continue
+                if s_param is not None and binary_storage.S_PARAMS[s_code] != s_param:
+                    continue
+                if pan is not None and not pan[0] <= phi <= pan[1]:
+                    continue
+                if tilt is not None and not tilt[0] <= theta <= tilt[1]:
+                    continue
+                positions = self.positions(self.index['tables'][table], freq, fmin, fmax)
+                for [start, stop] in spans(positions):
+                    [freqs, magnitude, phase] = self.read_span(file, n, data_offset, table, start, stop)
+                    count = stop - start
+                    result['run'].extend(array('I', [c_run]) * count)
+                    result['theta'].extend(array('d', [theta]) * count)
+                    result['phi'].extend(array('d', [phi]) * count)
+                    result['freq'].extend(freqs)
+                    result['magnitude'].extend(magnitude)
+                    result['phase'].extend(phase)
+        return result
+
+    def positions(self, table, freq, fmin, fmax):  # sorted positions of the wanted points within a chunk
+        freqs = table['freqs']
+        if freq is not None:
+            i = bisect.bisect_left(freqs, freq)
+            if i == len(freqs) or (i > 0 and freq - freqs[i - 1] <= freqs[i] - freq):
+                i = i - 1
+            wanted = [i]
+        else:
+            lo = 0 if fmin is None else bisect.bisect_left(freqs, fmin)
+            hi = len(freqs) if fmax is None else bisect.bisect_right(freqs, fmax)
+            wanted = range(lo, hi)
+        return sorted(table['order'][i] for i in wanted)
+
+    def read_span(self, file, n, data_offset, table, start, stop):
+        count = stop - start
+        if self.index['raw']:
+            file.seek(data_offset + binary_storage.RAW_TIMESTAMP.size + 8 * start)
+            [real, imag] = binary_storage.raw_column(file.read(8 * count), 0, count)
+            freqs = array('d', self.index['tables'][table]['plan'][start:stop])
+            magnitude = array('d', [20 * math.log10(math.hypot(re, im) + 1e-60) for re, im in zip(real, imag)])
+            phase = array('d', [math.degrees(math.atan2(im, re)) for re, im in zip(real, imag)])
+            return [freqs, magnitude, phase]
+        columns = []
+        for c in range(0, binary_storage.COLUMNS):
+            file.seek(data_offset + 8 * (c * n + start))
+            columns.append(binary_storage.column(file.read(8 * count), 0, count))
+        return columns
+
+
+def sorted_table(freqs):
+    """Frequency table of a chunk: 'plan' in stored order, 'freqs' sorted and
+    'order' mapping sorted positions back to stored positions.
+    """
+    order = sorted(range(0, len(freqs)), key=lambda i: freqs[i])
+    return {'plan': list(freqs), 'freqs': [freqs[i] for i in order], 'order': order}
+
+
+def find_table(tables, freqs):
+    for i in range(0, len(tables)):
+        if tables[i]['plan'] == freqs:
+            return i
+    tables.append(sorted_table(freqs))
+    return len(tables) - 1
+
+
+def spans(positions):  # groups sorted positions into contiguous [start, stop) reads
+    result = []
+    for p in positions:
+        if len(result) != 0 and result[-1][1] == p:
+            result[-1][1] = p + 1
+        else:
+            result.append([p, p + 1])
+    return result
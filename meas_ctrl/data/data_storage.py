@@ -1,17 +1,116 @@
+import json
+import os
+import binary_storage
+import data_writer
+
+
+# files ending in .mcb use the binary columnar format of binary_storage, anything else is CSV
 def append_data(filename, data):
+    if binary_storage.is_binary(filename) or isinstance(data, binary_storage.raw_trace):
+        binary_storage.append_data(filename, data)
+        return
     file = open(filename, 'a')
+    file.write(encode_data(filename, data))
+    file.close()
+
+
+# returns the records for data as they are stored in filename (bytes for binary files, text for CSV,
+# a list of buffers for a binary_storage.raw_trace)
+def encode_data(filename, data):
+    if isinstance(data, binary_storage.raw_trace):
+        if not binary_storage.is_binary(filename):
+            raise Exception('Raw traces can only be stored in binary (.mcb) files: {}'.format(filename))
+        return binary_storage.encode_raw(data)
+    if binary_storage.is_binary(filename):
+        return binary_storage.encode_data(data)
+    lines = []
     for i in range(0, len(data)):
-        file.write('%s,%d,%f,%f,%f,%f\n' % (
+        lines.append('%s,%d,%f,%f,%f,%f\n' % (
             data[i].measurement_type, 
             data[i].freq, 
             data[i].theta, 
             data[i].phi, 
             data[i].value_mag, 
             data[i].value_phase))
-    file.close()
+    return ''.join(lines)
 
 
-def create_file(filename):
-    file = open(filename, 'w')
-    file.write('measurement_type,freq,theta,phi,magnitude,phase,\n')
-    file.close()
+def encode_end_run(filename):
+    if binary_storage.is_binary(filename):
+        return binary_storage.encode_end_run()
+    return "null,null,null,null,null,null\n"
+
+
+# plan is the run configuration and freqs the frequency points, both kept in the header of binary files,
+# raw selects binary files holding the unconverted FORM2 traces
+def create_file(filename, plan=None, freqs=None, raw=False):
+    if binary_storage.is_binary(filename):
+        binary_storage.create_file(filename, plan, freqs, raw)
+    else:
+        file = open(filename, 'w')
+        file.write('measurement_type,freq,theta,phi,magnitude,phase,\n')
+        file.close()
+    clear_checkpoint(filename)
+
+
+def end_run(filename):
+    if binary_storage.is_binary(filename):
+        binary_storage.end_run(filename)
+        return
+    with open(filename, 'a') as file:
+        file.write(encode_end_run(filename))
+
+
+def open_writer(filename, max_bytes=65536, max_delay=1.0, fsync='commit'):
+    return data_writer.data_writer(filename, encode_data, encode_end_run, commit_checkpoint,
+                                   max_bytes, max_delay, fsync)
+
+
+# writer decoding and encoding traces of freqs in worker processes, see process_writer
+def open_process_writer(filename, freqs, raw=False, processes=2, slots=8, max_bytes=65536, max_delay=1.0,
+                        fsync='commit'):
+    import process_writer  # multiprocessing is only loaded when a pool is requested
+    return process_writer.process_writer(filename, freqs, raw, processes, slots, max_bytes, max_delay, fsync)
+
+
+def checkpoint_name(filename):
+    return filename + '.ckpt'
+
+
+# makes everything appended to filename so far durable, then atomically replaces the checkpoint
+# so that it records both the plan state and the length of the committed data. sync False (the
+# writer's fsync='never' policy) skips both fsyncs: the checkpoint still survives a crash of the
+# program, durability against a power loss is left to the OS
+def commit_checkpoint(filename, state, sync=True):
+    with open(filename, 'ab') as file:
+        if sync:
+            os.fsync(file.fileno())
+        state['offset'] = os.fstat(file.fileno()).st_size
+    temp = checkpoint_name(filename) + '.tmp'
+    with open(temp, 'w') as file:
+        json.dump(state, file)
+        file.flush()
+        if sync:
+            os.fsync(file.fileno())
+    os.replace(temp, checkpoint_name(filename))
+
+
+def load_checkpoint(filename):
+    try:
+        with open(checkpoint_name(filename), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# drops anything written after the last commit (e.g. half of an angle from an interrupted run)
+def rollback(filename, state):
+    with open(filename, 'rb+') as file:
+        file.truncate(state['offset'])
+
+
+def clear_checkpoint(filename):
+    try:
+        os.remove(checkpoint_name(filename))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,195 @@
+################################################################################
+#
+#  Description:
+#      Long-lived, buffered writer for measurement data. The acquisition loop
+#      only hands records over (append() is a queue put), a background thread
+#      formats them, batches them and writes them to a file that stays open
+#      for the whole run. A batch is flushed once it holds max_bytes, once its
+#      oldest record is max_delay seconds old, or at a commit. The fsync
+#      policy is one of:
+#          'never'   leave durability to the OS, checkpoints included
+#          'commit'  fsync at every commit() (checkpointed angles)
+#          'always'  fsync after every flush
+#      Write latency (hand-over to write) and queue depth are tracked so the
+#      cost of storage can be watched during a run.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import os
+import queue
+import time
+from threading import Lock, Thread
+
+_DATA = 0
+_END_RUN = 1
+_COMMIT = 2
+_CLOSE = 3
+
+
+class writer_metrics:
+    def __init__(self):
+        self.records = 0            # append() calls written out
+        self.bytes_written = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self.latency_total = 0      # seconds between append() and the write, summed over records
+        self.latency_max = 0
+        self.queue_depth = 0        # items waiting for the background thread
+        self.queue_depth_max = 0
+
+    def latency_mean(self):
+        if self.records == 0:
+            return 0
+        return self.latency_total / self.records
+
+    def summary(self):
+        return ('{} records, {} bytes in {} flushes ({} fsyncs), write latency mean {:.1f} ms / '
+                'max {:.1f} ms, queue depth max {}').format(
+            self.records, self.bytes_written, self.flushes, self.fsyncs, 1000 * self.latency_mean(),
+            1000 * self.latency_max, self.queue_depth_max)
+
+
+class data_writer:
+    def __init__(self, filename, encode_data, encode_end_run, commit_checkpoint,
+                 max_bytes=65536, max_delay=1.0, fsync='commit'):
+        if fsync not in ('never', 'commit', 'always'):
+            raise Exception('Invalid fsync policy: {}'.format(fsync))
+        self.filename = filename
+        self.encode_data = encode_data              # data_storage.encode_data
+        self.encode_end_run = encode_end_run        # data_storage.encode_end_run
+        self.commit_checkpoint = commit_checkpoint  # data_storage.commit_checkpoint
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.metrics = writer_metrics()
+        self.metrics_lock = Lock()
+        self.error = None
+        self.queue = queue.Queue()
+        self.pending = []           # [timestamp, record] batched but not yet written
+        self.pending_bytes = 0
+        self.thread = Thread(target=self.worker, name='data_writer', daemon=True)
+        self.thread.start()
+
+    def append(self, data):
+        self.check()
+        self.put(_DATA, data)
+
+    def end_run(self):
+        self.check()
+        self.put(_END_RUN, None)
+
+    def commit(self, state=None, wait=False):
+        """Flushes everything appended so far and, if state is given, writes
+        it as the checkpoint of the data once the data is on disk. Returns
+        immediately unless wait is set.
+        """
+        self.check()
+        done = queue.Queue()
+        self.put(_COMMIT, [state, done])
+        if wait:
+            done.get()
+            self.check()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.put(_CLOSE, None)
+            self.thread.join()
+        self.check()
+
+    def check(self):  # re-raises a failure of the background thread in the caller
+        if self.error is not None:
+            raise Exception('Writing {} failed: {}'.format(self.filename, self.error))
+
+    def put(self, kind, item):
+        with self.metrics_lock:
+            self.metrics.queue_depth = self.metrics.queue_depth + 1
+            self.metrics.queue_depth_max = max(self.metrics.queue_depth_max, self.metrics.queue_depth)
+        self.queue.put([kind, item, time.perf_counter()])
+
+    def worker(self):
+        mode = 'a'
+        if isinstance(self.encode_end_run(self.filename), bytes):
+            mode = 'ab'
+        file = open(self.filename, mode)
+        try:
+            while True:
+                timeout = None
+                if len(self.pending) != 0:
+                    timeout = max(0, self.pending[0][0] + self.max_delay - time.perf_counter())
+                try:
+                    [kind, item, stamp] = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    self.flush(file)
+                    continue
+                with self.metrics_lock:
+                    self.metrics.queue_depth = self.metrics.queue_depth - 1
+                if self.error is not None:
+                    if kind == _COMMIT:
+                        item[1].put(False)
+                    elif kind == _CLOSE:
+                        return
+                    continue
+                try:
+                    if kind == _DATA:
+                        self.buffer(file, stamp, self.encode_data(self.filename, item))
+                    elif kind == _END_RUN:
+                        self.buffer(file, stamp, self.encode_end_run(self.filename))
+                    elif kind == _COMMIT:
+                        self.flush(file, self.fsync != 'never')
+                        if item[0] is not None:
+                            self.commit_checkpoint(self.filename, item[0], self.fsync != 'never')
+                        item[1].put(True)
+                    else:
+                        self.flush(file)
+                        return
+                except Exception as err:
+                    self.error = err
+                    if kind == _COMMIT:
+                        item[1].put(False)
+        finally:
+            file.close()
+
+    def buffer(self, file, stamp, record):
+        if isinstance(record, list):  # raw traces come as a list of buffers
+            size = sum(len(part) for part in record)
+        else:
+            size = len(record)
+        self.pending.append([stamp, record])
+        self.pending_bytes = self.pending_bytes + size
+        if self.pending_bytes >= self.max_bytes:
+            self.flush(file)
+
+    def flush(self, file, sync=False):
+        if len(self.pending) != 0:
+            if isinstance(self.pending[0][1], str):
+                file.write(''.join([p[1] for p in self.pending]))
+            else:
+                parts = []
+                for p in self.pending:
+                    if isinstance(p[1], list):
+                        parts.extend(p[1])
+                    else:
+                        parts.append(p[1])
+                file.writelines(parts)
+            file.flush()
+            now = time.perf_counter()
+            with self.metrics_lock:
+                for p in self.pending:
+                    latency = now - p[0]
+                    self.metrics.records = self.metrics.records + 1
+                    self.metrics.latency_total = self.metrics.latency_total + latency
+                    self.metrics.latency_max = max(self.metrics.latency_max, latency)
+                self.metrics.bytes_written = self.metrics.bytes_written + self.pending_bytes
+                self.metrics.flushes = self.metrics.flushes + 1
+            self.pending = []
+            self.pending_bytes = 0
+            if self.fsync == 'always':
+                sync = True
+        if sync:
+            os.fsync(file.fileno())
+            with self.metrics_lock:
+                self.metrics.fsyncs = self.metrics.fsyncs + 1
@@ -0,0 +1,107 @@
+################################################################################
+#
+#  Description:
+#      Preallocated, memory-mapped pattern cube. A run is stored as a complex64
+#      array of shape [tilt, pan, S-param, freq] plus a bitmap with one bit per
+#      [tilt, pan, S-param] trace that is set once the trace has been written.
+#      The acquisition writes every trace straight into the mapping, any other
+#      reader (GUI, analysis) can open the same cube read-only while the run
+#      is still going and slice it at random without loading the whole file.
+#
+#      A cube named 'data\run0' consists of:
+#          run0.cube.npy   complex64 [tilt, pan, S-param, freq]
+#          run0.valid.npy  uint8 bitmap, bit i of byte i // 8 is trace i
+#          run0.axes.json  tilt, pan, S-param and frequency axes
+#
+#  Status:
+#
+#
+#  Dependencies:
+#      NumPy
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import json
+import numpy as np
+
+
+def file_names(name):
+    return [name + '.cube.npy', name + '.valid.npy', name + '.axes.json']
+
+
+class pattern_cube:
+    def __init__(self, name, axes, cube, valid):
+        self.name = name
+        self.tilts = np.asarray(axes['tilt'], dtype=np.float64)
+        self.pans = np.asarray(axes['pan'], dtype=np.float64)
+        self.s_params = list(axes['s_param'])
+        self.freqs = np.asarray(axes['freq'], dtype=np.float64)
+        self.cube = cube      # np.memmap, [tilt, pan, S-param, freq]
+        self.valid = valid    # np.memmap, packed validity bits
+
+    def shape(self):
+        return self.cube.shape
+
+    def trace_number(self, tilt_index, pan_index, s_index):
+        return (tilt_index * len(self.pans) + pan_index) * len(self.s_params) + s_index
+
+    def nearest(self, axis, angle):  # grid index closest to a measured angle
+        return int(np.argmin(np.abs(axis - angle)))
+
+    def write_trace(self, tilt, pan, s_param, real, imag):
+        """Writes one trace, taken at the measured position (tilt, pan) in
+        degrees, into the grid point nearest to it and marks it valid.
+        """
+        t = self.nearest(self.tilts, tilt)
+        p = self.nearest(self.pans, pan)
+        s = self.s_params.index(s_param)
+        trace = self.cube[t, p, s]
+        trace.real = real
+        trace.imag = imag
+        n = self.trace_number(t, p, s)
+        self.valid[n // 8] = self.valid[n // 8] | (1 << (n % 8))   # data first, then its valid bit
+
+    def is_valid(self, tilt_index, pan_index, s_index):
+        n = self.trace_number(tilt_index, pan_index, s_index)
+        return bool(self.valid[n // 8] & (1 << (n % 8)))
+
+    def valid_mask(self):  # bool [tilt, pan, S-param]
+        count = len(self.tilts) * len(self.pans) * len(self.s_params)
+        bits = np.unpackbits(np.asarray(self.valid), bitorder='little')[:count]
+        return bits.reshape(len(self.tilts), len(self.pans), len(self.s_params)).astype(bool)
+
+    def cut(self, s_param, freq_index, tilt_index=None, pan_index=None):
+        """Pattern cut at one frequency: all pans at tilt_index, or all tilts
+        at pan_index. Returns [angles, values, valid], values are complex.
+        """
+        s = self.s_params.index(s_param)
+        mask = self.valid_mask()
+        if pan_index is None:
+            return [self.pans, np.array(self.cube[tilt_index, :, s, freq_index]), mask[tilt_index, :, s]]
+        return [self.tilts, np.array(self.cube[:, pan_index, s, freq_index]), mask[:, pan_index, s]]
+
+    def flush(self):
+        self.cube.flush()
+        self.valid.flush()
+
+
+def create(name, tilts, pans, s_params, freqs):
+    [cube_file, valid_file, axes_file] = file_names(name)
+    axes = {'tilt': list(tilts), 'pan': list(pans), 's_param': list(s_params), 'freq': list(freqs)}
+    with open(axes_file, 'w') as file:
+        json.dump(axes, file)
+    shape = (len(tilts), len(pans), len(s_params), len(freqs))
+    cube = np.lib.format.open_memmap(cube_file, mode='w+', dtype=np.complex64, shape=shape)
+    traces = len(tilts) * len(pans) * len(s_params)
+    valid = np.lib.format.open_memmap(valid_file, mode='w+', dtype=np.uint8, shape=((traces + 7) // 8,))
+    return pattern_cube(name, axes, cube, valid)
+
+
+def open_cube(name, mode='r'):  # 'r' for readers, 'r+' to continue writing (e.g. a resumed run)
+    [cube_file, valid_file, axes_file] = file_names(name)
+    with open(axes_file, 'r') as file:
+        axes = json.load(file)
+    cube = np.load(cube_file, mmap_mode=mode)
+    valid = np.load(valid_file, mmap_mode=mode)
+    return pattern_cube(name, axes, cube, valid)
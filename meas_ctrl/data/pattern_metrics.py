@@ -0,0 +1,302 @@
+################################################################################
+#
+#  Description:
+#      Antenna pattern metrics computed for every frequency of a cut in one
+#      batched NumPy pass: peak gain and its direction, half-power beamwidth,
+#      front-to-back ratio, first sidelobe level and null depth. The cut is
+#      handled as a [freq, angle] array of dB values, every metric is
+#      evaluated with array operations over all frequencies at once instead
+#      of looping over frequencies and angles.
+#
+#      Angles are refined below the angular resolution of the measurement:
+#      peaks, nulls and sidelobes by fitting a parabola through the sample
+#      and its two neighbours, the -3 dB points by linear interpolation
+#      between the samples either side of the crossing.
+#
+#      The result is a columnar table, a dict of equally long arrays with
+#      one entry per frequency:
+#          freq            MHz
+#          peak_gain       dB, interpolated maximum of the cut
+#          peak_angle      degrees
+#          hpbw            degrees between the -3 dB points around the peak
+#          front_to_back   dB, peak minus the value 180 degrees away
+#          sidelobe_level  dB relative to the peak (negative)
+#          sidelobe_angle  degrees
+#          null_depth      dB, peak minus the deepest point of the cut
+#          null_angle      degrees
+#      Metrics that do not exist for a cut (no -3 dB point inside the
+#      measured span, no sidelobe, front-to-back of a partial cut) are NaN.
+#
+#      A cut can be taken from a pattern cube or from the columns of a stored
+#      measurement (csv_loader or binary_storage.load).
+#
+#  Status:
+#      The dB values are those of the stored S-parameter, absolute gain needs
+#      the reference antenna correction applied first.
+#
+#  Dependencies:
+#      NumPy
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import sys
+import numpy as np
+
+S_PARAMS = ['S11', 'S21', 'S12', 'S22']  # codes match binary_storage.S_PARAMS
+COLUMNS = ['freq', 'peak_gain', 'peak_angle', 'hpbw', 'front_to_back', 'sidelobe_level', 'sidelobe_angle',
+           'null_depth', 'null_angle']
+
+
+def to_db(values):  # complex traces -> dB magnitude, as vna_comms.session.to_data computes it
+    return 20 * np.log10(np.abs(values) + 1e-60)
+
+
+def uniform_grid(angles, gain):
+    """Sorts the cut by angle and resamples it onto an evenly spaced grid
+    (measured angles jitter by a few hundredths of a degree). A full circle
+    whose last angle repeats the first one loses the duplicate. Returns
+    [start, step, gain, circular].
+    """
+    order = np.argsort(angles)
+    angles = angles[order]
+    gain = gain[:, order]
+    count = len(angles)
+    span = angles[-1] - angles[0]
+    step = span / (count - 1)
+    circular = span + step >= 360 - step / 2
+    if circular and span >= 360 - step / 2:
+        angles = angles[:-1]
+        gain = gain[:, :-1]
+        count = count - 1
+    if circular:
+        step = 360.0 / count
+    grid = angles[0] + step * np.arange(0, count)
+    upper = np.clip(np.searchsorted(angles, grid), 1, count - 1)
+    weight = (grid - angles[upper - 1]) / np.maximum(angles[upper] - angles[upper - 1], 1e-12)
+    weight = np.clip(weight, 0, 1)
+    gain = gain[:, upper - 1] * (1 - weight) + gain[:, upper] * weight
+    return [angles[0], step, gain, circular]
+
+
+def parabola(left, centre, right):
+    """Vertex of the parabola through three equally spaced samples, as
+    [offset in samples (-0.5..0.5), value]. Flat or missing neighbours give
+    the centre sample itself.
+    """
+    denominator = left - 2 * centre + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(denominator != 0, .5 * (left - right) / denominator, 0)
+    offset = np.clip(np.nan_to_num(offset), -.5, .5)
+    return [offset, centre - .25 * (left - right) * offset]
+
+
+def around(gain, centre, circular):
+    """Samples of every row reordered by distance from its centre index,
+    as [right, left], both [freq, distance] with distance 0 the centre
+    itself. Samples outside a partial cut are NaN.
+    """
+    count = gain.shape[1]
+    rows = np.arange(0, gain.shape[0])[:, None]
+    if circular:
+        distance = np.arange(0, count // 2 + 1)
+    else:
+        distance = np.arange(0, count)
+    padded = np.concatenate([gain, np.full((gain.shape[0], 1), np.nan)], axis=1)
+    sides = []
+    for direction in [1, -1]:
+        index = centre[:, None] + direction * distance[None, :]
+        if circular:
+            index = index % count
+        else:
+            index = np.where((index < 0) | (index >= count), count, index)   # count is the NaN column
+        sides.append(padded[rows, index])
+    return sides
+
+
+def first(mask):  # index of the first True of every row, -1 where there is none
+    return np.where(mask.any(axis=1), np.argmax(mask, axis=1), -1)
+
+
+def crossing(side, level):
+    """Distance in samples, interpolated, at which every row first drops
+    below its level. NaN where it never does.
+    """
+    index = first(side[:, 1:] < level[:, None]) + 1
+    rows = np.arange(0, side.shape[0])
+    inside = side[rows, index - 1]
+    outside = side[rows, index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = (inside - level) / (inside - outside)
+    return np.where(index > 0, index - 1 + fraction, np.nan)
+
+
+def first_sidelobe(side):
+    """Level and interpolated distance of the first local maximum beyond the
+    first null (first local minimum) of every row, NaN where there is none.
+    """
+    rows = np.arange(0, side.shape[0])
+    previous = side[:, :-2]
+    centre = side[:, 1:-1]
+    following = side[:, 2:]
+    minimum = (centre <= previous) & (centre < following)
+    maximum = (centre >= previous) & (centre > following)
+    null = first(minimum)
+    beyond = np.arange(0, centre.shape[1])[None, :] > null[:, None]
+    lobe = first(maximum & beyond & (null >= 0)[:, None])
+    index = np.maximum(lobe, 0)
+    [offset, level] = parabola(previous[rows, index], centre[rows, index], following[rows, index])
+    found = lobe >= 0
+    return [np.where(found, level, np.nan), np.where(found, index + 1 + offset, np.nan)]
+
+
+def cut_metrics(freqs, angles, gain):
+    """Metrics of a pattern cut. freqs in MHz, angles in degrees (any order,
+    roughly evenly spaced), gain in dB as a [freq, angle] array. Returns the
+    columnar table described at the top of the file.
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    [start, step, gain, circular] = uniform_grid(np.asarray(angles, dtype=np.float64),
+                                                 np.atleast_2d(np.asarray(gain, dtype=np.float64)))
+    count = gain.shape[1]
+    rows = np.arange(0, gain.shape[0])
+
+    def neighbours(index):
+        if circular:
+            return [gain[rows, (index - 1) % count], gain[rows, index], gain[rows, (index + 1) % count]]
+        centre = gain[rows, index]
+        left = np.where(index > 0, gain[rows, np.maximum(index - 1, 0)], centre)
+        right = np.where(index < count - 1, gain[rows, np.minimum(index + 1, count - 1)], centre)
+        return [left, centre, right]
+
+    def angle_of(position):
+        angle = start + position * step
+        if circular:
+            angle = (angle + 180) % 360 - 180
+        return angle
+
+    peak = np.argmax(gain, axis=1)
+    [peak_offset, peak_gain] = parabola(*neighbours(peak))
+    peak_angle = angle_of(peak + peak_offset)
+
+    [right, left] = around(gain, peak, circular)
+    level = peak_gain - 3
+    hpbw = (crossing(right, level) + crossing(left, level)) * step
+
+    [right_level, right_distance] = first_sidelobe(right)
+    [left_level, left_distance] = first_sidelobe(left)
+    use_right = np.nan_to_num(right_level, nan=-np.inf) >= np.nan_to_num(left_level, nan=-np.inf)
+    sidelobe_level = np.where(use_right, right_level, left_level) - peak_gain
+    sidelobe_angle = angle_of(peak + np.where(use_right, right_distance, -left_distance))
+
+    null = np.argmin(gain, axis=1)
+    [null_offset, null_gain] = parabola(*neighbours(null))
+    null_depth = peak_gain - null_gain
+    null_angle = angle_of(null + null_offset)
+
+    if circular:
+        position = (peak + peak_offset + count / 2.0) % count
+        lower = np.floor(position).astype(np.int64)
+        fraction = position - lower
+        back = gain[rows, lower % count] * (1 - fraction) + gain[rows, (lower + 1) % count] * fraction
+        front_to_back = peak_gain - back
+    else:
+        front_to_back = np.full(len(rows), np.nan)
+
+    return {
+        'freq': freqs,
+        'peak_gain': peak_gain,
+        'peak_angle': peak_angle,
+        'hpbw': hpbw,
+        'front_to_back': front_to_back,
+        'sidelobe_level': sidelobe_level,
+        'sidelobe_angle': sidelobe_angle,
+        'null_depth': null_depth,
+        'null_angle': null_angle,
+    }
+
+
+def cube_cut(cube, s_param='S21', tilt_index=None, pan_index=None):
+    """[freqs, angles, gain] of a pattern cube cut over all frequencies: all
+    pans at tilt_index or all tilts at pan_index. A cube with a single tilt
+    (or pan) needs no index. Traces that were never written are left out.
+    """
+    if tilt_index is None and pan_index is None:
+        if len(cube.tilts) == 1:
+            tilt_index = 0
+        else:
+            pan_index = 0
+    s = cube.s_params.index(s_param)
+    mask = cube.valid_mask()
+    if pan_index is None:
+        [angles, traces, valid] = [cube.pans, cube.cube[tilt_index, :, s, :], mask[tilt_index, :, s]]
+    else:
+        [angles, traces, valid] = [cube.tilts, cube.cube[:, pan_index, s, :], mask[:, pan_index, s]]
+    return [cube.freqs, angles[valid], to_db(np.asarray(traces)[valid]).T]
+
+
+def stored_cut(columns, run=0, s_param='S21'):
+    """[freqs, angles, gain] of one run of a stored measurement, from the
+    columns of csv_loader (a measurement_table or parse()) or of
+    binary_storage.load. The cut runs along whichever of theta and phi
+    varies; angles not measured at every frequency are left out.
+    """
+    def column(name):
+        if isinstance(columns, dict):
+            return np.asarray(columns[name])
+        return np.asarray(getattr(columns, name))
+
+    rows = (column('run') == run) & (column('s_param') == S_PARAMS.index(s_param))
+    theta = column('theta')[rows]
+    phi = column('phi')[rows]
+    if not rows.any():
+        raise Exception('No {} data in run {}'.format(s_param, run))
+    if np.ptp(phi) >= np.ptp(theta):
+        angle = phi
+    else:
+        angle = theta
+    freq = column('freq')[rows]
+    magnitude = column('magnitude')[rows]
+    freqs = np.unique(freq)
+    angles = np.unique(np.round(angle, 3))
+    gain = np.full((len(freqs), len(angles)), np.nan)
+    gain[np.searchsorted(freqs, freq), np.searchsorted(angles, np.round(angle, 3))] = magnitude
+    complete = ~np.isnan(gain).any(axis=0)
+    return [freqs, angles[complete], gain[:, complete]]
+
+
+def format_table(metrics):
+    lines = ['{:>12}{:>11}{:>11}{:>9}{:>9}{:>10}{:>10}{:>9}{:>10}'.format(
+        'freq (MHz)', 'peak (dB)', 'at (deg)', 'hpbw', 'f/b (dB)', 'sll (dB)', 'at (deg)', 'null', 'at (deg)')]
+    for i in range(0, len(metrics['freq'])):
+        lines.append('{:>12.3f}{:>11.2f}{:>11.2f}{:>9.2f}{:>9.2f}{:>10.2f}{:>10.2f}{:>9.2f}{:>10.2f}'.format(
+            *[metrics[c][i] for c in COLUMNS]))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print('usage: pattern_metrics.py data.csv|data.mcb|cube_name [S21] [run]')
+        return 1
+    s_param = 'S21'
+    if len(argv) > 2:
+        s_param = argv[2]
+    run = 0
+    if len(argv) > 3:
+        run = int(argv[3])
+    name = argv[1]
+    if name.endswith('.csv'):
+        import csv_loader
+        cut = stored_cut(csv_loader.load(name), run, s_param)
+    elif name.endswith('.mcb'):
+        import binary_storage
+        cut = stored_cut(binary_storage.load(name)[1], run, s_param)
+    else:
+        import pattern_cube
+        cut = cube_cut(pattern_cube.open_cube(name), s_param)
+    print(format_table(cut_metrics(*cut)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,257 @@
+################################################################################
+#
+#  Description:
+#      Storage writer that moves trace decoding and record encoding out of
+#      the acquisition process. append_trace() copies the FORM2 payload of a
+#      trace into a slot of a shared memory ring and queues a small task, a
+#      pool of worker processes decodes the payload, derives the magnitude
+#      and phase columns and encodes the records in the format of the data
+#      file. A sequencer process puts the encoded records (and the end of
+#      run and commit markers the acquisition queued in between) back into
+#      the order they were handed over in and writes them through a
+#      data_writer, with its batching, fsync policy and checkpoints.
+#
+#      Back-pressure: a slot is returned once a worker has taken its trace,
+#      if every slot is in flight append_trace() waits for one, so no more
+#      than slots + processes traces are ever waiting to be encoded. The
+#      number of such waits is reported with the storage metrics.
+#
+#  Status:
+#      Records appended with append() (already decoded data) are encoded in
+#      the acquisition process and only ordered and written by the pool.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+import binary_storage
+import data_storage
+import data_writer
+import vna_comms
+
+_DATA = 0
+_END_RUN = 1
+_COMMIT = 2
+_CLOSE = 3
+_ERROR = 4
+
+SLOT_WAIT = 1.0   # seconds between checks that the pool is still alive while waiting for a slot
+
+
+class pool_metrics(data_writer.writer_metrics):
+    def __init__(self):
+        super().__init__()
+        self.stalls = 0             # append_trace() calls that had to wait for a free slot
+
+    def summary(self):
+        return '{}, {} back-pressure stalls'.format(super().summary(), self.stalls)
+
+
+def encode_trace(filename, freqs, raw, task, payload):
+    [seq, slot, s_param, theta, phi, timestamp, size] = task
+    if raw == True:
+        return data_storage.encode_data(filename, binary_storage.raw_trace(s_param, theta, phi, timestamp, payload))
+    [real, imag] = vna_comms.decode_trace(payload)
+    return data_storage.encode_data(filename, vna_comms.trace_data(freqs, real, imag, theta, phi, s_param))
+
+
+def worker(shm_name, slot_size, tasks, results, free, filename, freqs, raw):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            [seq, slot, size] = [task[0], task[1], task[6]]
+            try:
+                payload = bytes(shm.buf[slot * slot_size:slot * slot_size + size])
+                free.put(slot)
+                results.put([seq, _DATA, encode_trace(filename, freqs, raw, task, payload)])
+            except Exception as err:
+                results.put([seq, _ERROR, str(err)])
+    finally:
+        shm.close()
+
+
+def passthrough(filename, record):  # the records reach the sequencer already encoded
+    return record
+
+
+def sequencer(filename, results, acks, max_bytes, max_delay, fsync):
+    writer = data_writer.data_writer(filename, passthrough, data_storage.encode_end_run,
+                                     data_storage.commit_checkpoint, max_bytes, max_delay, fsync)
+    pending = {}
+    next_seq = 0
+    error = None
+    while True:
+        [seq, kind, item] = results.get()
+        pending[seq] = [kind, item]
+        while next_seq in pending:
+            [kind, item] = pending.pop(next_seq)
+            next_seq = next_seq + 1
+            if kind == _CLOSE:
+                try:
+                    writer.close()
+                except Exception as err:
+                    if error is None:
+                        acks.put([_ERROR, str(err)])
+                acks.put([_CLOSE, vars(writer.metrics)])
+                return
+            if error is not None:
+                if kind == _COMMIT and item[1]:
+                    acks.put([_COMMIT, seq])
+                continue
+            try:
+                if kind == _DATA:
+                    writer.append(item)
+                elif kind == _END_RUN:
+                    writer.end_run()
+                elif kind == _COMMIT:
+                    writer.commit(item[0], item[1])
+                    if item[1]:
+                        acks.put([_COMMIT, seq])
+                else:
+                    raise Exception(item)
+            except Exception as err:
+                error = err
+                acks.put([_ERROR, str(err)])
+                if kind == _COMMIT and item[1]:
+                    acks.put([_COMMIT, seq])
+
+
+class process_writer:
+    def __init__(self, filename, freqs, raw=False, processes=2, slots=8,
+                 max_bytes=65536, max_delay=1.0, fsync='commit'):
+        """Writer for traces of len(freqs) points, processes workers share
+        slots trace buffers.
+        """
+        if fsync not in ('never', 'commit', 'always'):
+            raise Exception('Invalid fsync policy: {}'.format(fsync))
+        self.filename = filename
+        self.slot_size = 8 * len(freqs)
+        self.slots = slots
+        self.metrics = pool_metrics()
+        self.error = None
+        self.seq = 0
+        self.acked = set()          # sequence numbers of acknowledged commits
+        self.closed = None          # sequencer metrics once it has shut down
+
+        context = multiprocessing.get_context()
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, slots * self.slot_size))
+        self.free = context.Queue()
+        for i in range(0, slots):
+            self.free.put(i)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.acks = context.Queue()
+        self.workers = []
+        for i in range(0, processes):
+            p = context.Process(target=worker, name='process_writer.worker', daemon=True,
+                                args=(self.shm.name, self.slot_size, self.tasks, self.results, self.free,
+                                      filename, list(freqs), raw))
+            p.start()
+            self.workers.append(p)
+        self.sequencer = context.Process(target=sequencer, name='process_writer.sequencer', daemon=True,
+                                         args=(filename, self.results, self.acks, max_bytes, max_delay, fsync))
+        self.sequencer.start()
+
+    def append_trace(self, s_param, theta, phi, timestamp, payload):
+        """Hands a FORM2 payload (see vna_comms.session.get_raw) over to the
+        pool. Blocks while every slot is in flight.
+        """
+        self.check()
+        size = len(payload)
+        if size > self.slot_size:
+            raise Exception('Trace of {} bytes does not fit the {} byte slots of {}'.format(
+                size, self.slot_size, self.filename))
+        slot = self.take_slot()
+        self.shm.buf[slot * self.slot_size:slot * self.slot_size + size] = payload
+        self.tasks.put([self.next_seq(), slot, s_param, theta, phi, timestamp, size])
+
+    def append(self, data):
+        self.check()
+        self.results.put([self.next_seq(), _DATA, data_storage.encode_data(self.filename, data)])
+
+    def end_run(self):
+        self.check()
+        self.results.put([self.next_seq(), _END_RUN, None])
+
+    def commit(self, state=None, wait=False):  # like data_writer.commit, in order with the traces before it
+        self.check()
+        seq = self.next_seq()
+        self.results.put([seq, _COMMIT, [state, wait]])
+        if wait:
+            while seq not in self.acked:
+                self.receive(SLOT_WAIT)
+            self.acked.discard(seq)
+            self.check()
+
+    def close(self):
+        if self.closed is None:
+            self.results.put([self.next_seq(), _CLOSE, None])
+            for p in self.workers:
+                self.tasks.put(None)
+            while self.closed is None and self.sequencer.is_alive():
+                self.receive(SLOT_WAIT)
+            self.receive(0)
+            for p in self.workers:
+                p.join()
+            self.sequencer.join()
+            self.shm.close()
+            self.shm.unlink()
+            if self.closed is None:
+                self.closed = {}
+                if self.error is None:
+                    self.error = 'the sequencer process exited'
+            for name in self.closed:
+                if name != 'queue_depth_max':
+                    setattr(self.metrics, name, self.closed[name])
+        self.check()
+
+    def check(self):  # re-raises a failure of the pool in the caller
+        self.receive(0)
+        if self.error is not None:
+            raise Exception('Writing {} failed: {}'.format(self.filename, self.error))
+
+    def next_seq(self):
+        seq = self.seq
+        self.seq = self.seq + 1
+        return seq
+
+    def take_slot(self):
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.metrics.stalls = self.metrics.stalls + 1
+            while True:
+                try:
+                    slot = self.free.get(timeout=SLOT_WAIT)
+                    break
+                except queue.Empty:
+                    self.check()
+                    if not all(p.is_alive() for p in self.workers):
+                        raise Exception('Writing {} failed: a worker process exited'.format(self.filename))
+        try:  # slots in flight, qsize() is not available on every platform
+            self.metrics.queue_depth = self.slots - self.free.qsize()
+            self.metrics.queue_depth_max = max(self.metrics.queue_depth_max, self.metrics.queue_depth)
+        except NotImplementedError:
+            pass
+        return slot
+
+    def receive(self, timeout):  # handles the acknowledgements of the sequencer
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                [kind, item] = self.acks.get(timeout=max(0, deadline - time.perf_counter()))
+            except queue.Empty:
+                return
+            if kind == _ERROR and self.error is None:
+                self.error = item
+            elif kind == _COMMIT:
+                self.acked.add(item)
+            elif kind == _CLOSE:
+                self.closed = item
+            deadline = time.perf_counter()  # drain what is there without waiting again
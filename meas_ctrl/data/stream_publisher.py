@@ -0,0 +1,194 @@
+################################################################################
+#
+#  Description:
+#      Local publish channel for live measurement results. Every completed
+#      angle is sent to all connected subscribers as one binary columnar
+#      record (the chunk encoding of binary_storage) framed with a sequence
+#      number. Subscribers connect over a Unix domain socket, or a localhost
+#      TCP port where Unix sockets are not available (Windows).
+#
+#          frame = 'MCST', sequence (u64), length (u32), chunk (length bytes)
+#
+#      Each subscriber has a bounded queue served by its own sender thread.
+#      publish() never blocks: when a subscriber falls more than max_queue
+#      records behind, its oldest records are dropped and it sees a gap in
+#      the sequence numbers, so a slow consumer can never stall the
+#      acquisition loop or the other subscribers.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import os
+import queue
+import socket
+import struct
+from threading import Lock, Thread
+import binary_storage
+
+FRAME = struct.Struct('<4sQI')
+FRAME_MAGIC = b'MCST'
+
+
+class subscription:
+    def __init__(self, conn, max_queue):
+        self.conn = conn
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.alive = True
+
+
+class stream_publisher:
+    def __init__(self, address, max_queue=64):
+        """address is a filesystem path for a Unix socket or a port number for
+        a localhost TCP socket.
+        """
+        self.address = address
+        self.max_queue = max_queue
+        self.sequence = 0
+        self.subscribers = []
+        self.lock = Lock()
+        if isinstance(address, int):
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind(('127.0.0.1', address))
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(address)
+        self.server.listen()
+        self.running = True
+        self.thread = Thread(target=self.accept, name='stream_publisher', daemon=True)
+        self.thread.start()
+
+    def accept(self):
+        while self.running:
+            try:
+                conn, addr = self.server.accept()
+            except OSError:
+                return  # server socket closed
+            sub = subscription(conn, self.max_queue)
+            with self.lock:
+                self.subscribers.append(sub)
+            Thread(target=self.send, args=(sub,), name='stream_subscriber', daemon=True).start()
+
+    def send(self, sub):
+        while sub.alive:
+            frame = sub.queue.get()
+            if frame is None:
+                break
+            try:
+                sub.conn.sendall(frame)
+            except OSError:
+                break
+        sub.alive = False
+        sub.conn.close()
+        with self.lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+
+    def publish_chunk(self, chunk):
+        with self.lock:
+            self.sequence = self.sequence + 1
+            frame = FRAME.pack(FRAME_MAGIC, self.sequence, len(chunk)) + chunk
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            while True:
+                try:
+                    sub.queue.put_nowait(frame)
+                    break
+                except queue.Full:
+                    try:
+                        sub.queue.get_nowait()  # drop the oldest, the subscriber sees the gap
+                        sub.dropped = sub.dropped + 1
+                    except queue.Empty:
+                        pass
+        return self.sequence
+
+    def publish(self, data):  # data is a list of vna_comms.data or a binary_storage.raw_trace
+        if isinstance(data, binary_storage.raw_trace):
+            return self.publish_chunk(b''.join(binary_storage.encode_raw(data)))
+        return self.publish_chunk(binary_storage.encode_data(data))
+
+    def end_run(self):
+        return self.publish_chunk(binary_storage.encode_end_run())
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def close(self):
+        self.running = False
+        self.server.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            sub.alive = False
+            try:
+                sub.queue.put_nowait(None)
+            except queue.Full:
+                sub.conn.close()
+        if not isinstance(self.address, int) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class stream_subscriber:
+    """Client side of the channel. records() yields [sequence, gap, chunk]
+    where gap is the number of records lost before this one and chunk is
+    [tag, s_param, theta, phi, columns] with columns a dict of arrays
+    ('freq', 'magnitude', 'phase' or 'real', 'imag').
+    """
+    def __init__(self, address):
+        if isinstance(address, int):
+            self.conn = socket.create_connection(('127.0.0.1', address))
+        else:
+            self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.conn.connect(address)
+        self.last = None
+
+    def read_exact(self, n):
+        parts = []
+        while n > 0:
+            part = self.conn.recv(n)
+            if len(part) == 0:
+                return None
+            parts.append(part)
+            n = n - len(part)
+        return b''.join(parts)
+
+    def records(self):
+        while True:
+            head = self.read_exact(FRAME.size)
+            if head is None:
+                return
+            magic, sequence, length = FRAME.unpack(head)
+            if magic != FRAME_MAGIC:
+                raise Exception('Lost framing on the measurement stream')
+            chunk = self.read_exact(length)
+            if chunk is None:
+                return
+            gap = 0
+            if self.last is not None:
+                gap = sequence - self.last - 1
+            self.last = sequence
+            yield [sequence, gap, decode_chunk(chunk)]
+
+    def close(self):
+        self.conn.close()
+
+
+def decode_chunk(chunk):
+    for [tag, s_code, theta, phi, n, data_offset, next_offset] in binary_storage.chunks(memoryview(chunk), 0):
+        columns = {}
+        if tag == binary_storage.RAW:
+            [columns['real'], columns['imag']] = binary_storage.raw_column(
+                chunk, data_offset + binary_storage.RAW_TIMESTAMP.size, n)
+        elif tag == binary_storage.CHUNK:
+            columns['freq'] = binary_storage.column(chunk, data_offset, n)
+            columns['magnitude'] = binary_storage.column(chunk, data_offset + 8 * n, n)
+            columns['phase'] = binary_storage.column(chunk, data_offset + 16 * n, n)
+        return [tag, binary_storage.S_PARAMS[s_code], theta, phi, columns]
+    raise Exception('Corrupt record on the measurement stream')
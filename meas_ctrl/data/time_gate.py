@@ -0,0 +1,137 @@
+################################################################################
+#
+#  Description:
+#      Time-domain gating of linear frequency sweeps. A batch of traces,
+#      handled as a complex [trace, freq] array, is Kaiser windowed and
+#      transformed to the time domain (band-pass mode) with one zero-padded
+#      IFFT along the frequency axis, multiplied by the gate and transformed
+#      back with one FFT. Chamber reflections arriving outside the gate are
+#      removed from every trace of the batch in the same pass.
+#
+#      The gated traces are normalized by the response of an ideal impulse
+#      at the gate centre through the same window and gate, so a response
+#      inside the gate keeps its level and the window taper is undone.
+#
+#      gate_stage gates traces while a run is recorded and writes them to a
+#      derived pattern cube (the S21 gated copy of the run), buffering
+#      traces so the transforms run in batches. gate_cube gates a whole
+#      stored cube at once.
+#
+#      usage: time_gate.py cube_name start_ns stop_ns [beta] [pad]
+#
+#  Status:
+#      Time resolution is 1 / span, the alias-free range 1 / step of the
+#      frequency plan. A gate that cuts into the main response also removes
+#      part of it, the gate should be at least a few resolution cells wide.
+#
+#  Dependencies:
+#      NumPy
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import math
+import sys
+import numpy as np
+import pattern_cube
+
+BETA = 6.0    # Kaiser window shape, 0 is rectangular
+PAD = 4       # time-domain interpolation factor (zero padding of the IFFT)
+BATCH = 16    # traces per transform while a run is recorded
+
+
+class time_gate:
+    def __init__(self, freqs, start, stop, beta=BETA, pad=PAD):
+        """Gate keeping the response between start and stop (ns) of traces
+        taken at freqs (MHz, evenly spaced).
+        """
+        freqs = np.asarray(freqs, dtype=np.float64)
+        if len(freqs) < 2:
+            raise Exception('Time gating needs at least 2 frequency points')
+        self.points = len(freqs)
+        self.size = 2 ** int(math.ceil(math.log2(self.points * pad)))
+        step = (freqs[-1] - freqs[0]) / (self.points - 1)
+        self.times = np.fft.fftfreq(self.size, d=step) * 1000   # ns of every time-domain sample
+        self.start = start
+        self.stop = stop
+        self.window = np.kaiser(self.points, beta)
+        self.gate = ((self.times >= start) & (self.times <= stop)).astype(np.float64)
+
+        centre = (start + stop) / 2.0   # the same gate around t = 0, for the response of an ideal impulse
+        shape = ((self.times >= start - centre) & (self.times <= stop - centre)).astype(np.float64)
+        self.norm = np.fft.fft(np.fft.ifft(self.window, n=self.size) * shape)[:self.points]
+
+    def time_domain(self, traces):  # [trace, time] complex response, on the axis of self.times
+        return np.fft.ifft(np.asarray(traces) * self.window, n=self.size, axis=-1)
+
+    def apply(self, traces):  # gated copy of traces ([trace, freq] or one trace), complex
+        gated = np.fft.fft(self.time_domain(traces) * self.gate, axis=-1)[..., :self.points]
+        return gated / self.norm
+
+
+class gate_stage:
+    """Gates recorded S21 traces and writes them to a derived cube, every
+    batch traces in one transform. flush() gates whatever is buffered, it
+    is called whenever the run's cube is flushed.
+    """
+    def __init__(self, gate, cube, batch=BATCH):
+        self.gate = gate
+        self.cube = cube
+        self.batch = batch
+        self.positions = []
+        self.traces = np.empty((batch, gate.points), dtype=np.complex128)
+
+    def add(self, tilt, pan, real, imag):
+        n = len(self.positions)
+        self.traces[n].real = real
+        self.traces[n].imag = imag
+        self.positions.append([tilt, pan])
+        if len(self.positions) == self.batch:
+            self.flush()
+
+    def flush(self):
+        if len(self.positions) != 0:
+            gated = self.gate.apply(self.traces[:len(self.positions)])
+            for i in range(0, len(self.positions)):
+                [tilt, pan] = self.positions[i]
+                self.cube.write_trace(tilt, pan, 'S21', gated[i].real, gated[i].imag)
+            self.positions = []
+        self.cube.flush()
+
+
+def gated_name(name):  # derived cube of a cube (or data file stem) name
+    return name + '_gated'
+
+
+def gate_cube(source, name, start, stop, beta=BETA, pad=PAD):
+    """Gates the S21 traces of the cube source into a new cube name, all
+    traces in one transform. Returns the new cube.
+    """
+    s = source.s_params.index('S21')
+    gate = time_gate(source.freqs, start, stop, beta, pad)
+    cube = pattern_cube.create(name, source.tilts, source.pans, ['S21'], source.freqs)
+    traces = np.asarray(source.cube[:, :, s, :]).reshape(-1, gate.points)
+    cube.cube[:, :, 0, :] = gate.apply(traces).reshape(len(source.tilts), len(source.pans), gate.points)
+    valid = source.valid_mask()[:, :, s].reshape(-1)
+    cube.valid[:] = np.packbits(valid, bitorder='little')
+    cube.flush()
+    return cube
+
+
+def main(argv):
+    if len(argv) < 4:
+        print('usage: time_gate.py cube_name start_ns stop_ns [beta] [pad]')
+        return 1
+    beta = BETA
+    if len(argv) > 4:
+        beta = float(argv[4])
+    pad = PAD
+    if len(argv) > 5:
+        pad = int(argv[5])
+    cube = gate_cube(pattern_cube.open_cube(argv[1]), gated_name(argv[1]), float(argv[2]), float(argv[3]), beta, pad)
+    print('Gated {} traces into {}'.format(len(cube.tilts) * len(cube.pans), cube.name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
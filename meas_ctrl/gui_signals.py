@@ -0,0 +1,25 @@
+################################################################################
+#
+#  Description:
+#      Qt signals of meas_ctrl for the GUI.
+#
+#  Status:
+#
+#
+#  Dependencies:
+#      PyQt5
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+from PyQt5 import QtCore as qtc
+
+
+class meas_ctrl_signals(qtc.QObject):
+    finished = qtc.pyqtSignal()
+    paused = qtc.pyqtSignal()
+    stopped = qtc.pyqtSignal()
+    progress = qtc.pyqtSignal(float)
+    current_pan = qtc.pyqtSignal(float)
+    current_tilt = qtc.pyqtSignal(float)
+    cal_verified = qtc.pyqtSignal(str, float, float, bool)  # source, age (h), S11 deviation (dB), accepted
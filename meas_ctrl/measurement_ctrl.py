@@ -15,142 +15,292 @@
 #
 ################################################################################
 import vna_comms
+import cal_store
+import vna_timing
+import list_plan
 import positioner
+import kinematics
+import noise_tuning
 from integer import Coordinate
 import data_storage
-from time import sleep
+import binary_storage
+import stream_publisher
+import acq_trace
+import run_control
+import ctrl_signals
+import visa_backend
+from time import time
 from threading import Lock, Thread
 import json
+import os
 import sys
-from PyQt5 import QtWidgets as qtw
-from PyQt5 import QtGui as qtg
-from PyQt5 import QtCore as qtc
 
 
-class meas_ctrl_signals(qtc.QObject):
-    finished = qtc.pyqtSignal()
-    paused = qtc.pyqtSignal()
-    stopped = qtc.pyqtSignal()
-    progress = qtc.pyqtSignal(float)
-    current_pan = qtc.pyqtSignal(float)
-    current_tilt = qtc.pyqtSignal(float)
+def __getattr__(name):  # meas_ctrl_signals lives in gui_signals now, importing it from here still works
+    if name == 'meas_ctrl_signals':
+        from gui_signals import meas_ctrl_signals
+        return meas_ctrl_signals
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 
 class meas_ctrl:
+    # signals: ctrl_signals.plain_signals() for headless use, Qt signals (imports PyQt5) by default
     def __init__(
             self,
             args,
-            data_file='data\\data0.csv'):
+            data_file='data\\data0.csv',
+            signals=None):
 
+        self.vna_resource = 'GPIB0::' + str(args['gpib_addr']) + '::INSTR'
+        self.qpt_resource = 'ASRL' + str(args['alias']) + '::INSTR'
+        self.vna = vna_comms.open_session(self.vna_resource)   # pooled, reused by later meas_ctrl objects
+        self.qpt = positioner.open_positioner(self.qpt_resource, args['baud_rate'])
+        self.vna_lock = Lock()
+        self.writer = None
+        self.publisher = None
+        self.bridge = None
+        self.token = run_control.cancel_token()
+        self.interrupted = None   # 'pause' or 'stop' once run() has been interrupted, 'error' once it failed
+        self.cal_reused = False   # True once setup() kept the instrument's calibration or recalled a cached one
+        self.pan = -1
+        self.tilt = -1
+        if signals is None:
+            signals = ctrl_signals.qt_signals()
+        self.signals = signals
+        self.configure(args, data_file)
+        self.update_position()
+
+    # applies a new configuration while keeping the open instrument sessions (and their calibration)
+    def configure(self, args, data_file):
+        self.args = args
         self.impedance = args['impedance']  # if true, S11 and S21 will be measured. Else, only S21
         if len(args['list']) != 0:          # list or vna_comms.lin_freq obj
             self.freq = args['list']
         else:
             self.freq = vna_comms.lin_freq(args['linear']['start'], args['linear']['end'], args['linear']['points'])
         self.cal = args['calibration'] # true or false
+        if self.cal == True and isinstance(self.freq, list) and len(list_plan.tables(self.freq)) > 1:
+            raise Exception('Calibration needs a frequency list that fits one VNA list table ({} segments, '
+                            '{} points), split the list over several runs or measure without calibration'.format(
+                                list_plan.MAX_SEGMENTS, list_plan.MAX_POINTS))
+        self.cal_dir = args.get('cal_dir', 'cal') # folder of the calibration cache, see cal_store
+        self.cal_max_age = args.get('cal_max_age', cal_store.MAX_AGE) # seconds a cached calibration is reused
+        self.cal_tolerance = args.get('cal_tolerance', cal_store.TOLERANCE) # dB S11 deviation a recalled cal may show
+        self.cal_registers = args.get('cal_registers', cal_store.REGISTERS) # VNA registers the cal cache may overwrite
+        self.dut = args.get('dut') # name of the DUT, cached calibrations are only recalled for the same DUT
         self.avg = args['averaging'] # e.g. 8, 16, etc.
+        self.if_bw = args.get('if_bw', 3700) # IF bandwidth in Hz
+        self.noise_target = args.get('noise_target') # trace noise in dB, if set setup() picks if_bw and averaging
+        self.noise_max_time = args.get('noise_max_time', noise_tuning.MAX_ANGLE_TIME) # seconds per angle at most
         self.sweep_mode = args['positioner_mv'] # either 'continuous' or 'step'
         self.offset = args['offset']['pan']       
         self.exe_mode = args['sweep_axis'] # 'pan' for pan sweep or 'tilt' for tilt sweep
         self.const_angle = args['fixed_angle'] # angle at which non-changing coordinate is set to
         self.resolution = args['resolution']
-        self.vna = vna_comms.session('GPIB0::' + str(args['gpib_addr']) + '::INSTR')
-        self.qpt = positioner.Positioner('ASRL' + str(args['alias']) + '::INSTR', args['baud_rate'])
         self.progress = 0 # percentage, e.g. 0.11 for 11%
         self.vna_avg_delay = 0
         self.vna_S11_delay = 0
         self.vna_S21_delay = 0
         self.pan_speed = 0
         self.tilt_speed = 0
-        self.vna_lock = Lock()
         self.file = data_file
-        self.pan = -1
-        self.tilt = -1
-        self.signals = meas_ctrl_signals()
-        self.update_position()
+        self.writer_opts = args.get('writer', {}) # max_bytes, max_delay (s), fsync policy, processes and slots of the data writer
+        self.s11_done = False
+        self.cube_name = args.get('cube') # path (without extension) of a pattern cube to fill, True to use data_file's
+        if self.cube_name == True:
+            self.cube_name = os.path.splitext(data_file)[0]
+        self.cube = None
+        self.gate = args.get('gate') # S21 time gate {'start': ns, 'stop': ns, 'beta', 'pad', 'batch'}, see time_gate
+        if self.gate is not None and isinstance(self.freq, list):
+            raise Exception('Time gating needs a linear frequency sweep')
+        self.gated = None # time_gate.gate_stage filling the gated copy of the run
+        self.raw = args.get('raw', False) # store the unconverted FORM2 traces, needs a binary (.mcb) data_file
+        if self.raw == True and not binary_storage.is_binary(data_file):
+            raise Exception('Raw trace storage needs a binary (.mcb) data file: {}'.format(data_file))
+        self.stream = args.get('stream') # Unix socket path or localhost port to publish every angle on
+        self.trace = args.get('trace') # Chrome trace (JSON) file to write the per-stage timing of the run to
 
+    # a setup that fails is closed like a failed run, see fail()
     def setup(self):
-        if self.exe_mode == 'pan':
-            self.qpt.move_to(-180+self.offset, self.const_angle, 'abs')
-        else:
-            self.qpt.move_to(self.offset+self.const_angle, -90, 'abs')
-        self.update_position()
+        try:
+            self.prepare()
+        except Exception:
+            self.fail()
+            raise
+
+    def prepare(self):
+        self.token.reset()
+        self.start_trace()
+        self.move_to_index(0)
 
         self.vna.reset()
-        data_storage.create_file(self.file)
-        
-        if self.cal == True:
-            self.vna.calibrate() # cal prompts have to be changed for GUI integration
-        
-        self.vna.setup(self.freq, self.avg, 3700)
+        data_storage.create_file(self.file, self.args, vna_comms.plan_frequencies(self.freq), self.raw)
+        self.open_writer()
+        self.open_publisher()
+        self.s11_done = False
+        self.cal_reused = False
+
+        if self.noise_target is not None:
+            self.tune_noise()
+        self.vna.setup(self.freq, self.avg, self.if_bw)
         [self.vna_avg_delay, self.vna_S11_delay, self.vna_S21_delay] = self.compute_vna_delay()
+        if self.cal == True:
+            self.cal_reused = self.vna.is_calibrated_for(self.freq, self.if_bw) or self.calibrate()
         
         if self.sweep_mode == 'continuous': # check if a continuous sweep is possible
             if self.exe_mode == 'pan':
                 total_time = (self.vna_avg_delay + self.vna_S21_delay) * 360 / self.resolution
-                if total_time > self.qpt.MAX_PAN_TIME:
+                if total_time > kinematics.MAX_PAN_TIME:
                     self.sweep_mode = 'step'
                     self.pan_speed = 0
                 else:
                     self.pan_speed = self.compute_pan_speed(total_time)
             else:
                 total_time = (self.vna_avg_delay + self.vna_S21_delay) * 180 / self.resolution
-                if total_time > self.qpt.MAX_TILT_TIME:
+                if total_time > kinematics.MAX_TILT_TIME:
                     self.sweep_mode = 'step'
                     self.tilt_speed = 0
                 else:
                     self.tilt_speed = self.compute_tilt_speed(total_time)
 
-    def run(self):
-        if self.impedance == True:
+        if self.cube_name is not None:
+            self.create_cube()
+        if self.gate is not None:
+            self.create_gated()
+
+    def resume(self):
+        state = data_storage.load_checkpoint(self.file)
+        if state is None:
+            raise Exception('There is no checkpoint to resume from for: {}'.format(self.file))
+        if state['config'] != self.args:
+            raise Exception('The checkpoint for {} was taken with a different configuration'.format(self.file))
+        try:
+            start = self.restore(state)
+        except Exception:
+            self.fail()   # the checkpoint is kept, resume() can be retried
+            raise
+        self.run(start)
+
+    def restore(self, state):  # reopens the run of the checkpoint state, returns the index to continue from
+        self.token.reset()
+        self.start_trace()
+        data_storage.rollback(self.file, state)
+        self.open_writer()
+        self.open_publisher()
+
+        # re-validate the instruments, the run may have died on a comms timeout or power loss
+        self.vna.identify()
+        self.qpt.update_positioner_stats()
+        if self.qpt.comms.connected is not True:
+            raise Exception('The positioner is not responding, unable to resume: {}'.format(self.file))
+        self.vna.reset()
+        self.vna.using_correction = state['calibrated'] # cal data survives reset(), only re-enable it
+        self.avg = state.get('averaging', self.avg) # as picked by tune_noise()
+        self.if_bw = state.get('if_bw', self.if_bw)
+        self.vna.setup(self.freq, self.avg, self.if_bw)
+        [self.vna_avg_delay, self.vna_S11_delay, self.vna_S21_delay] = self.compute_vna_delay()
+
+        # keep the sweep mode and speeds the run was started with so the dataset stays consistent
+        self.sweep_mode = state['sweep_mode']
+        self.pan_speed = state['pan_speed']
+        self.tilt_speed = state['tilt_speed']
+        self.s11_done = state['s11_done']
+        if self.cube_name is not None:
+            import pattern_cube # numpy is only needed when a cube is requested
+            self.cube = pattern_cube.open_cube(self.cube_name, 'r+')
+        if self.gate is not None:
+            import pattern_cube
+            self.open_gated(pattern_cube.open_cube(self.gated_name(), 'r+'))
+
+        start = state['next_index']
+        if self.sweep_mode == 'continuous' and start > 0:
+            self.move_to_index(start - 1) # continuous sweeps average on the way to the next angle
+        else:
+            self.move_to_index(start)
+        return start
+
+    def run(self, start=0):
+        self.interrupted = None
+        try:
+            self.sweep(start)
+        except run_control.run_interrupted as interruption:
+            self.interrupt(interruption.reason)
+            return
+        except Exception:
+            self.fail()
+            raise
+        self.writer.end_run()
+        self.close_writer()
+        if self.publisher is not None:
+            self.publisher.end_run()
+        self.flush_cubes()
+        data_storage.clear_checkpoint(self.file)
+        self.finish_trace()
+
+    def sweep(self, start):
+        self.commit(start)  # a run paused before its first angle can be resumed as well
+        if self.impedance == True and self.s11_done is not True:
             self.vna.rst_avg('S11')
-            sleep(self.vna_avg_delay)
+            with acq_trace.span('vna.avg_wait'):
+                self.wait(self.vna_avg_delay)
             self.record_data('S11', self.file)    # need to create_file prior
+            self.s11_done = True
+            self.commit(start)
 
         # Step Case
         if self.sweep_mode == 'step':
             # Pan Case
             if self.exe_mode == 'pan':
-                for i in range(0, int(360/self.resolution)):
+                for i in range(start, int(360/self.resolution)):
                     self.step_delay()
                     self.record_data('S21', self.file)
+                    self.commit(i+1)
                     self.progress = (i+1) * self.resolution / 360
-                    self.signals.progress.emit(self.progress)
+                    self.emit_progress()
                     if self.is_step_pan_complete() is True:
                         break
                     else:
                         target = ((i+1) * self.resolution) - 180
-                        self.qpt.move_to(target, self.const_angle, 'abs')
+                        self.qpt.move_to(target, self.const_angle, 'abs', self.token)
+                        self.token.check()
             # Tilt Case
             else:
-                for i in range(0, int(180/self.resolution)):
+                for i in range(start, int(180/self.resolution)):
                     self.step_delay()
                     self.record_data('S21', self.file)
+                    self.commit(i+1)
                     self.progress = (i+1) * self.resolution / 180
-                    self.signals.progress.emit(self.progress)
+                    self.emit_progress()
                     if self.is_step_tilt_complete() is True:
                         break
                     else:
                         target = ((i+1) * self.resolution) - 90
-                        self.qpt.move_to(self.const_angle, target, 'abs')
+                        self.qpt.move_to(self.const_angle, target, 'abs', self.token)
+                        self.token.check()
 
         # Continuous Case
+        # index 0 is recorded by init_continuous_sweep, loop iteration i records index i+1
         else:
+            if start == 0:
+                self.init_continuous_sweep()
+                self.commit(1)
+                start = 1
             # Pan Case
             if self.exe_mode == 'pan':
-                self.init_continuous_sweep()
-                for i in range(0, int(360/self.resolution)):
+                for i in range(start-1, int(360/self.resolution)):
                     lock = self.init_continuous_lock()
                     target = ((i+1) * self.resolution) - 180
                     self.update_position()
                     while lock.acquire(blocking=False) is not True:
                         while self.pan < target:
-                            sleep(.08)
+                            self.wait(.08)
                             self.qpt.jog_cw(self.pan_speed, Coordinate(180,0))
                             self.update_position()
+                    self.token.check()
                     self.record_data('S21', self.file)
+                    self.commit(i+2)
                     self.progress = (target + 180) / 360
-                    self.signals.progress.emit(self.progress)
+                    self.emit_progress()
                     if self.is_continuous_pan_complete() is True:
                         self.halt()
                         break
@@ -158,26 +308,167 @@ class meas_ctrl:
                         self.qpt.jog_cw(self.pan_speed, Coordinate(180,0))
             # Tilt Case
             else:
-                self.init_continuous_sweep()
-                for i in range(0, int(180/self.resolution)):
+                for i in range(start-1, int(180/self.resolution)):
                     lock = self.init_continuous_lock()
                     target = ((i+1) * self.resolution) - 90
                     self.update_position()
                     while lock.acquire(blocking=False) is not True:
                         while self.tilt < target:
-                            sleep(.08)
+                            self.wait(.08)
                             self.qpt.jog_up(self.tilt_speed, Coordinate(0,90))
                             self.update_position()
+                    self.token.check()
                     self.record_data('S21', self.file)
+                    self.commit(i+2)
                     self.progress = (target + 90) / 180
-                    self.signals.progress.emit(self.progress)
+                    self.emit_progress()
                     if self.is_continuous_tilt_complete() is True:
                         self.halt()
                         break
                     else:
                         self.qpt.jog_up(self.tilt_speed, Coordinate(0,90))
-        with open(self.file, 'a') as file:
-            file.write("null,null,null,null,null,null\n")
+
+    # callable from any thread, the run halts at its next wait (within one position poll or averaging wait)
+    def pause(self):
+        self.token.cancel('pause')
+
+    def stop(self):
+        self.token.cancel('stop')
+
+    def wait(self, seconds):
+        if self.token.wait(seconds):
+            raise run_control.run_interrupted(self.token.reason)
+
+    # a paused run keeps its checkpoint (every recorded angle is committed) and is continued with resume(),
+    # a stopped run is closed like a finished one. The output is closed even if the positioner cannot be
+    # halted (e.g. a dead link), the halt error is raised afterwards.
+    def interrupt(self, reason):
+        self.interrupted = reason
+        try:
+            self.halt()
+        finally:
+            self.close_interrupted(reason)
+
+    def close_interrupted(self, reason):
+        self.flush_cubes()
+        if reason == 'pause':
+            self.close_writer()
+            self.finish_trace()
+            self.signals.paused.emit()
+            return
+        self.writer.end_run()
+        self.close_writer()
+        if self.publisher is not None:
+            self.publisher.end_run()
+        data_storage.clear_checkpoint(self.file)
+        self.finish_trace()
+        self.signals.stopped.emit()
+
+    # a failed run (instrument or storage error) is closed like a paused one: the head is halted, the writer
+    # drains its queued commits and closes, the checkpoint is kept and resume() continues after the last
+    # committed angle. The stream is closed too, resume() reopens it. Every step is tried, their errors are
+    # reported, the error that ended the run is the one raised.
+    def fail(self):
+        self.interrupted = 'error'
+        for step in [self.halt, self.flush_cubes, self.close_writer, self.close_publisher, self.finish_trace]:
+            try:
+                step()
+            except Exception as err:
+                print('WARNING: closing the failed run of {}: {}'.format(self.file, err))
+
+    # commits everything recorded so far together with the plan state needed to resume after it
+    def commit(self, next_index):
+        self.writer.commit({
+            'config': self.args,
+            'sweep_mode': self.sweep_mode,
+            'pan_speed': self.pan_speed,
+            'tilt_speed': self.tilt_speed,
+            'calibrated': self.vna.using_correction,
+            's11_done': self.s11_done,
+            'averaging': self.avg,
+            'if_bw': self.if_bw,
+            'next_index': next_index,
+        })
+
+    # recalls the cached calibration of the plan (from its register, else from the host-side coefficients) if
+    # it still reproduces the S11 trace taken after calibrating, otherwise calibrates and caches the result.
+    # Returns True if a cached calibration was recalled
+    def calibrate(self):
+        key = cal_store.cal_key(self.freq, self.if_bw, vna_comms.CAL_PORT, self.dut)
+        record = cal_store.find(self.cal_dir, key, self.cal_max_age)
+        if record is not None:
+            if record['register'] in self.cal_registers:
+                self.vna.recall_register(record['register'], self.freq, self.if_bw)
+                self.vna.setup(self.freq, self.avg, self.if_bw)
+                if self.verify_calibration(record, 'register {}'.format(record['register'])):
+                    return True
+            self.vna.load_cal_coefficients(cal_store.coefficients(record), self.freq, self.if_bw)
+            if self.verify_calibration(record, 'host coefficients'):
+                return True
+        self.vna.calibrate(self.freq, self.if_bw) # cal prompts have to be changed for GUI integration
+        register = cal_store.free_register(self.cal_dir, key, self.cal_registers)
+        if register is not None:
+            self.vna.save_register(register)
+        cal_store.save(self.cal_dir, key, register, self.vna.read_cal_coefficients(), self.s11_payload())
+        return False
+
+    # compares the DUT's S11 with the trace taken after calibrating (see cal_store on what this proves) and
+    # reports the outcome through signals.cal_verified
+    def verify_calibration(self, record, source):
+        deviation = cal_store.deviation(record, self.s11_payload())
+        age = (time() - record['timestamp']) / 3600
+        accepted = deviation <= self.cal_tolerance
+        self.signals.cal_verified.emit(source, age, deviation, accepted)
+        return accepted
+
+    def s11_payload(self):  # one averaged S11 trace
+        self.vna.rst_avg('S11')
+        self.wait(self.vna_avg_delay)
+        return bytes(self.vna.get_raw('S11', self.wait))
+
+    # measures the trace noise at the setup position and sets if_bw and avg to the fastest setting
+    # predicted to reach noise_target, see noise_tuning
+    def tune_noise(self):
+        ref_if_bw = vna_timing.BASE_IF_BW
+        self.vna.setup(self.freq, noise_tuning.REFERENCE_AVG, ref_if_bw)
+        delay = vna_timing.vna_delay(self.freq, noise_tuning.REFERENCE_AVG, ref_if_bw)[0]
+        traces = []
+        for i in range(0, noise_tuning.REFERENCE_TRACES):
+            self.vna.rst_avg('S21')
+            self.wait(delay)
+            traces.append(self.vna.get_trace('S21', self.wait))
+        noise = noise_tuning.trace_noise(traces)
+        [self.if_bw, self.avg, predicted, seconds] = noise_tuning.choose(self.freq, noise, ref_if_bw,
+                                                                         noise_tuning.REFERENCE_AVG, self.noise_target,
+                                                                         self.noise_max_time)
+        print('Noise tuning: {:.3f} dB trace noise at {} Hz IF BW, averaging {}'.format(
+            noise, ref_if_bw, noise_tuning.REFERENCE_AVG))
+        print('Noise tuning: IF BW {} Hz, averaging {}, predicted noise {:.3f} dB (target {:.3f} dB), '
+              '{:.2f} s per angle'.format(self.if_bw, self.avg, predicted, self.noise_target, seconds))
+        if predicted > self.noise_target:
+            print('WARNING: noise tuning cannot reach {:.3f} dB within {} s per angle, measuring at {:.3f} dB '
+                  '(raise noise_max_time or noise_target)'.format(self.noise_target, self.noise_max_time, predicted))
+
+    # position of the i-th angle of the plan, index 0 is the setup position
+    def plan_position(self, i):
+        if self.exe_mode == 'pan':
+            if i == 0:
+                return [-180+self.offset, self.const_angle]
+            return [(i * self.resolution) - 180, self.const_angle]
+        else:
+            if i == 0:
+                return [self.offset+self.const_angle, -90]
+            return [self.const_angle, (i * self.resolution) - 90]
+
+    def move_to_index(self, i):
+        [pan, tilt] = self.plan_position(i)
+        self.qpt.move_to(pan, tilt, 'abs', self.token)
+        self.update_position()
+        self.token.check()
+
+    def release_instruments(self):  # drops the pooled sessions, the next meas_ctrl reconnects from scratch
+        visa_backend.discard(self.vna_resource)
+        visa_backend.discard(self.qpt_resource)
 
     def halt(self):
         self.qpt.move_to(0, 0, 'stop')
@@ -186,23 +477,179 @@ class meas_ctrl:
         curr = self.qpt.get_position()
         self.pan = curr.pan_angle()
         self.tilt = curr.tilt_angle()
-        self.signals.current_pan.emit(self.pan)
-        self.signals.current_tilt.emit(self.tilt)
+        if self.bridge is not None:
+            self.bridge.post_position(self.pan, self.tilt)
+            return
+        with acq_trace.span('signals.emit'):
+            self.signals.current_pan.emit(self.pan)
+            self.signals.current_tilt.emit(self.tilt)
+
+    def emit_progress(self):
+        if self.bridge is not None:
+            self.bridge.post_progress(self.progress)
+            return
+        with acq_trace.span('signals.emit'):
+            self.signals.progress.emit(self.progress)
+
+    # position and progress go to the bridge (coalesced to its display rate) instead of being emitted
+    # on every update, the bridge also gets every recorded trace
+    def attach_bridge(self, bridge):
+        self.bridge = bridge
 
     def record_data(self, s, file):
         if s == 'S21':
             self.update_position()
-            data_storage.append_data(file, self.vna.get_data(self.tilt, self.pan, s))
+            [theta, phi] = [self.tilt, self.pan]
+        else:
+            [theta, phi] = [0, 0]
+        if self.raw == True or self.pooled(file):
+            payload = self.vna.get_raw(s, self.wait)
+            self.store(file, binary_storage.raw_trace(s, theta, phi, time(), payload))
+            if self.cube is None and self.bridge is None and self.gated is None:
+                return
+            with acq_trace.span('vna.decode'):
+                [real, imag] = vna_comms.decode_trace(payload)
         else:
-            data_storage.append_data(file, self.vna.get_data(0, 0, s))
+            [real, imag] = self.vna.get_trace(s, self.wait)
+            with acq_trace.span('vna.to_data'):
+                data = self.vna.to_data(real, imag, theta, phi, s)
+            self.store(file, data)
+        if self.cube is not None:
+            self.cube.write_trace(self.tilt, self.pan, s, real, imag)
+        if self.gated is not None and s == 'S21':
+            with acq_trace.span('gate.add'):
+                self.gated.add(self.tilt, self.pan, real, imag)
+        if self.bridge is not None:
+            self.bridge.post_trace(s, theta, phi, self.vna.frequencies(), real, imag)
+
+    def store(self, file, data):
+        with acq_trace.span('storage.append'):
+            if self.pooled(file) and isinstance(data, binary_storage.raw_trace):
+                self.writer.append_trace(data.s_param, data.theta, data.phi, data.timestamp, data.payload)
+            elif self.writer is not None and file == self.file:
+                self.writer.append(data)
+            else:
+                data_storage.append_data(file, data)
+        if self.publisher is not None:
+            if isinstance(data, binary_storage.raw_trace) and self.raw != True:  # pooled writer, the file gets values
+                with acq_trace.span('vna.to_data'):
+                    [real, imag] = vna_comms.decode_trace(data.payload)
+                    data = self.vna.to_data(real, imag, data.theta, data.phi, data.s_param)
+            with acq_trace.span('stream.publish'):
+                self.publisher.publish(data)
+
+    def close_publisher(self):
+        if self.publisher is not None:
+            publisher = self.publisher
+            self.publisher = None
+            publisher.close()
+
+    def open_publisher(self):  # the channel outlives single runs, subscribers stay connected across jobs
+        if self.publisher is not None and self.publisher.address != self.stream:
+            self.publisher.close()
+            self.publisher = None
+        if self.publisher is None and self.stream is not None:
+            self.publisher = stream_publisher.stream_publisher(self.stream)
+
+    # pattern cube covering every angle of the plan, S11 goes to the setup position where it is taken
+    def create_cube(self):
+        import pattern_cube # numpy is only needed when a cube is requested
+        [tilts, pans] = self.cube_axes()
+        s_params = ['S21']
+        if self.impedance == True:
+            s_params.append('S11')
+        self.cube = pattern_cube.create(self.cube_name, tilts, pans, s_params, self.vna.frequencies())
+
+    # cube of the time gated S21 traces, next to the run's cube (or data file)
+    def create_gated(self):
+        import pattern_cube
+        [tilts, pans] = self.cube_axes()
+        self.open_gated(pattern_cube.create(self.gated_name(), tilts, pans, ['S21'], self.vna.frequencies()))
+
+    def open_gated(self, cube):
+        import time_gate
+        gate = time_gate.time_gate(cube.freqs, self.gate['start'], self.gate['stop'],
+                                   self.gate.get('beta', time_gate.BETA), self.gate.get('pad', time_gate.PAD))
+        self.gated = time_gate.gate_stage(gate, cube, self.gate.get('batch', time_gate.BATCH))
+
+    def gated_name(self):
+        import time_gate
+        if self.cube_name is None:
+            return time_gate.gated_name(os.path.splitext(self.file)[0])
+        return time_gate.gated_name(self.cube_name)
+
+    def flush_cubes(self):
+        if self.cube is not None:
+            self.cube.flush()
+        if self.gated is not None:
+            with acq_trace.span('gate.flush'):
+                self.gated.flush()
+
+    def cube_axes(self):  # [tilts, pans] of the grid of the plan
+        if self.exe_mode == 'pan':
+            span = 360
+        else:
+            span = 180
+        count = int(span/self.resolution)
+        if self.sweep_mode == 'continuous':
+            count = count + 1
+        positions = [self.plan_position(i) for i in range(0, count)]
+        if self.exe_mode == 'pan':
+            pans = [p[0] for p in positions]
+            tilts = [self.const_angle]
+        else:
+            pans = [self.const_angle]
+            tilts = [p[1] for p in positions]
+        return [tilts, pans]
+
+    def open_writer(self):
+        self.close_writer()
+        if self.writer_opts.get('processes', 0) > 0:
+            self.writer = data_storage.open_process_writer(self.file, vna_comms.plan_frequencies(self.freq), self.raw,
+                                                           self.writer_opts['processes'],
+                                                           self.writer_opts.get('slots', 8),
+                                                           self.writer_opts.get('max_bytes', 65536),
+                                                           self.writer_opts.get('max_delay', 1.0),
+                                                           self.writer_opts.get('fsync', 'commit'))
+            return
+        self.writer = data_storage.open_writer(self.file, self.writer_opts.get('max_bytes', 65536),
+                                               self.writer_opts.get('max_delay', 1.0),
+                                               self.writer_opts.get('fsync', 'commit'))
+
+    # traces for file are decoded and stored by the worker processes of the writer
+    def pooled(self, file):
+        return self.writer_opts.get('processes', 0) > 0 and self.writer is not None and file == self.file
+
+    def close_writer(self):
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            writer.close()
+            print('Storage: ' + writer.metrics.summary())
 
     def step_delay(self):
         self.vna.rst_avg('S21')
-        sleep(self.vna_avg_delay)
+        with acq_trace.span('vna.avg_wait'):
+            self.wait(self.vna_avg_delay)
 
-    def continuous_delay(self, lock):
+    def continuous_delay(self, lock):  # runs in its own thread, the sweep loop checks the token
         with lock:
-            sleep(self.vna_avg_delay)
+            with acq_trace.span('vna.avg_wait'):
+                self.token.wait(self.vna_avg_delay)
+
+    def start_trace(self):  # the positioner link counters are kept per run as well
+        self.qpt.comms.stats.reset()
+        if self.trace is not None:
+            acq_trace.enable()
+
+    # link counters and per-stage summary on the console, the full timeline to the trace file
+    def finish_trace(self):
+        print('Positioner link: ' + self.qpt.comms.stats.summary())
+        if self.trace is not None:
+            acq_trace.disable()
+            acq_trace.recorder.export(self.trace)
+            print('Timing ({}):'.format(self.trace))
+            print(acq_trace.recorder.summary_table())
 
     def is_step_pan_complete(self):
         if self.progress > 1:
@@ -220,6 +667,7 @@ class meas_ctrl:
         t = Thread(target=self.continuous_delay, args=(lock,))
         t.start()                
         t.join()
+        self.token.check()
         self.record_data('S21', self.file)
 
     def init_continuous_lock(self):
@@ -240,64 +688,13 @@ class meas_ctrl:
         return False
 
     # returns list w/ 3 numbers in seconds, [averaging delay, get_data delay (S11), get_data delay (S21)]
-    def compute_vna_delay(self):        
-        if isinstance(self.freq, list):
-            if len(self.freq) <= 5:
-                if self.avg <= 8:
-                    return [2.19, 1.202, 1.26]
-                return [3.98, 1.202, 1.26]
-            elif len(self.freq) <= 10:
-                if self.avg <= 8:
-                    return [3.02, 1.296, 1.35]
-                return [5.80, 1.296, 1.35]
-            elif len(self.freq) <= 15:
-                if self.avg <= 8:
-                    return [3.11, 1.36, 1.42]
-                return [5.95, 1.36, 1.42]
-            elif len(self.freq) <= 20:
-                if self.avg <= 8:
-                    return [3.36, 1.417, 1.489]
-                return [6.48, 1.417, 1.489]
-            elif len(self.freq) <= 25:
-                if self.avg <= 8:
-                    return [3.26, 1.477, 1.547]
-                return [6.35, 1.477, 1.547]
-            else:
-                if self.avg <= 8:
-                    return [3.58, 1.52, 1.61]
-                return [6.76, 1.52, 1.61]
-        else:
-            if self.freq.points <= 201:
-                if self.avg <= 8:
-                    return [3.79, 1.71, 2.03]
-                return [7.30, 1.71, 2.03]
-            elif self.freq.points <= 401:
-                if self.avg <= 8:
-                    return [4.23, 2.15, 2.73]
-                return [7.99, 2.15, 2.73]
-            elif self.freq.points <= 801:
-                if self.avg <= 8:
-                    return [5.49, 3.01, 4.09]
-                return [10.39, 3.01, 4.09]
-            elif self.freq.points <= 1601:
-                if self.avg <= 8:
-                    return [8.51, 4.72, 6.74]
-                return [16.06, 4.72, 6.74]
+    def compute_vna_delay(self):
+        return vna_timing.vna_delay(self.freq, self.avg, self.if_bw)
 
     def compute_pan_speed(self, total_time):
-        pan_speed = int((12.8866*(360.0 / total_time) + 3.1546))
-        if pan_speed <= self.qpt.MIN_PAN_SPEED:
-            return self.qpt.MIN_PAN_SPEED
-        elif pan_speed >= self.qpt.MAX_PAN_SPEED:
-            return self.qpt.MAX_PAN_SPEED
-        return int(pan_speed)
+        return kinematics.pan_speed_for(total_time)
 
     def compute_tilt_speed(self, total_time):
-        tilt_speed = int((39.3701*(180.0 / total_time) + 6.8228))
-        if tilt_speed <= self.qpt.MIN_TILT_SPEED:
-            return self.qpt.MIN_TILT_SPEED
-        elif tilt_speed >= self.qpt.MAX_TILT_SPEED:
-            return self.qpt.MAX_TILT_SPEED
-        return int(tilt_speed)
+        return kinematics.tilt_speed_for(total_time)
 """End meas_ctrl Class"""
 
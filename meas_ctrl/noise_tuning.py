@@ -0,0 +1,79 @@
+################################################################################
+#
+#  Description:
+#      Picks the IF bandwidth and averaging factor for a target trace noise.
+#      meas_ctrl records a few unaveraged traces at the setup position, the
+#      trace noise is the median over all points of the standard deviation of
+#      the magnitude (dB) between those traces. The noise power grows with
+#      the IF bandwidth and averaging N traces divides it by N, so the noise
+#      in dB of any other setting is predicted as
+#
+#          noise * sqrt((if_bw / ref_if_bw) * (ref_avg / avg))
+#
+#      and the setting meeting the target with the least time per angle in
+#      the VNA timing model (vna_timing) is chosen. Settings slower than
+#      max_time per angle are not considered, if none of the others meets the
+#      target the quietest of them is used and meas_ctrl warns about it.
+#
+#  Status:
+#      The prediction holds while the noise is small compared to the signal
+#      (up to about 1 dB), which is the range worth tuning for.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import math
+import statistics
+import vna_timing
+
+REFERENCE_TRACES = 4   # unaveraged traces the noise is measured from
+REFERENCE_AVG = 1
+AVERAGING = [1, 2, 4, 8, 16, 32, 64]
+MAX_ANGLE_TIME = 30    # seconds per angle the tuning may spend at most, default of noise_max_time
+
+
+def magnitude_db(real, imag):
+    return [20 * math.log10(math.sqrt(real[i] * real[i] + imag[i] * imag[i]) + 1e-60) for i in range(0, len(real))]
+
+
+def trace_noise(traces):  # traces is a list of [real, imag] of the same sweep, returns the trace noise in dB
+    magnitudes = [magnitude_db(real, imag) for [real, imag] in traces]
+    deviations = [statistics.stdev(point) for point in zip(*magnitudes)]
+    return statistics.median(deviations)
+
+
+def predict(noise, ref_if_bw, ref_avg, if_bw, avg):  # trace noise in dB at if_bw and avg
+    return noise * math.sqrt((if_bw / ref_if_bw) * (ref_avg / avg))
+
+
+def angle_time(freq, avg, if_bw):  # averaging and S21 get_data time of one angle
+    [avg_delay, s11_delay, s21_delay] = vna_timing.vna_delay(freq, avg, if_bw)
+    return avg_delay + s21_delay
+
+
+def choose(freq, noise, ref_if_bw, ref_avg, target, max_time=MAX_ANGLE_TIME):
+    """[if_bw, avg, predicted noise dB, seconds per angle] of the fastest
+    setting predicted to meet target (dB) within max_time seconds per angle.
+    If none does, the quietest setting within max_time is returned (the
+    fastest one if even that is slower than max_time), callers compare the
+    predicted noise with target to tell.
+    """
+    best = None
+    quietest = None
+    fastest = None
+    for if_bw in vna_timing.IF_BWS:
+        for avg in AVERAGING:
+            candidate = [if_bw, avg, predict(noise, ref_if_bw, ref_avg, if_bw, avg), angle_time(freq, avg, if_bw)]
+            if fastest is None or candidate[3] < fastest[3]:
+                fastest = candidate
+            if candidate[3] > max_time:
+                continue
+            if candidate[2] <= target and (best is None or candidate[3] < best[3]):
+                best = candidate
+            if quietest is None or candidate[2] < quietest[2]:
+                quietest = candidate
+    if best is not None:
+        return best
+    if quietest is not None:
+        return quietest
+    return fastest
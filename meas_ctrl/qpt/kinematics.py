@@ -0,0 +1,62 @@
+################################################################################
+#
+#  Description:
+#      Kinematic model of the QPT Positioner. Holds the jog speed limits and
+#      the empirical conversions between jog speed codes (0-127, as sent in
+#      the jog packet) and angular rates, plus an estimate of how long an
+#      automated move (Positioner.move_to) takes.
+#
+#  Status:
+#      The jog conversions were fitted on the chamber positioner, the
+#      automated move rates assume the positioner runs at its maximum speed.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+
+# Jog speed limits
+MAX_PAN_TIME = 1240
+MIN_PAN_SPEED = 8
+MAX_PAN_SPEED = 127
+
+MAX_TILT_TIME = 700
+MIN_TILT_SPEED = 17
+MAX_TILT_SPEED = 127
+
+# Positioner.move_to overhead: speed set/reset, the command itself and the status polls
+MOVE_OVERHEAD = .48
+
+
+def pan_speed_for(total_time):  # jog speed that sweeps 360 degrees of pan in total_time seconds
+    pan_speed = int((12.8866*(360.0 / total_time) + 3.1546))
+    if pan_speed <= MIN_PAN_SPEED:
+        return MIN_PAN_SPEED
+    elif pan_speed >= MAX_PAN_SPEED:
+        return MAX_PAN_SPEED
+    return int(pan_speed)
+
+
+def tilt_speed_for(total_time):  # jog speed that sweeps 180 degrees of tilt in total_time seconds
+    tilt_speed = int((39.3701*(180.0 / total_time) + 6.8228))
+    if tilt_speed <= MIN_TILT_SPEED:
+        return MIN_TILT_SPEED
+    elif tilt_speed >= MAX_TILT_SPEED:
+        return MAX_TILT_SPEED
+    return int(tilt_speed)
+
+
+def pan_rate(pan_speed):  # degrees per second for a pan jog speed
+    return (pan_speed - 3.1546) / 12.8866
+
+
+def tilt_rate(tilt_speed):  # degrees per second for a tilt jog speed
+    return (tilt_speed - 6.8228) / 39.3701
+
+
+def move_time(pan_from, tilt_from, pan_to, tilt_to):
+    """Estimated duration of Positioner.move_to between two positions in
+    seconds. Both axes move at once, so the slower axis sets the time.
+    """
+    pan_time = abs(pan_to - pan_from) / pan_rate(MAX_PAN_SPEED)
+    tilt_time = abs(tilt_to - tilt_from) / tilt_rate(MAX_TILT_SPEED)
+    return max(pan_time, tilt_time) + MOVE_OVERHEAD
@@ -16,61 +16,165 @@
 ################################################################################
 import time
 from threading import Lock
-import pyvisa as visa
 import integer as qi
 import packet as pkt
+import kinematics
+import acq_trace
+import visa_backend
 from constants import BIT0, BIT1, BIT2, BIT3, BIT4, BIT5, BIT6, BIT7
 from packet_parser import Parser
 
+
+class link_stats:
+    """Fault counters and round-trip latency of the serial link."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.timeouts = 0       # no reply within the read timeout
+        self.corrupt = 0        # replies with bad framing or LRC, or answering another command
+        self.retries = 0        # retransmissions
+        self.resyncs = 0        # clear_rx_buffer() calls after a fault
+        self.recovered = 0      # queries answered after one or more retransmissions
+        self.failed = 0         # queries that used up their retry budget
+        self.latency_total = 0  # seconds, over the valid replies
+        self.latency_max = 0
+        self.replies = 0
+
+    def latency_mean(self):
+        if self.replies == 0:
+            return 0
+        return self.latency_total / self.replies
+
+    def summary(self):
+        return ('{} queries, {} timeouts, {} corrupt replies, {} retries ({} recovered, {} failed), {} resyncs, '
+                'latency mean {:.1f} ms / max {:.1f} ms').format(
+            self.queries, self.timeouts, self.corrupt, self.retries, self.recovered, self.failed, self.resyncs,
+            1000 * self.latency_mean(), 1000 * self.latency_max)
+
+
+def valid_reply(rx, cmd):  # a complete packet with a valid LRC answering command cmd
+    if rx is None or len(rx) < 4 or rx[0] != 0x02:
+        return False
+    rx = bytes(pkt.strip_esc(rx))
+    return rx[1] == cmd and pkt.valid_LRC(rx[1:-1])
+
+
 class Comms:
     _LIMIT = 25
+    _RETRIES = {0x31: 3, 0x33: 3, 0x35: 3, 0x34: 0}  # retransmissions per command, a delta move is not idempotent
+    _DEFAULT_RETRIES = 2
+    _INITIAL_TIMEOUT = 50   # ms, the fixed wait and timeout used before the link latency has been measured
+    _MIN_TIMEOUT = 30       # ms
+    _MAX_TIMEOUT = 500      # ms
 
     def __init__(self, com_port, baud_rate):
-        self.rm = visa.ResourceManager()
+        self.rm = visa_backend.resource_manager()
+        visa = visa_backend.visa()
         self.comms = self.rm.open_resource(com_port)
         self.comms.read_termination = b'\x03'
         self.comms.write_termination = b'\x03'
-        self.comms.timeout = 30
+        self.comms.timeout = self._INITIAL_TIMEOUT
         self.comms.baud_rate = baud_rate
         self.comms.stop_bites = visa.constants.StopBits.one
         self.comms.parity = visa.constants.Parity.none
         self.comms.data_bits = 8
+        self.timeout = self._INITIAL_TIMEOUT
+        self.srtt = None        # smoothed round-trip time (s)
+        self.rttvar = 0         # round-trip time variation (s)
+        self.stats = link_stats()
         self.connected = self.init_comms_link()
 
     def init_comms_link(self):
         tries = 0
-        rx = self.positioner_query(pkt.get_status())
+        rx = self.positioner_query(pkt.get_status(), 0)
         while tries < self._LIMIT and rx == None:
-            rx = self.positioner_query(pkt.get_status())
+            rx = self.positioner_query(pkt.get_status(), 0)
             tries = tries + 1
         if rx == None:
             return False
         return True
 
-    def positioner_query(self, msg):
+    def positioner_query(self, msg, retries=None):
+        """Sends msg and returns the reply, None if no valid reply arrived
+        within the retry budget of the command (retries overrides it). After
+        every fault (timeout, corrupt reply, reply to another command) the
+        receive buffer is cleared before the command is sent again, so a
+        lost packet costs one retransmission.
+        """
+        cmd = bytes(pkt.strip_esc(msg))[1]
+        if retries is None:
+            retries = self._RETRIES.get(cmd, self._DEFAULT_RETRIES)
+        with acq_trace.span('qpt.query'):
+            self.stats.queries = self.stats.queries + 1
+            for attempt in range(0, retries + 1):
+                if attempt > 0:
+                    self.stats.retries = self.stats.retries + 1
+                rx = self.exchange(msg, cmd)
+                if rx is not None:
+                    if attempt > 0:
+                        self.stats.recovered = self.stats.recovered + 1
+                    return rx
+                self.clear_rx_buffer()
+                self.stats.resyncs = self.stats.resyncs + 1
+            self.stats.failed = self.stats.failed + 1
+            return None
+
+    def exchange(self, msg, cmd):  # one transmission, returns the reply if it is valid
+        start = time.perf_counter()
         self.comms.write_raw(msg)
         try:
-            time.sleep(.02)
             rx = self.comms.read_raw()
-        except visa.errors.VisaIOError as err:
+        except visa_backend.io_error() as err:
+            self.stats.timeouts = self.stats.timeouts + 1
             return None
+        if not valid_reply(rx, cmd):
+            self.stats.corrupt = self.stats.corrupt + 1
+            return None
+        self.measured(time.perf_counter() - start)
         return rx
 
-    def clear_rx_buffer(self):
-        clear = False
-        while clear is False:
+    def measured(self, rtt):  # smooths the round-trip time like TCP (RFC 6298), the read timeout follows it
+        self.stats.replies = self.stats.replies + 1
+        self.stats.latency_total = self.stats.latency_total + rtt
+        self.stats.latency_max = max(self.stats.latency_max, rtt)
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = .75 * self.rttvar + .25 * abs(self.srtt - rtt)
+            self.srtt = .875 * self.srtt + .125 * rtt
+        timeout = int(round(min(self._MAX_TIMEOUT, max(self._MIN_TIMEOUT, 1000 * (self.srtt + 4 * self.rttvar)))))
+        if timeout != self.timeout:
+            self.timeout = timeout
+            self.comms.timeout = timeout
+
+    def clear_rx_buffer(self):  # drops whatever is left of earlier replies, until a read times out
+        for i in range(0, self._LIMIT):
             try:
                 rx = self.comms.read_raw()
-            except visa.errors.VisaIOError as err:
-                clear = True
+            except visa_backend.io_error() as err:
+                return
 """End CommsManager Class"""
 
 
+# linked positioner on com_port, shared with earlier users of the port while it still answers
+def open_positioner(com_port, baud_rate):
+    return visa_backend.checkout(com_port, lambda: Positioner(com_port, baud_rate),
+                                 lambda p: p.comms.comms.baud_rate == baud_rate and p.is_alive())
+
+
 class Positioner:
+    _POLL_FAILURES = 5      # status polls (or jogs) in a row without a reply before a move is given up
+    _MOVE_MARGIN = 2        # a move may take this many times its estimated duration...
+    _MOVE_SLACK = 10        # ...plus this many seconds
+
     def __init__(self, com_port, baud_rate):
         self.comms = Comms(com_port, baud_rate)
         self.p = Parser()
         self.curr_lock = Lock()
+        self.jog_failures = 0   # jog commands in a row without a reply
 
         # General Properties
         self.executing = False
@@ -125,38 +229,80 @@ class Positioner:
         self.update_positioner_stats()
 
         # Jog speed limits
-        self.MAX_PAN_TIME = 1240
-        self.MIN_PAN_SPEED = 8
-        self.MAX_PAN_SPEED = 127
+        self.MAX_PAN_TIME = kinematics.MAX_PAN_TIME
+        self.MIN_PAN_SPEED = kinematics.MIN_PAN_SPEED
+        self.MAX_PAN_SPEED = kinematics.MAX_PAN_SPEED
+
+        self.MAX_TILT_TIME = kinematics.MAX_TILT_TIME
+        self.MIN_TILT_SPEED = kinematics.MIN_TILT_SPEED
+        self.MAX_TILT_SPEED = kinematics.MAX_TILT_SPEED
+
+
+    # a cancelled token (run_control.cancel_token) stops the motion at the next status poll, a positioner that
+    # stops answering or does not arrive within the move deadline raises an exception
+    def move_to(self, pan, tilt, move_type='stop', token=None):
+        with acq_trace.span('qpt.move_to'):
+            self.p.parse(self.comms.positioner_query(pkt.set_minimum_speeds(40,40)),self)
 
-        self.MAX_TILT_TIME = 700
-        self.MIN_TILT_SPEED = 17
-        self.MAX_TILT_SPEED = 127
+            if move_type == 'abs':
+                coord = qi.Coordinate(pan,tilt)
+                rx = self.comms.positioner_query(pkt.move_to_entered_coords(coord))
+            elif move_type == 'delta':
+                coord = qi.Coordinate(pan,tilt)
+                rx = self.comms.positioner_query(pkt.move_to_delta_coords(coord))
+            elif move_type == 'zero':
+                rx = self.comms.positioner_query(pkt.move_to_absolute_zero())
+            else:
+                rx = self.comms.positioner_query(pkt.stop())
+            if rx is None:  # the reply is a status packet, without it the state of the move is unknown
+                raise Exception('The positioner did not acknowledge the {} move ({})'.format(
+                    move_type, self.comms.stats.summary()))
+            self.p.parse(rx,self)
 
+            deadline = time.perf_counter() + self.move_deadline(pan, tilt, move_type)
+            self.idle(.08, token)
+            self.p.parse(self.comms.positioner_query(pkt.get_status()),self)
+            self.idle(.12, token)
+
+            failures = 0
+            while self.status_executing is True:
+                if token is not None and token.is_cancelled():
+                    self.p.parse(self.comms.positioner_query(pkt.stop()),self)
+                    token = None    # keep polling until the stop has taken effect
+                rx = self.comms.positioner_query(pkt.get_status())
+                if rx is None:
+                    failures = failures + 1
+                    if failures >= self._POLL_FAILURES:
+                        raise Exception('The positioner stopped answering during a move ({})'.format(
+                            self.comms.stats.summary()))
+                else:
+                    failures = 0
+                self.p.parse(rx,self)
+                if self.status_executing is True and time.perf_counter() > deadline:
+                    self.p.parse(self.comms.positioner_query(pkt.stop()),self)
+                    raise Exception('The positioner did not complete the move to {:.2f}/{:.2f} in time'.format(
+                        pan, tilt))
+                self.idle(.08, token)
 
-    def move_to(self, pan, tilt, move_type='stop'):
-        self.p.parse(self.comms.positioner_query(pkt.set_minimum_speeds(40,40)),self)
-        
+            self.p.parse(self.comms.positioner_query(pkt.set_minimum_speeds(8,17)),self)
+
+    def move_deadline(self, pan, tilt, move_type):  # seconds a move_to may take
+        curr = self.get_position()
         if move_type == 'abs':
-            coord = qi.Coordinate(pan,tilt)
-            self.p.parse(self.comms.positioner_query(pkt.move_to_entered_coords(coord)),self)
+            estimate = kinematics.move_time(curr.pan_angle(), curr.tilt_angle(), pan, tilt)
         elif move_type == 'delta':
-            coord = qi.Coordinate(pan,tilt)
-            self.p.parse(self.comms.positioner_query(pkt.move_to_delta_coords(coord)),self)
+            estimate = kinematics.move_time(0, 0, pan, tilt)
         elif move_type == 'zero':
-            self.p.parse(self.comms.positioner_query(pkt.move_to_absolute_zero()),self)
+            estimate = kinematics.move_time(curr.pan_angle(), curr.tilt_angle(), 0, 0)
         else:
-            self.p.parse(self.comms.positioner_query(pkt.stop()),self)
-
-        time.sleep(.08)
-        self.p.parse(self.comms.positioner_query(pkt.get_status()),self)
-        time.sleep(.12)
+            estimate = kinematics.MOVE_OVERHEAD
+        return self._MOVE_MARGIN * estimate + self._MOVE_SLACK
 
-        while self.status_executing is True:
-            self.p.parse(self.comms.positioner_query(pkt.get_status()),self)
-            time.sleep(.08)
-
-        self.p.parse(self.comms.positioner_query(pkt.set_minimum_speeds(8,17)),self)
+    def idle(self, seconds, token=None):  # sleeps, returns True early if the token gets cancelled
+        if token is None:
+            time.sleep(seconds)
+            return False
+        return token.wait(seconds)
 
     def get_position(self):
         with self.curr_lock:
@@ -166,31 +312,41 @@ class Positioner:
     def get_status(self):
         self.p.parse(self.comms.positioner_query(pkt.get_status()), self)
 
+    # the jog reply is a status packet and the only position update of a continuous sweep, a positioner that
+    # stops answering would leave the head jogging on a stale position, so it raises like a lost move
+    def jog(self, msg):
+        rx = self.comms.positioner_query(msg)
+        if rx is None:
+            self.jog_failures = self.jog_failures + 1
+            if self.jog_failures >= self._POLL_FAILURES:
+                self.jog_failures = 0
+                raise Exception('The positioner stopped answering during a jog ({})'.format(
+                    self.comms.stats.summary()))
+        else:
+            self.jog_failures = 0
+        self.p.parse(rx, self)
+
     def jog_cw(self, pan_speed, target):
         if self.curr_position.pan_angle() < target.pan_angle():
-            rx = self.comms.positioner_query(pkt.jog_positioner(pan_speed, 1, 0, 0))
-            self.p.parse(rx, self)
+            self.jog(pkt.jog_positioner(pan_speed, 1, 0, 0))
         else:
             self.move_to(0,0,'stop')
 
     def jog_ccw(self, pan_speed, target):
         if self.curr_position.pan_angle() > target.pan_angle():
-            rx = self.comms.positioner_query(pkt.jog_positioner(pan_speed, 0, 0, 0))
-            self.p.parse(rx, self)
+            self.jog(pkt.jog_positioner(pan_speed, 0, 0, 0))
         else:
             self.move_to(0,0,'stop')
 
     def jog_up(self, tilt_speed, target):
         if self.curr_position.tilt_angle() < target.tilt_angle():
-            rx = self.comms.positioner_query(pkt.jog_positioner(0, 0, tilt_speed, 1))
-            self.p.parse(rx, self)
+            self.jog(pkt.jog_positioner(0, 0, tilt_speed, 1))
         else:
             self.move_to(0,0,'stop')
             
     def jog_down(self, tilt_speed, target):
         if self.curr_position.tilt_angle() > target.tilt_angle():
-            rx = self.comms.positioner_query(pkt.jog_positioner(0, 0, tilt_speed, 0))
-            self.p.parse(rx, self)
+            self.jog(pkt.jog_positioner(0, 0, tilt_speed, 0))
         else:
             self.move_to(0,0,'stop')
 
@@ -201,6 +357,14 @@ class Positioner:
                 self.curr_position.tilt_angle(),
                 time.time()))
 
+    def is_alive(self):  # one status query, which also refreshes position and status
+        rx = self.comms.positioner_query(pkt.get_status())
+        self.p.parse(rx, self)
+        return rx is not None
+
+    def close(self):
+        self.comms.comms.close()
+
     def update_positioner_stats(self):
         self.p.parse(self.comms.positioner_query(pkt.get_status()), self)
         self.p.parse(self.comms.positioner_query(pkt.get_angle_correction()), self)
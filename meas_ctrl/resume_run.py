@@ -0,0 +1,29 @@
+################################################################################
+#
+#  Description:
+#      Command line entry point for continuing an interrupted measurement.
+#      The configuration must be the one the run was started with, the data
+#      file is rolled back to its last committed angle and the run continues
+#      appending to it.
+#
+#      usage: resume_run.py pivot.json data\data0.csv
+#
+#  Dependencies:
+#      PyVISA Version: 1.10.1
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import sys
+import run_headless
+
+
+def main(argv):
+    if len(argv) != 3:
+        print('usage: resume_run.py config.json data_file')
+        return 1
+    return run_headless.main([argv[0], '--resume', argv[1], argv[2]])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,250 @@
+################################################################################
+#
+#  Description:
+#      Runs several VNA + positioner rigs concurrently from one controller
+#      process. Every rig gets its own worker process, which owns the rig's
+#      meas_ctrl object (and therefore its own GPIB and serial sessions) and
+#      writes the rig's output file independently. Progress and position
+#      updates from every worker are funnelled into a single telemetry queue
+#      so one operator (or one GUI) can watch all rigs at once. Each worker
+#      also listens on its own command queue, so a single rig can be paused
+#      or stopped (the run is closed and checkpointed as in the GUI) without
+#      touching the others.
+#
+#  Status:
+#      Calibration prompts need an operator at the console, so rigs with
+#      'calibration' set must be calibrated before being handed to the
+#      supervisor.
+#
+#  Dependencies:
+#      PyVISA Version: 1.10.1
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import json
+import multiprocessing as mp
+import queue
+import signal
+import sys
+import threading
+import time
+
+
+class telemetry:
+    def __init__(self, rig, kind, value, timestamp):
+        self.rig = rig              # name of the rig that produced the event
+        self.kind = kind            # 'progress', 'pan', 'tilt', 'finished', 'stopped' or 'error'
+        self.value = value
+        self.timestamp = timestamp
+
+
+class rig:
+    def __init__(self, name, args, data_file):
+        self.name = name
+        self.args = args            # pivot.json style configuration dictionary
+        self.data_file = data_file  # each rig must write to its own file
+        self.process = None
+        self.commands = None        # queue of 'pause' / 'stop' requests for the worker
+        self.progress = 0
+        self.pan = None
+        self.tilt = None
+        self.state = 'idle'         # 'idle', 'running', 'finished', 'stopped' or 'error'
+
+
+def rig_worker(name, args, data_file, events, commands):
+    """Entry point of a rig's worker process. Builds the meas_ctrl for the
+    rig, forwards its signals onto the shared telemetry queue and runs the
+    measurement to completion. 'pause' and 'stop' on the commands queue are
+    passed to the meas_ctrl, requests sent during setup take effect once the
+    run starts. A run that was paused or stopped before its end is reported
+    as 'stopped' with the reason.
+    """
+    def post(kind, value):
+        events.put((name, kind, value, time.time()))
+
+    def listen(ctrl):
+        while True:
+            command = commands.get()
+            if command == 'pause':
+                ctrl.pause()
+            elif command == 'stop':
+                ctrl.stop()
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C is handled by the supervisor, see terminate()
+    try:
+        from measurement_ctrl import meas_ctrl
+        import ctrl_signals
+        ctrl = meas_ctrl(args, data_file, ctrl_signals.plain_signals())
+        ctrl.signals.progress.connect(lambda p: post('progress', p))
+        ctrl.signals.current_pan.connect(lambda p: post('pan', p))
+        ctrl.signals.current_tilt.connect(lambda t: post('tilt', t))
+        ctrl.setup()    # resets the run's cancel token, so commands are only taken from here on
+        threading.Thread(target=listen, args=(ctrl,), name='commands', daemon=True).start()
+        ctrl.run()
+        if ctrl.interrupted is not None:
+            post('stopped', ctrl.interrupted)
+        else:
+            post('finished', None)
+    except Exception as err:
+        post('error', repr(err))
+
+
+class rig_supervisor:
+    def __init__(self, rigs):
+        self.rigs = {}
+        files = set()
+        addresses = set()
+        for r in rigs:
+            if r.name in self.rigs:
+                raise Exception('Duplicate rig name: {}'.format(r.name))
+            if r.data_file in files:
+                raise Exception('Rigs {} share the output file {}'.format(r.name, r.data_file))
+            resources = (('GPIB', r.args['gpib_addr']), ('ASRL', r.args['alias']))
+            for res in resources:
+                if res in addresses:
+                    raise Exception('Rig {} reuses instrument address {}{}'.format(r.name, res[0], res[1]))
+                addresses.add(res)
+            if r.args['calibration'] == True:
+                raise Exception('Rig {} requests calibration, calibrate it before running it '
+                                'under the supervisor'.format(r.name))
+            files.add(r.data_file)
+            self.rigs[r.name] = r
+        self.events = mp.Queue()
+
+    def start(self):
+        for r in self.rigs.values():
+            r.commands = mp.Queue()
+            r.process = mp.Process(target=rig_worker, args=(r.name, r.args, r.data_file, self.events, r.commands),
+                                   name='rig-' + r.name, daemon=True)
+            r.state = 'running'
+            r.process.start()
+
+    # a paused rig keeps its checkpoint and can be resumed with run_headless.py --resume, a stopped rig is
+    # closed like a finished one. Either way the worker reports 'stopped' and exits
+    def pause(self, name):
+        self.command(name, 'pause')
+
+    def stop(self, name):
+        self.command(name, 'stop')
+
+    def command(self, name, command):
+        if name not in self.rigs:
+            raise Exception('Unknown rig: {}'.format(name))
+        r = self.rigs[name]
+        if r.state == 'running':
+            r.commands.put(command)
+
+    def is_running(self):
+        return any(r.state == 'running' for r in self.rigs.values())
+
+    def telemetry(self, poll=.1):
+        """Generator yielding the aggregated telemetry of all rigs, in arrival
+        order, until every worker has either finished or failed.
+        """
+        while self.is_running():
+            try:
+                name, kind, value, timestamp = self.events.get(timeout=poll)
+            except queue.Empty:
+                self.reap()
+                continue
+            event = telemetry(name, kind, value, timestamp)
+            self.update(event)
+            yield event
+
+    def update(self, event):
+        r = self.rigs[event.rig]
+        if event.kind == 'progress':
+            r.progress = event.value
+        elif event.kind == 'pan':
+            r.pan = event.value
+        elif event.kind == 'tilt':
+            r.tilt = event.value
+        elif event.kind == 'finished':
+            r.state = 'finished'
+        elif event.kind == 'stopped':
+            r.state = 'stopped'
+        elif event.kind == 'error':
+            r.state = 'error'
+
+    def reap(self):  # catches workers that died without reporting (e.g. killed or crashed interpreter)
+        for r in self.rigs.values():
+            if r.state == 'running' and r.process is not None and not r.process.is_alive() \
+                    and self.events.empty():
+                r.state = 'error'
+
+    def overall_progress(self):
+        if len(self.rigs) == 0:
+            return 0
+        return sum(min(r.progress, 1) for r in self.rigs.values()) / len(self.rigs)
+
+    def join(self):
+        for r in self.rigs.values():
+            if r.process is not None:
+                r.process.join()
+
+    # stops every running rig and waits up to timeout seconds for the workers to close their runs, workers
+    # still alive after that are killed and marked 'error'
+    def terminate(self, timeout=30):
+        for r in self.rigs.values():
+            if r.process is not None and r.process.is_alive():
+                r.commands.put('stop')
+        deadline = time.time() + timeout
+        for r in self.rigs.values():
+            if r.process is not None:
+                r.process.join(max(0, deadline - time.time()))
+        while True:     # the 'stopped' reports of the workers that closed their runs
+            try:
+                name, kind, value, timestamp = self.events.get(timeout=.1)
+            except queue.Empty:
+                break
+            self.update(telemetry(name, kind, value, timestamp))
+        for r in self.rigs.values():
+            if r.process is not None and r.process.is_alive():
+                r.process.terminate()
+                r.state = 'error'
+
+
+def load_rigs(filename):
+    """Reads a rig list of the form
+        {"rigs": [{"name": "chamber_a", "config": "pivot_a.json", "data_file": "data\\a.csv"}, ...]}
+    where each config file is in pivot.json format.
+    """
+    with open(filename, 'r') as file:
+        listing = json.load(file)
+    rigs = []
+    for entry in listing['rigs']:
+        with open(entry['config'], 'r') as file:
+            args = json.load(file)
+        rigs.append(rig(entry['name'], args, entry['data_file']))
+    return rigs
+
+
+def main(argv):
+    if len(argv) != 2:
+        print('usage: rig_supervisor.py rigs.json')
+        return 1
+    supervisor = rig_supervisor(load_rigs(argv[1]))
+    supervisor.start()
+    try:
+        for event in supervisor.telemetry():
+            if event.kind == 'progress':
+                print('{:>12} progress {:6.1%}   overall {:6.1%}'.format(
+                    event.rig, event.value, supervisor.overall_progress()))
+            elif event.kind == 'finished':
+                print('{:>12} finished'.format(event.rig))
+            elif event.kind == 'stopped':
+                print('{:>12} stopped before the end of the run ({})'.format(event.rig, event.value))
+            elif event.kind == 'error':
+                print('{:>12} failed: {}'.format(event.rig, event.value))
+    except KeyboardInterrupt:
+        print('Stopping all rigs...')
+        supervisor.terminate()
+    supervisor.join()
+    if any(r.state != 'finished' for r in supervisor.rigs.values()):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
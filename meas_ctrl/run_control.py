@@ -0,0 +1,46 @@
+################################################################################
+#
+#  Description:
+#      Cooperative pause/stop for measurement runs. The GUI (or any other
+#      thread) cancels the run's token, every wait of the run waits on the
+#      token instead of sleeping, so it wakes up as soon as the token is
+#      cancelled and the run unwinds by raising run_interrupted.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+from threading import Event
+
+
+class run_interrupted(Exception):
+    def __init__(self, reason):
+        super().__init__('Run interrupted: {}'.format(reason))
+        self.reason = reason   # 'pause' or 'stop'
+
+
+class cancel_token:
+    def __init__(self):
+        self.event = Event()
+        self.reason = None
+
+    def cancel(self, reason):  # a stop requested after a pause wins
+        if self.reason != 'stop':
+            self.reason = reason
+        self.event.set()
+
+    def reset(self):
+        self.event.clear()
+        self.reason = None
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    def wait(self, seconds):  # sleeps for seconds, returns True early if the token is cancelled
+        return self.event.wait(seconds)
+
+    def check(self):
+        if self.event.is_set():
+            raise run_interrupted(self.reason)
@@ -0,0 +1,217 @@
+################################################################################
+#
+#  Description:
+#      Dry-run estimator for measurement configurations. Predicts how long a
+#      pivot.json style configuration takes, from the VNA timing model
+#      (vna_timing) and the positioner kinematics (kinematics), including the
+#      setup move and the S11 capture, and following the same continuous to
+#      step fallback as meas_ctrl.setup(). Given a deadline and accuracy
+#      constraints it also searches resolution, averaging, IF bandwidth,
+#      number of points and sweep mode for the fastest acceptable config.
+#
+#      usage: run_estimator.py config.json [--deadline S] [--max-resolution DEG]
+#                 [--min-averaging N] [--max-if-bw HZ] [--min-points N]
+#
+#  Status:
+#      Calibration is not included, it is paced by the operator.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import argparse
+import copy
+import json
+import sys
+import kinematics
+import list_plan
+import vna_timing
+
+RESOLUTIONS = [0.5, 1, 2, 2.5, 3, 4, 5, 6, 9, 10, 12, 15, 18, 20, 30, 45]
+AVERAGING = [1, 2, 4, 8, 16, 32, 64]
+LINEAR_POINTS = [201, 401, 801, 1601]
+VNA_SETUP_WRITE = .02  # seconds per GPIB write during session.setup()
+
+
+class estimate:
+    def __init__(self):
+        self.sweep_mode = None      # sweep mode after the continuous -> step fallback
+        self.pan_speed = 0
+        self.tilt_speed = 0
+        self.setup_move = 0         # move from the start position to the first angle
+        self.vna_setup = 0
+        self.s11 = 0
+        self.angles = 0             # number of S21 traces recorded
+        self.per_angle = 0          # average time per S21 angle
+        self.sweep = 0              # S21 part of the run
+        self.total = 0
+
+    def summary(self):
+        return ('{} sweep, {} angles @ {:.2f} s: setup move {:.1f} s, VNA setup {:.1f} s, '
+                'S11 {:.1f} s, sweep {:.1f} s, total {:.1f} s ({:.1f} min)').format(
+            self.sweep_mode, self.angles, self.per_angle, self.setup_move, self.vna_setup,
+            self.s11, self.sweep, self.total, self.total / 60)
+
+
+def plan_points(args):  # [is_list, points] of the frequency plan in args
+    if len(args['list']) != 0:
+        return [True, len(args['list'])]
+    return [False, args['linear']['points']]
+
+
+def start_position(args):  # same as meas_ctrl.plan_position(0)
+    if args['sweep_axis'] == 'pan':
+        return [-180 + args['offset']['pan'], args['fixed_angle']]
+    return [args['offset']['pan'] + args['fixed_angle'], -90]
+
+
+def estimate_run(args, current=(0, 0)):
+    """Predicts the duration of a run of args, starting with the positioner
+    at current = (pan, tilt).
+    """
+    est = estimate()
+    [is_list, points] = plan_points(args)
+    if_bw = args.get('if_bw', vna_timing.BASE_IF_BW)
+    if is_list:  # segmented lists include the table switches in the get_data delays
+        [avg_delay, s11_delay, s21_delay] = vna_timing.vna_delay(args['list'], args['averaging'], if_bw)
+    else:
+        [avg_delay, s11_delay, s21_delay] = vna_timing.plan_delay(is_list, points, args['averaging'], if_bw)
+    resolution = args['resolution']
+
+    [pan, tilt] = start_position(args)
+    est.setup_move = kinematics.move_time(current[0], current[1], pan, tilt)
+    writes = 6
+    if is_list:  # the first list table, see session.load_table()
+        writes = writes + 3 + 2 * len(list_plan.tables(args['list'])[0])
+    else:
+        writes = writes + 4
+    est.vna_setup = writes * VNA_SETUP_WRITE
+    if args['impedance'] == True:
+        est.s11 = avg_delay + s11_delay
+
+    if args['sweep_axis'] == 'pan':
+        span = 360
+        max_time = kinematics.MAX_PAN_TIME
+    else:
+        span = 180
+        max_time = kinematics.MAX_TILT_TIME
+    steps = int(span / resolution)
+
+    est.sweep_mode = args['positioner_mv']
+    if est.sweep_mode == 'continuous':
+        total_time = (avg_delay + s21_delay) * span / resolution
+        if total_time > max_time:
+            est.sweep_mode = 'step'
+
+    if est.sweep_mode == 'continuous':
+        if args['sweep_axis'] == 'pan':
+            est.pan_speed = kinematics.pan_speed_for(total_time)
+            rate = kinematics.pan_rate(est.pan_speed)
+        else:
+            est.tilt_speed = kinematics.tilt_speed_for(total_time)
+            rate = kinematics.tilt_rate(est.tilt_speed)
+        # the head keeps jogging while averaging, whichever finishes last paces the angle
+        est.angles = steps + 1
+        est.sweep = avg_delay + s21_delay + steps * (max(avg_delay, resolution / rate) + s21_delay)
+        est.sweep = est.sweep + kinematics.MOVE_OVERHEAD  # halt()
+    else:
+        est.angles = steps
+        move = kinematics.move_time(0, 0, resolution, 0)
+        if args['sweep_axis'] != 'pan':
+            move = kinematics.move_time(0, 0, 0, resolution)
+        est.sweep = steps * (avg_delay + s21_delay + move)
+
+    est.per_angle = est.sweep / est.angles
+    est.total = est.setup_move + est.vna_setup + est.s11 + est.sweep
+    return est
+
+
+def candidates(args, max_resolution, min_averaging, max_if_bw, min_points):
+    [is_list, points] = plan_points(args)
+    if is_list:
+        point_options = [points]
+    else:
+        if min_points is None:
+            min_points = points
+        point_options = [p for p in LINEAR_POINTS if p >= min_points]
+        if min_points not in point_options:
+            point_options.insert(0, min_points)
+    for resolution in [r for r in RESOLUTIONS if r <= max_resolution]:
+        for avg in [a for a in AVERAGING if a >= min_averaging] or [min_averaging]:
+            for if_bw in [b for b in vna_timing.IF_BWS if b <= max_if_bw]:
+                for p in point_options:
+                    for mode in ['step', 'continuous']:
+                        option = copy.deepcopy(args)
+                        option['resolution'] = resolution
+                        option['averaging'] = avg
+                        option['if_bw'] = if_bw
+                        option['positioner_mv'] = mode
+                        if not is_list:
+                            option['linear']['points'] = p
+                        yield option
+
+
+def accuracy_key(args):  # smaller is more accurate, used to break ties between equally fast configs
+    return (args['resolution'], -args['averaging'], args['if_bw'], -plan_points(args)[1],
+            args['positioner_mv'] != 'step')
+
+
+def optimize(args, deadline=None, max_resolution=None, min_averaging=None, max_if_bw=None, min_points=None):
+    """Searches for the fastest variant of args that satisfies the accuracy
+    constraints. Unset constraints default to the values in args, i.e. the
+    result is never coarser, less averaged or noisier than what was asked
+    for. Returns [args, estimate] or None if nothing fits in the deadline.
+    """
+    if max_resolution is None:
+        max_resolution = args['resolution']
+    if min_averaging is None:
+        min_averaging = args['averaging']
+    if max_if_bw is None:
+        max_if_bw = args.get('if_bw', vna_timing.BASE_IF_BW)
+
+    best = None
+    for option in candidates(args, max_resolution, min_averaging, max_if_bw, min_points):
+        est = estimate_run(option)
+        if deadline is not None and est.total > deadline:
+            continue
+        if best is None or (round(est.total, 3), accuracy_key(option)) < (round(best[1].total, 3),
+                                                                           accuracy_key(best[0])):
+            best = [option, est]
+    return best
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Estimate (and optimize) the duration of a measurement.')
+    parser.add_argument('config', help='configuration file in pivot.json format')
+    parser.add_argument('--deadline', type=float, default=None, help='maximum run time in seconds')
+    parser.add_argument('--max-resolution', type=float, default=None, help='coarsest acceptable step in degrees')
+    parser.add_argument('--min-averaging', type=int, default=None, help='smallest acceptable averaging factor')
+    parser.add_argument('--max-if-bw', type=int, default=None, help='widest acceptable IF bandwidth in Hz')
+    parser.add_argument('--min-points', type=int, default=None, help='fewest acceptable linear sweep points')
+    parser.add_argument('--write', default=None, help='save the optimized configuration to this file')
+    opts = parser.parse_args(argv[1:])
+
+    with open(opts.config, 'r') as file:
+        args = json.load(file)
+    print('As configured: ' + estimate_run(args).summary())
+
+    if opts.deadline is None and opts.max_resolution is None and opts.min_averaging is None \
+            and opts.max_if_bw is None and opts.min_points is None:
+        return 0
+    best = optimize(args, opts.deadline, opts.max_resolution, opts.min_averaging, opts.max_if_bw,
+                    opts.min_points)
+    if best is None:
+        print('No configuration meets the accuracy constraints within {} s.'.format(opts.deadline))
+        return 1
+    [option, est] = best
+    print('Optimized: resolution {} deg, averaging {}, IF BW {} Hz, {} points, {} mode'.format(
+        option['resolution'], option['averaging'], option['if_bw'], plan_points(option)[1],
+        option['positioner_mv']))
+    print('           ' + est.summary())
+    if opts.write is not None:
+        with open(opts.write, 'w') as file:
+            json.dump(option, file, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,76 @@
+################################################################################
+#
+#  Description:
+#      Headless command line entry point. Runs one configuration file (or
+#      resumes an interrupted run of it) without importing Qt: meas_ctrl
+#      reports through ctrl_signals.plain_signals and progress is printed to
+#      the console. The measurement modules (and with them PyVISA, through
+#      visa_backend) are only imported once the arguments have been checked,
+#      and the time spent on imports and instrument start-up is reported.
+#
+#      usage: run_headless.py [--resume] config.json data\data0.csv
+#
+#  Dependencies:
+#      PyVISA Version: 1.10.1
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import argparse
+import json
+import sys
+import time
+
+
+def main(argv):
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(description='Run a measurement configuration without the GUI.')
+    parser.add_argument('config', help='configuration file in pivot.json format')
+    parser.add_argument('data_file', help='output data file (.csv or .mcb)')
+    parser.add_argument('--resume', action='store_true', help='continue the interrupted run of data_file')
+    opts = parser.parse_args(argv[1:])
+    with open(opts.config, 'r') as file:
+        args = json.load(file)
+
+    from measurement_ctrl import meas_ctrl
+    import cal_store
+    import ctrl_signals
+    import data_storage
+    imported = time.perf_counter()
+    if opts.resume:
+        state = data_storage.load_checkpoint(opts.data_file)
+        if state is None:
+            print('No checkpoint found for {}, nothing to resume.'.format(opts.data_file))
+            return 1
+        print('Resuming {} at angle index {}...'.format(opts.data_file, state['next_index']))
+
+    signals = ctrl_signals.plain_signals()
+    signals.progress.connect(lambda p: print('progress {:6.1%}'.format(p)))
+    signals.paused.connect(lambda: print('paused'))
+    signals.stopped.connect(lambda: print('stopped'))
+    signals.cal_verified.connect(lambda *result: print(cal_store.verification_text(*result)))
+    ctrl = meas_ctrl(args, opts.data_file, signals)
+    connected = time.perf_counter()
+    print('Start-up: imports {:.3f} s, instruments {:.3f} s'.format(imported - start, connected - imported))
+
+    try:
+        if opts.resume:
+            ctrl.resume()
+        else:
+            ctrl.setup()
+            ctrl.run()
+    except KeyboardInterrupt:  # leave the head standing still, the last checkpoint allows --resume
+        ctrl.halt()
+        raise
+    if ctrl.interrupted == 'pause':
+        print('Run paused, continue it with --resume.')
+        return 1
+    if ctrl.interrupted is not None:
+        print('Run interrupted ({}).'.format(ctrl.interrupted))
+        return 1
+    print('Run complete in {:.1f} s.'.format(time.perf_counter() - connected))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
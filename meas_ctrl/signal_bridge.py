@@ -0,0 +1,93 @@
+################################################################################
+#
+#  Description:
+#      Rate-limited hand-over of measurement updates to the GUI thread. The
+#      measurement thread posts every position, progress and trace update to
+#      the bridge, which only stores the latest position and progress and
+#      queues the traces. A timer in the bridge's own (GUI) thread delivers
+#      what changed at the display rate: at most one position and one
+#      progress signal per frame, plus one trace_ready signal for every angle
+#      recorded since the last frame. This replaces the queued cross-thread
+#      signal per position poll that meas_ctrl_signals emits otherwise.
+#
+#      trace_ready carries one angle as columnar arrays:
+#          {'s_param': 'S21', 'theta': tilt, 'phi': pan,
+#           'freq': array('d') MHz, 'real': array('f'), 'imag': array('f')}
+#
+#      Usage (GUI thread):
+#          bridge = signal_bridge(rate=30)
+#          bridge.position.connect(...)
+#          ctrl.attach_bridge(bridge)
+#
+#  Status:
+#
+#
+#  Dependencies:
+#      PyQt5
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+from array import array
+from threading import Lock
+from PyQt5 import QtCore as qtc
+
+
+class signal_bridge(qtc.QObject):
+    position = qtc.pyqtSignal(float, float)  # pan, tilt
+    progress = qtc.pyqtSignal(float)
+    trace_ready = qtc.pyqtSignal(object)
+
+    def __init__(self, rate=30, parent=None):  # rate in frames per second
+        super().__init__(parent)
+        self.lock = Lock()
+        self.pending_position = None
+        self.pending_progress = None
+        self.traces = []
+        self.timer = qtc.QTimer(self)
+        self.timer.timeout.connect(self.deliver)
+        self.set_rate(rate)
+        self.timer.start()
+
+    def set_rate(self, rate):
+        self.timer.setInterval(max(1, int(1000 / rate)))
+
+    # called from the measurement thread, these only store the update
+    def post_position(self, pan, tilt):
+        with self.lock:
+            self.pending_position = (pan, tilt)
+
+    def post_progress(self, progress):
+        with self.lock:
+            self.pending_progress = progress
+
+    def post_trace(self, s_param, theta, phi, freqs, real, imag):
+        trace = {
+            's_param': s_param,
+            'theta': theta,
+            'phi': phi,
+            'freq': array('d', freqs),
+            'real': array('f', real),
+            'imag': array('f', imag),
+        }
+        with self.lock:
+            self.traces.append(trace)
+
+    def deliver(self):  # runs in the bridge's thread once per frame
+        with self.lock:
+            position = self.pending_position
+            progress = self.pending_progress
+            traces = self.traces
+            self.pending_position = None
+            self.pending_progress = None
+            self.traces = []
+        for trace in traces:
+            self.trace_ready.emit(trace)
+        if position is not None:
+            self.position.emit(position[0], position[1])
+        if progress is not None:
+            self.progress.emit(progress)
+
+    def stop(self):  # stops the timer and delivers whatever is still pending
+        self.timer.stop()
+        self.deliver()
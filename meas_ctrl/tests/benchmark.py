@@ -0,0 +1,292 @@
+################################################################################
+#
+#  Description:
+#      Benchmarks of the measurement hot paths that run with no instruments
+#      attached: positioner packet encode/decode, Parser.parse, FORM2 trace
+#      decode, storage append/load, meas_ctrl start-up and end-to-end sweeps
+#      (step and continuous) against the simulated instruments of
+#      sim_instruments.
+#      Results are written as JSON so runs of different versions can be
+#      compared:
+#
+#          python tests/benchmark.py -o before.json
+#          python tests/benchmark.py -o after.json --compare before.json
+#
+#      Every benchmark reports the best of several rounds. The simulated
+#      sweeps compress positioner motion and VNA averaging by --speedup, so
+#      their wall time is dominated by the host side (serial polling, trace
+#      transfer and conversion, storage) rather than by the instruments.
+#
+#  Status:
+#      Sections whose modules cannot be imported (e.g. no PyVISA or PyQt5)
+#      are reported as skipped instead of failing the whole run.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import argparse
+import json
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['', 'vna', 'qpt', 'data', 'tests']:
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+TRACE_POINTS = [5, 30, 201, 401, 801, 1601]
+
+
+def measure(fn, rounds=5, min_time=.2):
+    """Best time per call of fn over several rounds, every round calls fn
+    often enough to take at least min_time seconds.
+    """
+    count = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(0, count):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        count = count * 2
+    best = elapsed / count
+    for r in range(1, rounds):
+        start = time.perf_counter()
+        for i in range(0, count):
+            fn()
+        best = min(best, (time.perf_counter() - start) / count)
+    return {'seconds_per_call': best, 'calls_per_second': 1.0 / best}
+
+
+def form2_payload(points):  # FORM2 trace body (no #A header) like session.get_raw returns
+    values = []
+    for i in range(0, points):
+        values.append(.01 * (i % 17))
+        values.append(-.02 * (i % 13))
+    return memoryview(struct.pack('>{}f'.format(2 * points), *values))
+
+
+def bench_packets(results):
+    import qpt.packet as pkt
+    import qpt.integer as qi
+    from packet_parser import Parser
+    from threading import Lock
+    import sim_instruments
+
+    coord = qi.Coordinate(-123.45, 67.89)
+    results['packet.jog_positioner'] = measure(lambda: pkt.jog_positioner(127, 1, 0, 0))
+    results['packet.move_to_entered_coords'] = measure(lambda: pkt.move_to_entered_coords(coord))
+    results['packet.set_minimum_speeds'] = measure(lambda: pkt.set_minimum_speeds(40, 40))
+    status = sim_instruments.sim_positioner('ASRL1::INSTR').status(0x31)
+    results['packet.strip_esc'] = measure(lambda: pkt.strip_esc(status))
+
+    class parse_target:  # the attributes Parser.parse updates on a Positioner
+        def __init__(self):
+            self.curr_lock = Lock()
+
+    parser = Parser()
+    target = parse_target()
+    results['parser.parse_status'] = measure(lambda: parser.parse(status, target))
+    speeds = sim_instruments.packet(0x92, bytes([40, 40, 0, 0, 0, 0]))
+    results['parser.parse_min_speeds'] = measure(lambda: parser.parse(speeds, target))
+
+
+def bench_decode(results):
+    import vna_comms
+    import binary_storage
+    for points in TRACE_POINTS:
+        payload = form2_payload(points)
+        results['decode.decode_trace.{}'.format(points)] = measure(lambda: vna_comms.decode_trace(payload))
+        results['decode.raw_column.{}'.format(points)] = measure(
+            lambda: binary_storage.raw_column(payload, 0, points))
+
+
+def bench_storage(results, folder):
+    import data_storage
+    import binary_storage
+    import csv_loader
+    from sample_output import data
+
+    angles = 72
+    points = 201
+    traces = []
+    for a in range(0, angles):
+        traces.append([data('S21', 1000 + 10 * f, 0, a * 5 - 180, -30 - (f % 7), f % 360) for f in range(0, points)])
+
+    for name in ['bench.csv', 'bench.mcb']:
+        kind = os.path.splitext(name)[1][1:]
+        filename = os.path.join(folder, name)
+
+        def append():
+            data_storage.create_file(filename)
+            for t in traces:
+                data_storage.append_data(filename, t)
+            data_storage.end_run(filename)
+
+        def write():
+            data_storage.create_file(filename)
+            writer = data_storage.open_writer(filename)
+            for t in traces:
+                writer.append(t)
+            writer.end_run()
+            writer.close()
+
+        result = measure(append, rounds=3)
+        result['points_per_second'] = angles * points * result['calls_per_second']
+        results['storage.append_data.{}'.format(kind)] = result
+        result = measure(write, rounds=3)
+        result['points_per_second'] = angles * points * result['calls_per_second']
+        results['storage.writer.{}'.format(kind)] = result
+        if kind == 'csv':
+            result = measure(lambda: csv_loader.load(filename, use_cache=False), rounds=3)
+        else:
+            result = measure(lambda: binary_storage.load(filename), rounds=3)
+        result['points_per_second'] = angles * points * result['calls_per_second']
+        results['storage.load.{}'.format(kind)] = result
+
+
+def sweep_config(mode, resolution, points):
+    return {
+        'linear': {'start': 1000, 'end': 3000, 'points': points},
+        'list': [],
+        'impedance': True,
+        'calibration': False,
+        'averaging': 8,
+        'positioner_mv': mode,
+        'offset': {'pan': 0, 'tilt': 0},
+        'sweep_axis': 'pan',
+        'fixed_angle': 0,
+        'resolution': resolution,
+        'gpib_addr': 16,
+        'alias': 1,
+        'baud_rate': 9600,
+        'trace': os.devnull,
+    }
+
+
+def bench_sweeps(results, folder, speedup, resolution, points):
+    import sim_instruments
+    import acq_trace
+    import ctrl_signals
+    import measurement_ctrl
+
+    for mode in ['step', 'continuous']:
+        bench = sim_instruments.sim_bench(speedup)
+        sim_instruments.install(bench)
+        ctrl = measurement_ctrl.meas_ctrl(sweep_config(mode, resolution, points), os.path.join(folder, mode + '.csv'),
+                                          ctrl_signals.plain_signals())
+        ctrl.setup()
+        ctrl.vna_avg_delay = ctrl.vna_avg_delay / speedup
+        start = time.perf_counter()
+        ctrl.run()
+        elapsed = time.perf_counter() - start
+        angles = int(360 / resolution)
+        stages = {}
+        for [name, count, total, mean, peak] in acq_trace.recorder.summary():
+            stages[name] = {'count': count, 'total_seconds': total, 'mean_ms': mean}
+        results['sweep.{}'.format(mode)] = {
+            'seconds': elapsed,
+            'seconds_per_angle': elapsed / angles,
+            'mode_run': ctrl.sweep_mode,  # a continuous sweep that is too slow falls back to step
+            'angles': angles,
+            'points': points,
+            'speedup': speedup,
+            'positioner_queries': bench.open('ASRL1::INSTR').queries,
+            'positioner_link': vars(ctrl.qpt.comms.stats),
+            'stages': stages,
+        }
+
+
+def bench_startup(results, folder):  # meas_ctrl construction, on a fresh rig and on pooled connections
+    import sim_instruments
+    import ctrl_signals
+    import measurement_ctrl
+
+    sim_instruments.install(sim_instruments.sim_bench())
+    config = sweep_config('step', 30, 201)
+    start = time.perf_counter()
+    measurement_ctrl.meas_ctrl(config, os.path.join(folder, 'startup.csv'), ctrl_signals.plain_signals())
+    results['startup.connect'] = {'seconds': time.perf_counter() - start}
+    results['startup.pooled'] = measure(lambda: measurement_ctrl.meas_ctrl(
+        config, os.path.join(folder, 'startup.csv'), ctrl_signals.plain_signals()), rounds=3)
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run_section(name, fn, results, skipped):
+    print('{}...'.format(name))
+    try:
+        fn(results)
+    except ImportError as err:
+        skipped[name] = str(err)
+        print('  skipped: {}'.format(err))
+
+
+def compare(results, baseline):
+    print('{:<40}{:>14}{:>14}{:>9}'.format('benchmark', 'baseline', 'current', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        key = 'seconds' if 'seconds' in results[name] else 'seconds_per_call'
+        old = baseline[name][key]
+        new = results[name][key]
+        print('{:<40}{:>14.3e}{:>14.3e}{:>8.2f}x'.format(name, old, new, old / new))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks the measurement hot paths without instruments.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--speedup', type=float, default=20, help='time compression of the simulated instruments')
+    parser.add_argument('--resolution', type=float, default=30, help='angle step of the simulated sweeps')
+    parser.add_argument('--points', type=int, default=201, help='frequency points of the simulated sweeps')
+    parser.add_argument('--skip-sweeps', action='store_true')
+    options = parser.parse_args(argv[1:])
+
+    folder = tempfile.mkdtemp(prefix='meas_ctrl_bench_')
+    results = {}
+    skipped = {}
+    try:
+        run_section('packets', bench_packets, results, skipped)
+        run_section('trace decode', bench_decode, results, skipped)
+        run_section('storage', lambda r: bench_storage(r, folder), results, skipped)
+        run_section('start-up', lambda r: bench_startup(r, folder), results, skipped)
+        if not options.skip_sweeps:
+            run_section('simulated sweeps', lambda r: bench_sweeps(r, folder, options.speedup, options.resolution,
+                                                                   options.points), results, skipped)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    report = {
+        'revision': revision(),
+        'timestamp': time.time(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'results': results,
+        'skipped': skipped,
+    }
+    with open(options.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Results written to {}'.format(options.output))
+    if options.compare is not None:
+        with open(options.compare, 'r') as file:
+            compare(results, json.load(file)['results'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,70 @@
+################################################################################
+#
+#  Description:
+#      Checks of the legacy CSV loader (data/csv_loader) against files left
+#      behind by interrupted runs. Runs without instruments, either directly
+#      or under pytest:
+#
+#          python tests/csv_loader_check.py
+#
+#  Status:
+#      Needs NumPy.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['', 'vna', 'qpt', 'data']:
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import csv_loader
+
+SAMPLE = os.path.join(ROOT, 'data', 'data0.csv')
+
+
+def write_copy(content):
+    [handle, name] = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(handle, 'wb') as file:
+        file.write(content)
+    return name
+
+
+def test_truncated_last_row_is_dropped():
+    with open(SAMPLE, 'rb') as file:
+        content = file.read().rstrip(b'\r\n')
+    complete = csv_loader.load(SAMPLE, use_cache=False)
+    for cut in [11, 20, 40]:  # torn before the phase, inside the magnitude and inside the angles
+        name = write_copy(content[:-cut])
+        try:
+            table = csv_loader.load(name, use_cache=False)
+        finally:
+            os.remove(name)
+        assert len(table) == len(complete) - 1
+
+
+def test_malformed_row_names_the_line():
+    with open(SAMPLE, 'rb') as file:
+        lines = file.read().split(b'\n')
+    lines[3] = b'S21,1000,0.000000'
+    name = write_copy(b'\n'.join(lines))
+    try:
+        csv_loader.load(name, use_cache=False)
+    except Exception as err:
+        assert 'line 4' in str(err) and name in str(err), str(err)
+        return
+    finally:
+        os.remove(name)
+    assert False, 'a malformed row in the middle of the file was accepted'
+
+
+if __name__ == '__main__':
+    for [name, check] in sorted(globals().items()):
+        if name.startswith('test_'):
+            check()
+            print('{}: ok'.format(name))
@@ -0,0 +1,160 @@
+################################################################################
+#
+#  Description:
+#      Fault handling of meas_ctrl on the simulated rig (sim_instruments):
+#      a run that dies mid-sweep must halt the head, close its output and
+#      stream and keep a checkpoint that resume() completes the run from once
+#      the link is back, like after a pause. Runs without instruments,
+#      either directly or under pytest:
+#
+#          python tests/fault_check.py
+#
+#  Status:
+#      Every case waits out the positioner link timeouts, a few seconds each.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['', 'vna', 'qpt', 'data', 'tests']:
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import benchmark
+import binary_storage
+import ctrl_signals
+import data_storage
+import measurement_ctrl
+import sim_instruments
+import vna_timing
+
+SPEEDUP = 50
+FAIL_AFTER = 3      # angles committed before the positioner stops answering
+
+
+def sweep(mode, filename):  # config and meas_ctrl of a sweep on the installed simulated rig, set up
+    config = benchmark.sweep_config(mode, 10, 11)
+    config['stream'] = os.path.join(os.path.dirname(filename), 'stream')
+    ctrl = measurement_ctrl.meas_ctrl(config, filename, ctrl_signals.plain_signals())
+    ctrl.setup()
+    ctrl.vna_avg_delay = ctrl.vna_avg_delay / SPEEDUP
+    return ctrl
+
+
+def angles(filename):  # [(s_param, theta, phi) of every record, number of rows] of a binary file
+    [header, columns] = binary_storage.load(filename)
+    records = list(zip(columns['s_param'], columns['theta'], columns['phi']))
+    return [list(dict.fromkeys(records)), len(records)]
+
+
+def deaf_run(mode, folder):
+    """Runs a sweep whose positioner stops acknowledging anything after
+    FAIL_AFTER angles. Commands still reach it, only the replies are lost.
+    Returns [ctrl, positioner, error raised by run()].
+    """
+    bench = sim_instruments.sim_bench(SPEEDUP)
+    sim_instruments.install(bench)
+    positioner = bench.open('ASRL1::INSTR')
+    ctrl = sweep(mode, os.path.join(folder, mode + '.mcb'))
+    commit = ctrl.commit
+
+    def failing_commit(next_index):
+        commit(next_index)
+        if next_index == FAIL_AFTER:
+            positioner.inject(drops=10 ** 9)
+    ctrl.commit = failing_commit
+    try:
+        ctrl.run()
+    except Exception as err:
+        return [ctrl, positioner, err]
+    return [ctrl, positioner, None]
+
+
+def check_deaf_positioner(mode):
+    folder = tempfile.mkdtemp()
+    try:
+        [ctrl, positioner, error] = deaf_run(mode, folder)
+        assert error is not None, '{}: the run ignored a dead positioner link'.format(mode)
+        assert positioner.target is None and positioner.jog == [0.0, 0.0], '{}: the head was not halted'.format(mode)
+        assert ctrl.writer is None and ctrl.publisher is None, '{}: the output was left open'.format(mode)
+        assert not os.path.exists(os.path.join(folder, 'stream')), '{}: the stream socket is still bound'.format(mode)
+        assert ctrl.interrupted == 'error'
+        state = data_storage.load_checkpoint(ctrl.file)
+        assert state is not None and state['next_index'] >= FAIL_AFTER, '{}: no checkpoint to resume'.format(mode)
+        assert state['offset'] <= os.path.getsize(ctrl.file)
+    finally:
+        sim_instruments.install(sim_instruments.sim_bench())  # drops the pooled sessions of the dead rig
+        shutil.rmtree(folder)
+
+
+def check_resume_after_fault(mode):
+    folder = tempfile.mkdtemp()
+    try:
+        sim_instruments.install(sim_instruments.sim_bench(SPEEDUP))
+        clean = sweep(mode, os.path.join(folder, 'clean.mcb'))
+        clean.run()
+        [expected, rows] = angles(clean.file)
+        [ctrl, positioner, error] = deaf_run(mode, folder)
+        assert error is not None
+        with positioner.lock:   # the link is back
+            positioner.drops = 0
+        del ctrl.commit
+        compute_vna_delay = ctrl.compute_vna_delay
+        ctrl.compute_vna_delay = lambda: [delay / SPEEDUP for delay in compute_vna_delay()]
+        ctrl.resume()
+        assert ctrl.interrupted is None and data_storage.load_checkpoint(ctrl.file) is None
+        [resumed, resumed_rows] = angles(ctrl.file)
+        assert len(resumed) == len(expected) and resumed_rows == rows, '{}: rows were lost or repeated'.format(mode)
+        assert resumed[-1] == expected[-1], '{}: the resumed run did not reach the end of the sweep'.format(mode)
+    finally:
+        sim_instruments.install(sim_instruments.sim_bench())
+        shutil.rmtree(folder)
+
+
+def test_failed_setup():
+    folder = tempfile.mkdtemp()
+    try:
+        sim_instruments.install(sim_instruments.sim_bench(SPEEDUP))
+        config = benchmark.sweep_config('step', 10, vna_timing.MAX_LINEAR_POINTS + 1)  # fails after opening the output
+        config['stream'] = os.path.join(folder, 'stream')
+        ctrl = measurement_ctrl.meas_ctrl(config, os.path.join(folder, 'setup.mcb'), ctrl_signals.plain_signals())
+        try:
+            ctrl.setup()
+        except Exception:
+            pass
+        else:
+            assert False, 'the setup accepted an unsupported plan'
+        assert ctrl.writer is None and ctrl.publisher is None, 'the failed setup left its output open'
+        assert not os.path.exists(os.path.join(folder, 'stream'))
+    finally:
+        sim_instruments.install(sim_instruments.sim_bench())
+        shutil.rmtree(folder)
+
+
+def test_deaf_positioner_step():
+    check_deaf_positioner('step')
+
+
+def test_deaf_positioner_continuous():
+    check_deaf_positioner('continuous')
+
+
+def test_resume_after_fault_step():
+    check_resume_after_fault('step')
+
+
+def test_resume_after_fault_continuous():
+    check_resume_after_fault('continuous')
+
+
+if __name__ == '__main__':
+    for [name, check] in sorted(globals().items()):
+        if name.startswith('test_'):
+            check()
+            print('{}: ok'.format(name))
@@ -0,0 +1,238 @@
+################################################################################
+#
+#  Description:
+#      Simulated HP 8753D and QPT positioner for running meas_ctrl with no
+#      instruments attached. The simulated resources speak the same protocol
+#      as the real ones on the pyvisa resource interface (write/query/
+#      read_bytes for the VNA, write_raw/read_raw packets for the QPT), so
+#      vna_comms.session, positioner.Positioner and meas_ctrl run unchanged
+#      on top of them once install() has replaced the VISA backend.
+#
+#      Motion happens in real time multiplied by speedup, so a 360 degree
+#      jog at speed 127 (about 37 s on the chamber positioner) takes 37/speedup
+#      seconds. The VNA answers every trace request immediately with a fixed
+#      synthetic trace.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import math
+import struct
+import time
+from types import SimpleNamespace
+from threading import Lock
+import qpt.packet as pkt
+import kinematics
+import visa_backend
+
+STATUS_CMDS = [0x31, 0x33, 0x34, 0x35]
+
+
+class VisaIOError(Exception):
+    pass
+
+
+class sim_vna:
+    def __init__(self, name):
+        self.name = name
+        self.read_termination = '\n'
+        self.timeout = 2000
+        self.commands = 0
+        self.traces = {}   # points -> FORM2 block
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+
+    @timeout.deleter
+    def timeout(self):  # like pyvisa, deleting the timeout makes it infinite
+        self._timeout = None
+
+    def write(self, command):
+        self.commands = self.commands + 1
+
+    def write_raw(self, message):
+        self.commands = self.commands + 1
+
+    def query(self, command):
+        self.commands = self.commands + 1
+        if command.startswith('*IDN?'):
+            return 'HEWLETT PACKARD,8753D,0,6.14'
+        return '0'
+
+    def read_bytes(self, count):
+        points = (count - 4) // 8
+        if points not in self.traces:
+            values = []
+            for i in range(0, points):
+                magnitude = 10 ** (-(20 + 10 * math.sin(i / 7.0)) / 20)
+                values.append(magnitude * math.cos(i / 3.0))
+                values.append(magnitude * math.sin(i / 3.0))
+            payload = struct.pack('>{}f'.format(2 * points), *values)
+            self.traces[points] = b'#A' + struct.pack('>H', len(payload)) + payload
+        return self.traces[points]
+
+    def close(self):
+        pass
+
+
+class sim_positioner:
+    def __init__(self, name, speedup=1.0):
+        self.name = name
+        self.speedup = speedup
+        self.read_termination = b'\x03'
+        self.write_termination = b'\x03'
+        self.lock = Lock()
+        self.pan = 0.0
+        self.tilt = 0.0
+        self.target = None         # [pan, tilt] of an automated move
+        self.jog = [0.0, 0.0]      # pan, tilt rates in degrees per second
+        self.last = time.perf_counter()
+        self.reply = None
+        self.queries = 0
+        self.drops = 0             # replies still to be lost, see inject()
+        self.corruptions = 0       # replies still to be corrupted
+
+    def advance(self):
+        now = time.perf_counter()
+        dt = (now - self.last) * self.speedup
+        self.last = now
+        if self.target is not None:
+            self.pan = approach(self.pan, self.target[0], kinematics.pan_rate(kinematics.MAX_PAN_SPEED) * dt)
+            self.tilt = approach(self.tilt, self.target[1], kinematics.tilt_rate(kinematics.MAX_TILT_SPEED) * dt)
+            if self.pan == self.target[0] and self.tilt == self.target[1]:
+                self.target = None
+        else:
+            self.pan = max(-180.0, min(180.0, self.pan + self.jog[0] * dt))
+            self.tilt = max(-90.0, min(90.0, self.tilt + self.jog[1] * dt))
+
+    def rate(self, code, to_rate):  # signed rate of a jog speed byte (speed << 1 | direction)
+        speed = code >> 1
+        if speed == 0:
+            return 0.0
+        if code & 1:
+            return to_rate(speed)
+        return -to_rate(speed)
+
+    def write_raw(self, message):
+        with self.lock:
+            self.advance()
+            self.queries = self.queries + 1
+            rx = bytes(pkt.strip_esc(message))
+            cmd = rx[1]
+            if cmd == 0x31:
+                if rx[2] & 0x02:      # stop
+                    self.target = None
+                    self.jog = [0.0, 0.0]
+                elif self.target is None:
+                    self.jog = [self.rate(rx[3], kinematics.pan_rate), self.rate(rx[4], kinematics.tilt_rate)]
+            elif cmd == 0x33:
+                self.target = [angle(rx[2:4]), angle(rx[4:6])]
+            elif cmd == 0x34:
+                self.target = [self.pan + angle(rx[2:4]), self.tilt + angle(rx[4:6])]
+            elif cmd == 0x35:
+                self.target = [0.0, 0.0]
+            if cmd in STATUS_CMDS:
+                self.reply = self.status(cmd)
+            else:
+                self.reply = packet(cmd, bytes(6))
+            if self.drops > 0:
+                self.drops = self.drops - 1
+                self.reply = None
+            elif self.corruptions > 0:
+                self.corruptions = self.corruptions - 1
+                self.reply = self.reply[:2] + bytes([self.reply[2] ^ 0x40]) + self.reply[3:]
+
+    def inject(self, drops=0, corruptions=0):  # loses or corrupts the next replies
+        with self.lock:
+            self.drops = self.drops + drops
+            self.corruptions = self.corruptions + corruptions
+
+    def read_raw(self):
+        with self.lock:
+            reply = self.reply
+            self.reply = None
+        if reply is None:
+            raise VisaIOError('Timeout expired before operation completed.')
+        return reply
+
+    def status(self, cmd):
+        general = 0x80   # high resolution
+        if self.target is not None:
+            general = general | 0x40
+        if self.jog[0] > 0:
+            general = general | 0x08
+        elif self.jog[0] < 0:
+            general = general | 0x04
+        if self.jog[1] > 0:
+            general = general | 0x02
+        elif self.jog[1] < 0:
+            general = general | 0x01
+        return packet(cmd, struct.pack('<hhBBB', int(round(self.pan * 100)), int(round(self.tilt * 100)), 0, 0,
+                                       general))
+
+    def close(self):
+        pass
+
+
+def approach(value, target, step):
+    if abs(target - value) <= step:
+        return target
+    if target > value:
+        return value + step
+    return value - step
+
+
+def angle(data):  # QPT angle bytes (signed little endian hundredths of a degree) -> degrees
+    return int.from_bytes(data, byteorder='little', signed=True) / 100
+
+
+def packet(cmd, data):
+    tx = bytes([cmd]) + data
+    return b'\x02' + pkt.insert_esc(tx + pkt.generate_LRC(tx)) + b'\x03'
+
+
+class sim_resource_manager:
+    def __init__(self, bench):
+        self.bench = bench
+
+    def open_resource(self, name):
+        return self.bench.open(name)
+
+    def close(self):
+        pass
+
+
+class sim_bench:
+    """One simulated rig. Every resource name is opened once, GPIB resources
+    are VNAs and ASRL resources positioners.
+    """
+    def __init__(self, speedup=1.0):
+        self.speedup = speedup
+        self.resources = {}
+
+    def open(self, name):
+        if name not in self.resources:
+            if name.startswith('GPIB'):
+                self.resources[name] = sim_vna(name)
+            else:
+                self.resources[name] = sim_positioner(name, self.speedup)
+        return self.resources[name]
+
+    def visa(self):  # stands in for the pyvisa module
+        return SimpleNamespace(
+            ResourceManager=lambda *args: sim_resource_manager(self),
+            errors=SimpleNamespace(VisaIOError=VisaIOError),
+            constants=SimpleNamespace(StopBits=SimpleNamespace(one=10), Parity=SimpleNamespace(none=0)),
+        )
+
+
+def install(bench):  # points the process-wide VISA backend at the bench
+    visa_backend.use(bench.visa())
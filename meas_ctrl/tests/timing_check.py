@@ -0,0 +1,89 @@
+################################################################################
+#
+#  Description:
+#      Consistency checks of the VNA timing model (vna_timing) and of the
+#      optimizers built on it (run_estimator, noise_tuning). Runs without
+#      instruments, either directly or under pytest:
+#
+#          python tests/timing_check.py
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['', 'vna', 'qpt', 'data']:
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import benchmark
+import noise_tuning
+import run_estimator
+import vna_comms
+import vna_timing
+
+AVERAGING = [1, 2, 4, 8, 16, 32, 64, 128, 256, 999]
+
+
+def test_plan_delay_grows_with_averaging():  # from the measured 8 averages up, below them the 8-average wait holds
+    for is_list in [True, False]:
+        for points in [2, 5, 10, 15, 20, 25, 30, 201, 401, 801, 1601]:
+            for if_bw in vna_timing.IF_BWS:
+                delays = [vna_timing.plan_delay(is_list, points, avg, if_bw)[0] for avg in AVERAGING]
+                for [avg, low, high] in zip(AVERAGING[1:], delays, delays[1:]):
+                    assert high >= low
+                    assert avg <= 8 or high > low, \
+                        'list {} points {} IF BW {}: avg {} is not slower than the one below'.format(
+                            is_list, points, if_bw, avg)
+
+
+def test_plan_delay_never_below_measurements():  # the averaging delay is a real wait before reading a trace
+    for is_list in [True, False]:
+        for points in [2, 5, 10, 15, 20, 25, 30, 201, 401, 801, 1601]:
+            for avg in AVERAGING:
+                assert vna_timing.plan_delay(is_list, points, avg)[0] >= vna_timing.base_delay(is_list, points, avg)[0]
+
+
+def test_unmeasured_linear_sweep_raises():
+    try:
+        vna_timing.plan_delay(False, vna_timing.MAX_LINEAR_POINTS + 1, 8)
+    except Exception:
+        return
+    assert False, 'a linear sweep longer than the base table was timed'
+
+
+def test_plan_delay_matches_measurements():  # the base table was measured at 8 and 16 averages
+    for is_list in [True, False]:
+        for points in [5, 30, 201, 1601]:
+            for avg in [8, 16]:
+                measured = vna_timing.base_delay(is_list, points, avg)
+                model = vna_timing.plan_delay(is_list, points, avg)
+                assert all(abs(a - b) < 1e-9 for [a, b] in zip(measured, model))
+
+
+def test_optimize_keeps_minimum_averaging():  # more averaging is never free, so the minimum is the fastest
+    for points in [201, 801]:
+        [best, estimate] = run_estimator.optimize(benchmark.sweep_config('step', 10, points), min_averaging=16)
+        assert best['averaging'] == 16, 'points {}: picked averaging {}'.format(points, best['averaging'])
+
+
+def test_noise_tuning_respects_time_cap():
+    freq = vna_comms.lin_freq(1e9, 2e9, 201)
+    [if_bw, avg, predicted, seconds] = noise_tuning.choose(freq, .4, 3700, 1, .06)
+    assert predicted <= .06 and avg < 64
+    for max_time in [10, 30, 100]:  # unreachable target: quietest setting within the cap
+        [if_bw, avg, predicted, seconds] = noise_tuning.choose(freq, .4, 3700, 1, 1e-4, max_time)
+        assert predicted > 1e-4 and seconds <= max_time
+
+
+if __name__ == '__main__':
+    for [name, check] in sorted(globals().items()):
+        if name.startswith('test_'):
+            check()
+            print('{}: ok'.format(name))
@@ -0,0 +1,96 @@
+################################################################################
+#
+#  Description:
+#      Process-wide VISA backend. PyVISA is imported on first use instead of
+#      at module load and every session and positioner link of the process
+#      opens its resources through one shared ResourceManager, so the VISA
+#      library is only loaded once.
+#
+#      The backend also pools the connections built on top of it, keyed by
+#      resource string. checkout() hands out the already open and identified
+#      connection of a resource after a cheap health check and only opens a
+#      new one when there is none or the old one stopped answering, so back
+#      to back runs skip the identification and link set-up.
+#
+#      use() replaces the backend, e.g. with the simulated instruments of
+#      tests/sim_instruments.py.
+#
+#  Status:
+#
+#
+#  Dependencies:
+#      PyVISA Version: 1.10.1
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+from threading import Lock, RLock
+
+_lock = Lock()
+_visa = None      # the pyvisa module (or a stand-in)
+_manager = None   # the shared ResourceManager
+_pool_lock = RLock()
+_pool = {}        # resource string -> open connection (vna_comms.session, positioner.Positioner)
+
+
+def visa():
+    global _visa
+    with _lock:
+        if _visa is None:
+            import pyvisa
+            _visa = pyvisa
+        return _visa
+
+
+def resource_manager():
+    global _manager
+    module = visa()
+    with _lock:
+        if _manager is None:
+            _manager = module.ResourceManager()
+        return _manager
+
+
+def io_error():  # exception class of VISA I/O errors (timeouts), for except clauses
+    return visa().errors.VisaIOError
+
+
+def checkout(resource, connect, healthy):
+    """Connection to resource from the pool. The pooled connection is handed
+    out if healthy(connection) confirms it still answers, otherwise it is
+    closed and connect() opens a new one, which then replaces it.
+    """
+    with _pool_lock:
+        connection = _pool.get(resource)
+        if connection is not None:
+            if healthy(connection):
+                return connection
+            discard(resource)
+        connection = connect()
+        _pool[resource] = connection
+        return connection
+
+
+def discard(resource):  # closes the pooled connection of resource, the next checkout reconnects
+    with _pool_lock:
+        connection = _pool.pop(resource, None)
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass   # the link is being dropped because it misbehaves anyway
+
+
+def close_all():
+    with _pool_lock:
+        resources = list(_pool)
+    for resource in resources:
+        discard(resource)
+
+
+def use(module):
+    global _visa, _manager
+    close_all()
+    with _lock:
+        _visa = module
+        _manager = None
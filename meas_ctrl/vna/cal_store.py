@@ -0,0 +1,141 @@
+################################################################################
+#
+#  Description:
+#      Host-side cache of VNA calibrations. Every calibration is stored as a
+#      JSON record in the cache folder, keyed by frequency plan, IF bandwidth,
+#      port and the DUT named by the 'dut' config key, holding the time it was taken, the save/recall register of
+#      the VNA it was also saved to (if any), the error coefficient arrays
+#      read from the VNA and an S11 trace of the antenna taken right after
+#      calibrating. A later run recalls the register (or loads the
+#      coefficients when there is none or it has been overwritten) and
+#      repeats the S11 trace, the calibration is only used if both traces
+#      agree within a tolerance.
+#      The S11 comparison is a proxy: it shows that the port, cable and DUT
+#      still give the trace they gave right after calibrating, not that the
+#      calibration is valid against a standard. A different DUT would fail
+#      it for the wrong reason and a similar one could pass it, so records
+#      are only recalled for the DUT they were taken with. Runs that leave
+#      'dut' unset share one record per plan, and the operator has to make
+#      sure the DUT is the same one.
+#      Only the registers listed in the cal_registers config key are ever
+#      written, by default none, so the operator's saved states are safe.
+#
+#  Status:
+#      Only 1-port S11 calibrations are cached.
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import base64
+import hashlib
+import json
+import math
+import os
+import statistics
+import time
+import vna_comms
+
+REGISTERS = []                # save/recall registers of the VNA the cache may overwrite, default of cal_registers
+MAX_AGE = 24 * 3600           # seconds a cached calibration stays valid
+TOLERANCE = .5                # dB, median S11 deviation accepted when verifying a recalled calibration
+
+
+def cal_key(freq, if_bw, port, dut=None):
+    return [list(vna_comms.plan_key(freq)), if_bw, port, dut]
+
+
+def record_name(folder, key):
+    digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+    return os.path.join(folder, 'cal_{}.json'.format(digest[:16]))
+
+
+def records(folder):
+    if not os.path.isdir(folder):
+        return []
+    output = []
+    for name in sorted(os.listdir(folder)):
+        if name.startswith('cal_') and name.endswith('.json'):
+            with open(os.path.join(folder, name), 'r') as file:
+                output.append(json.load(file))
+    return output
+
+
+def find(folder, key, max_age=MAX_AGE):  # the cached calibration for key, None if there is none or it expired
+    name = record_name(folder, key)
+    if not os.path.exists(name):
+        return None
+    with open(name, 'r') as file:
+        record = json.load(file)
+    if record['key'] != key or time.time() - record['timestamp'] > max_age:
+        return None
+    return record
+
+
+def free_register(folder, key, registers=REGISTERS):
+    """Register out of registers for a new calibration of key: its own
+    earlier register, an unused one, or the one holding the oldest
+    calibration. None if registers is empty.
+    """
+    if len(registers) == 0:
+        return None
+    used = {}
+    for record in records(folder):
+        if record['register'] not in registers:
+            continue
+        if record['key'] == key:
+            return record['register']
+        used[record['register']] = min(record['timestamp'], used.get(record['register'], record['timestamp']))
+    for register in registers:
+        if register not in used:
+            return register
+    return min(used, key=lambda r: used[r])
+
+
+def save(folder, key, register, coefficients, verification):
+    """Stores a calibration, coefficients are the FORM2 payloads of the error
+    coefficient arrays, verification the FORM2 payload of the S11 trace.
+    register is None if the calibration was not saved on the VNA. Other
+    calibrations in the same register keep only their coefficients.
+    """
+    os.makedirs(folder, exist_ok=True)
+    if register is not None:
+        for record in records(folder):
+            if record['register'] == register and record['key'] != key:
+                record['register'] = None
+                write(folder, record)
+    record = {
+        'key': key,
+        'timestamp': time.time(),
+        'register': register,
+        'coefficients': [base64.b64encode(bytes(c)).decode('ascii') for c in coefficients],
+        'verification': base64.b64encode(bytes(verification)).decode('ascii'),
+    }
+    write(folder, record)
+    return record
+
+
+def write(folder, record):
+    name = record_name(folder, record['key'])
+    with open(name + '.tmp', 'w') as file:
+        json.dump(record, file)
+    os.replace(name + '.tmp', name)
+
+
+def coefficients(record):
+    return [base64.b64decode(c) for c in record['coefficients']]
+
+
+def verification_text(source, age, deviation, accepted):  # console line of a meas_ctrl cal_verified signal
+    if accepted:
+        return 'Calibration recalled from {} ({:.1f} h old, S11 deviation {:.3f} dB)'.format(source, age, deviation)
+    return 'Calibration from {} failed verification (S11 deviation {:.3f} dB)'.format(source, deviation)
+
+
+def deviation(record, payload):  # median magnitude difference (dB) between payload and the verification trace
+    [real_a, imag_a] = vna_comms.decode_trace(base64.b64decode(record['verification']))
+    [real_b, imag_b] = vna_comms.decode_trace(payload)
+    if len(real_a) != len(real_b):
+        return math.inf
+    return statistics.median(
+        [abs(10 * math.log10((real_a[i] ** 2 + imag_a[i] ** 2 + 1e-120) / (real_b[i] ** 2 + imag_b[i] ** 2 + 1e-120)))
+         for i in range(0, len(real_a))])
@@ -0,0 +1,128 @@
+################################################################################
+#
+#  Description:
+#      Splits a frequency list into list frequency tables the VNA can hold.
+#      The 8753D list mode takes at most 30 segments with at most 1632 points
+#      in total, and measures the table in ascending frequency order. A list
+#      of up to 30 frequencies fits one table and is programmed exactly as
+#      before, one single-point segment per frequency in list order. A longer
+#      list is turned into segments, evenly spaced runs of frequencies become
+#      one multi-point segment (start, stop, points) and every other
+#      frequency a single-point segment. The segments are then packed into as
+#      few tables as possible, balanced so every table takes about the same
+#      time to measure, measured table by table at each angle and merged
+#      back into one trace in the order of the list.
+#
+#  Status:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import math
+
+MAX_SEGMENTS = 30     # segments per list table
+MAX_POINTS = 1632     # points per list table
+
+
+def khz(freqs):  # the list in kHz, the resolution the segments are programmed with
+    return [int(round(f * 1000)) for f in freqs]
+
+
+def segments(freqs):
+    """[start kHz, stop kHz, points] segments covering the distinct
+    frequencies of the list (MHz) in ascending order. Runs of three or more
+    evenly spaced frequencies become one segment.
+    """
+    k = sorted(set(khz(freqs)))
+    result = []
+    i = 0
+    while i < len(k):
+        j = i
+        if i + 2 < len(k):
+            step = k[i + 1] - k[i]
+            while j + 1 < len(k) and k[j + 1] - k[j] == step and j + 1 - i < MAX_POINTS:
+                j = j + 1
+            if j == i + 1:   # two points are no run, the second may start the next one
+                j = i
+        result.append([k[i], k[j], j - i + 1])
+        i = j + 1
+    return result
+
+
+def split(segment, points):  # [first `points` points of segment, rest]
+    [start, stop, count] = segment
+    step = (stop - start) // (count - 1)
+    first = [start, start + step * (points - 1), points]
+    rest = [start + step * points, stop, count - points]
+    return [first, rest]
+
+
+def pack(parts, segment_cap, point_cap):
+    tables = [[]]
+    points = 0
+    queue = list(parts)
+    while len(queue) != 0:
+        segment = queue.pop(0)
+        room = point_cap - points
+        if len(tables[-1]) == segment_cap or room == 0:
+            tables.append([])
+            points = 0
+            room = point_cap
+        if segment[2] > room:
+            [segment, rest] = split(segment, room)
+            queue.insert(0, rest)
+        tables[-1].append(segment)
+        points = points + segment[2]
+    return tables
+
+
+def tables(freqs):
+    """List frequency tables for the list (MHz), each a list of segments.
+    A list that fits one table gets one segment per frequency, otherwise
+    the fewest tables the limits allow are used and the points are spread
+    evenly over them, splitting segments where needed.
+    """
+    k = khz(freqs)
+    distinct = list(dict.fromkeys(k))  # list order, repeats dropped
+    if len(distinct) <= MAX_SEGMENTS:
+        return [[[f, f, 1] for f in distinct]]
+    parts = segments(freqs)
+    total = sum(s[2] for s in parts)
+    count = max(1, int(math.ceil(len(parts) / float(MAX_SEGMENTS))), int(math.ceil(total / float(MAX_POINTS))))
+    while True:
+        result = pack(parts, MAX_SEGMENTS, min(MAX_POINTS, int(math.ceil(total / float(count)))))
+        if len(result) <= count:
+            return result
+        count = count + 1
+
+
+def table_points(table):
+    return sum(s[2] for s in table)
+
+
+def positions(freqs):
+    """Position of every list entry in the merged ascending trace of all
+    tables, None if that is the list order already.
+    """
+    k = khz(freqs)
+    ordered = sorted(set(k))
+    if ordered == k:
+        return None
+    index = {f: i for i, f in enumerate(ordered)}
+    return [index[f] for f in k]
+
+
+def merge(payloads, order):
+    """One FORM2 payload (8 bytes per point) in list order from the payloads
+    of all tables, in table order.
+    """
+    if len(payloads) == 1 and order is None:
+        return payloads[0]
+    merged = b''.join(payloads)
+    if order is None:
+        return memoryview(merged)
+    output = bytearray(8 * len(order))
+    for i in range(0, len(order)):
+        output[8 * i:8 * i + 8] = merged[8 * order[i]:8 * order[i] + 8]
+    return memoryview(output)
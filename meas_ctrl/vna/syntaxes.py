@@ -6,6 +6,7 @@ class Action(Enum):
     FORM2 = auto()
     EDIT_LIST = auto()
     ADD_LIST_FREQ = auto()
+    ADD_LIST_SEGMENT = auto()
     LIST_FREQ_MODE = auto()
     CLEAR_LIST = auto()
     LIN_FREQ_START = auto()
@@ -30,6 +31,11 @@ class Action(Enum):
     CAL_S11_1_PORT_LOAD = auto()
     SAVE_1_PORT_CAL = auto()
     CORRECTION_ON = auto()
+    SAVE_REGISTER = auto()
+    RECALL_REGISTER = auto()
+    OUTPUT_CAL_COEFS = auto()
+    INPUT_CAL_COEFS = auto()
+    SAVE_CAL_COEFS = auto()
 
 
 class Model(Enum):
@@ -52,6 +58,8 @@ def find_command(model, action, arg=0):
         return edit_list(model)
     elif action == Action.ADD_LIST_FREQ:
         return add_list_freq(model, arg)
+    elif action == Action.ADD_LIST_SEGMENT:
+        return add_list_segment(model, arg)
     elif action == Action.LIST_FREQ_MODE:
         return list_freq_mode(model)
     elif action == Action.CLEAR_LIST:
@@ -100,6 +108,16 @@ def find_command(model, action, arg=0):
         return save_1_port_cal(model)
     elif action == Action.CORRECTION_ON:
         return correction_on(model)
+    elif action == Action.SAVE_REGISTER:
+        return save_register(model, arg)
+    elif action == Action.RECALL_REGISTER:
+        return recall_register(model, arg)
+    elif action == Action.OUTPUT_CAL_COEFS:
+        return output_cal_coefs(model, arg)
+    elif action == Action.INPUT_CAL_COEFS:
+        return input_cal_coefs(model, arg)
+    elif action == Action.SAVE_CAL_COEFS:
+        return save_cal_coefs(model)
     else:
         raise Exception('Invalid action, find_command() does the recognize the action: {}'.format(action))
 
@@ -146,6 +164,26 @@ def add_list_freq(model, arg):
         raise Exception('The frequency is not in the valid range: {} MHz'.format(arg))
 
 
+# this action should add a segment of several evenly spaced points, arg is [start kHz, stop kHz, points]
+# 1. Add a new segment
+# 2. Modify the start frequency, stop frequency and number of points of the segment
+# 3. Done with segment
+def add_list_segment(model, arg):
+    [start, stop, points] = arg
+    argument_valid = {
+        Model.HP_8753D: start * 10 ** 3 in range(30000, 6 * 10 ** 9 + 1) and
+        stop * 10 ** 3 in range(30000, 6 * 10 ** 9 + 1) and start < stop and points in range(2, 1633),
+    }
+
+    commands = {
+        Model.HP_8753D: 'SADD; STAR {} KHZ; STOP {} KHZ; POIN {}; SDON'.format(start, stop, points),
+    }
+    if argument_valid.get(model):
+        return commands.get(model)
+    else:
+        raise Exception('The list segment is invalid: {} to {} kHz, {} points'.format(start, stop, points))
+
+
 # this action should select the list frequency sweep mode
 def list_freq_mode(model):
     commands = {
@@ -372,3 +410,71 @@ def correction_on(model):
         Model.HP_8753D: 'CORRON',
     }
     return commands.get(model)
+
+
+# this action should save the instrument state (including the calibration) to a save/recall register
+def save_register(model, arg):
+    argument_valid = {
+        Model.HP_8753D: arg in range(1, 32),
+    }
+
+    commands = {
+        Model.HP_8753D: 'SAVEREG{:02d}'.format(arg),
+    }
+    if argument_valid.get(model):
+        return commands.get(model)
+    else:
+        raise Exception('The save/recall register is invalid: {}'.format(arg))
+
+
+# this action should recall the instrument state (including the calibration) from a save/recall register
+def recall_register(model, arg):
+    argument_valid = {
+        Model.HP_8753D: arg in range(1, 32),
+    }
+
+    commands = {
+        Model.HP_8753D: 'RECAREG{:02d}'.format(arg),
+    }
+    if argument_valid.get(model):
+        return commands.get(model)
+    else:
+        raise Exception('The save/recall register is invalid: {}'.format(arg))
+
+
+# this action should output error coefficient array arg of the active calibration
+def output_cal_coefs(model, arg):
+    argument_valid = {
+        Model.HP_8753D: arg in range(1, 13),
+    }
+
+    commands = {
+        Model.HP_8753D: 'OUTPCALC{:02d}'.format(arg),
+    }
+    if argument_valid.get(model):
+        return commands.get(model)
+    else:
+        raise Exception('The error coefficient array is invalid: {}'.format(arg))
+
+
+# this action should input error coefficient array arg, the array data follows the command
+def input_cal_coefs(model, arg):
+    argument_valid = {
+        Model.HP_8753D: arg in range(1, 13),
+    }
+
+    commands = {
+        Model.HP_8753D: 'INPUCALC{:02d} '.format(arg),
+    }
+    if argument_valid.get(model):
+        return commands.get(model)
+    else:
+        raise Exception('The error coefficient array is invalid: {}'.format(arg))
+
+
+# this action should complete a calibration whose error coefficients were input, and turn correction on
+def save_cal_coefs(model):
+    commands = {
+        Model.HP_8753D: 'SAVC',
+    }
+    return commands.get(model)
@@ -1,7 +1,14 @@
-import pyvisa as visa
 import math
-from struct import unpack
+import time
+from struct import pack, unpack
 from syntaxes import find_command, Action, check_model
+import acq_trace
+import list_plan
+import vna_timing
+import visa_backend
+
+CAL_PORT = 1   # port of the S11 1-port calibration
+CAL_COEFS = 3  # error coefficient arrays of a 1-port calibration (directivity, source match, reflection tracking)
 
 
 class data:
@@ -21,20 +28,89 @@ class lin_freq:
         self.points = points
 
 
+# hashable description of a frequency plan, two plans with the same key configure the VNA identically
+def plan_key(freq):
+    if isinstance(freq, list):
+        return ('list',) + tuple(freq)
+    return ('linear', freq.start, freq.end, freq.points)
+
+
+def plan_frequencies(freq):  # frequency of every point of a frequency plan in MHz
+    if isinstance(freq, list):
+        return list(freq)
+    span = freq.end - freq.start
+    return [freq.start + i * span / (freq.points - 1) for i in range(0, freq.points)]
+
+
+# splits a FORM2 payload (see session.get_raw) into lists of real and imaginary parts
+def decode_trace(raw):
+    output_real = []
+    output_imag = []
+    x = 0
+    while x < len(raw) // 4:
+        output_real.append(unpack('>f', raw[4 * x:4 * (x + 1)])[0])
+        x = x + 1
+        output_imag.append(unpack('>f', raw[4 * x:4 * (x + 1)])[0])
+        x = x + 1
+    return [output_real, output_imag]
+
+
+# list of data for a decoded trace taken at freqs (MHz), see session.to_data
+def trace_data(freqs, output_real, output_imag, theta, phi, data_type):
+    temp_data_set = []
+    for i in range(0, len(freqs)):
+        rect_temp = [output_real[i], output_imag[i]]
+        mag_temp = 20 * math.log(math.sqrt(rect_temp[0] * rect_temp[0] + rect_temp[1] * rect_temp[1]) + 1e-60, 10)
+        phase_temp = phase(rect_temp)
+        if data_type == 'S21':
+            temp_data_set.append(data('S21', freqs[i], theta, phi, mag_temp, phase_temp))
+        else:
+            temp_data_set.append(data('S11', freqs[i], theta, phi, mag_temp, phase_temp))
+    return temp_data_set
+
+
+# identified session for resource, shared with earlier users of the resource while it still answers
+def open_session(resource):
+    return visa_backend.checkout(resource, lambda: session(resource), lambda s: s.is_alive())
+
+
 class session:
     def __init__(self, resource):
-        self.rm = visa.ResourceManager()
+        self.rm = visa_backend.resource_manager()
         self.vna = self.rm.open_resource(resource)
         self.vna.read_termination = '\n'
         del self.vna.timeout
-        self.model = check_model(self.vna.query('*IDN?'))
-        self.vna.write(find_command(self.model, Action.FORM2))
+        self.identify()
         self.freq = None
+        self.tables = None        # list frequency tables of a list plan (see list_plan), None for a linear plan
+        self.order = None         # list_plan.positions() of the list plan
+        self.active_table = 0
+        self.table_wait = 0       # averaging delay of one list table
         self.using_correction = False
+        self.cal_plan = None  # plan_key() of the frequency plan the current calibration was taken for
+        self.cal_bw = None    # IF bandwidth the current calibration was taken at
+
+    def identify(self):  # (re)checks the model and selects the binary transfer format
+        self.model = check_model(self.vna.query('*IDN?'))
+        self.vna.write(find_command(self.model, Action.FORM2))
+
+    def is_alive(self, timeout=2000):  # cheap check that the instrument still answers, timeout in ms
+        self.vna.timeout = timeout
+        try:
+            return check_model(self.vna.query('*IDN?')) == self.model
+        except Exception:
+            return False
+        finally:
+            del self.vna.timeout
+
+    def close(self):
+        self.vna.close()
 
     def reset_all(self):  # resets the entire machine to factory presets
         self.vna.write(find_command(self.model, Action.RESET))
         self.using_correction = False
+        self.cal_plan = None
+        self.cal_bw = None
         return 0
 
     def reset(self):  # resets only measurement parameters changed in setup (do not wipe calibration data!)
@@ -44,15 +120,14 @@ class session:
     def setup(self, freq, avg, bw):
         self.freq = freq
 
-        if isinstance(self.freq, list):
-            if len(self.freq) > 30:  # if sweep type is frequency list, only take a max of 30 frequencies
-                raise Exception('The number of frequencies in the frequency list exceeded 30.')
-            for i in range(0, len(self.freq)):
-                freq_temp = self.freq[i]
-                self.vna.write(find_command(self.model, Action.EDIT_LIST))
-                self.vna.write(find_command(self.model, Action.ADD_LIST_FREQ, int(freq_temp * 1000)))
-            self.vna.write(find_command(self.model, Action.LIST_FREQ_MODE))
+        if isinstance(self.freq, list):  # lists longer than one list table are split, see list_plan
+            self.tables = list_plan.tables(self.freq)
+            self.order = list_plan.positions(self.freq)
+            self.table_wait = vna_timing.vna_delay(self.freq, avg, bw)[0]
+            self.load_table(0)
         else:
+            self.tables = None
+            self.order = None
             self.vna.write(find_command(self.model, Action.LIN_FREQ_START, int(self.freq.start * 1000)))
             self.vna.write(find_command(self.model, Action.LIN_FREQ_END, int(self.freq.end * 1000)))
             self.vna.write(find_command(self.model, Action.LIN_FREQ_POINTS, self.freq.points))
@@ -62,65 +137,94 @@ class session:
         self.vna.write(find_command(self.model, Action.AVG_ON))
         self.vna.write(find_command(self.model, Action.AVG_RESET))
         self.vna.write(find_command(self.model, Action.IF_BW, bw))
-        if self.using_correction:
+        if self.using_correction and not self.is_segmented():  # load_table() drops the correction of a table
             self.vna.write(find_command(self.model, Action.CORRECTION_ON))
         return 0
 
+    def load_table(self, k):  # programs list table k and selects list mode
+        self.vna.write(find_command(self.model, Action.EDIT_LIST))
+        self.vna.write(find_command(self.model, Action.CLEAR_LIST))
+        for [start, stop, points] in self.tables[k]:
+            self.vna.write(find_command(self.model, Action.EDIT_LIST))
+            if points == 1:
+                self.vna.write(find_command(self.model, Action.ADD_LIST_FREQ, start))
+            else:
+                self.vna.write(find_command(self.model, Action.ADD_LIST_SEGMENT, [start, stop, points]))
+        self.vna.write(find_command(self.model, Action.LIST_FREQ_MODE))
+        self.active_table = k
+
+    def is_segmented(self):  # True if the plan takes more than one list table per trace
+        return self.tables is not None and len(self.tables) > 1
+
     def get_data(self, theta, phi, data_type):
-        temp_data_set = []
-        output_real = []
-        output_imag = []
-
-        self.vna.write(find_command(self.model, Action.DISPLAY_DATA_AND_MEM))
-        self.vna.write(find_command(self.model, Action.POLAR))
-        self.vna.write(find_command(self.model, Action.POLAR_LOG_MARKER))
-        self.vna.write(find_command(self.model, Action.AUTO_SCALE))
-        self.vna.write(find_command(self.model, Action.DATA_TO_MEM))
-        self.vna.write(find_command(self.model, Action.OUTPUT_FORMATTED_DATA))
-
-        if isinstance(self.freq, list):
-            output = self.vna.read_bytes(4 + 8 * len(self.freq))
-            x = 0
-            while x < 2 * len(self.freq):
-                output_real.append(unpack('>f', output[4 * (x + 1):4 * (x + 2)])[0])
-                x = x + 1
-                output_imag.append(unpack('>f', output[4 * (x + 1):4 * (x + 2)])[0])
-                x = x + 1
-        else:
-            output = self.vna.read_bytes(4 + 8 * self.freq.points)
-            x = 0
-            while x < 2 * self.freq.points:
-                output_real.append(unpack('>f', output[4 * (x + 1):4 * (x + 2)])[0])
-                x = x + 1
-                output_imag.append(unpack('>f', output[4 * (x + 1):4 * (x + 2)])[0])
-                x = x + 1
-
-        if isinstance(self.freq, list):
-            length = len(self.freq)
-            for i in range(0, length):
-                rect_temp = [output_real[i], output_imag[i]]
-                mag_temp = 20 * math.log(math.sqrt(rect_temp[0] * rect_temp[0] + rect_temp[1] * rect_temp[1]) + 1e-60,
-                                         10)
-                phase_temp = phase(rect_temp)
-                if data_type == 'S21':
-                    temp_data_set.append(data('S21', self.freq[i], theta, phi, mag_temp, phase_temp))
-                else:
-                    temp_data_set.append(data('S11', self.freq[i], theta, phi, mag_temp, phase_temp))
-        else:
-            span = self.freq.end - self.freq.start
-            for i in range(0, self.freq.points):
-                freq = self.freq.start + i * span / (self.freq.points - 1)
-                rect_temp = [output_real[i], output_imag[i]]
-                mag_temp = 20 * math.log(math.sqrt(rect_temp[0] * rect_temp[0] + rect_temp[1] * rect_temp[1]) + 1e-60,
-                                         10)
-                phase_temp = phase(rect_temp)
-                if data_type == 'S21':
-                    temp_data_set.append(data('S21', freq, theta, phi, mag_temp, phase_temp))
-                else:
-                    temp_data_set.append(data('S11', freq, theta, phi, mag_temp, phase_temp))
-        return temp_data_set
-
-    def calibrate(self):
+        [output_real, output_imag] = self.get_trace(data_type)
+        return self.to_data(output_real, output_imag, theta, phi, data_type)
+
+    def get_trace(self, data_type='S21', wait=time.sleep):  # reads the active trace as real and imaginary parts
+        payload = self.get_raw(data_type, wait)
+        with acq_trace.span('vna.decode'):
+            return decode_trace(payload)
+
+    def get_raw(self, data_type='S21', wait=time.sleep):
+        """Reads the trace of the whole frequency plan and returns the FORM2
+        payload: big-endian float32 (real, imag) pairs, one per point. For a
+        single table the memoryview points into the transfer buffer, no copy
+        is made.
+        A segmented list is read starting with the table that is loaded (and
+        already averaged), then every other table is loaded, averaged for
+        table_wait seconds through wait(seconds) and read. The last table
+        read stays loaded for the next trace, so every trace reprograms the
+        VNA one time less than it has tables. The tables are merged back into
+        the order of the list.
+        """
+        payload = self.read_table()
+        if self.tables is None:
+            return payload
+        payloads = [None] * len(self.tables)
+        payloads[self.active_table] = payload
+        for i in range(1, len(self.tables)):
+            k = (self.active_table + 1) % len(self.tables)
+            with acq_trace.span('vna.list_switch'):
+                self.load_table(k)
+                self.rst_avg(data_type)
+            with acq_trace.span('vna.avg_wait'):
+                wait(self.table_wait)
+            payloads[k] = self.read_table()
+        return list_plan.merge(payloads, self.order)
+
+    def read_table(self):  # FORM2 payload of the loaded sweep (one list table of a list plan)
+        with acq_trace.span('vna.write'):
+            self.vna.write(find_command(self.model, Action.DISPLAY_DATA_AND_MEM))
+            self.vna.write(find_command(self.model, Action.POLAR))
+            self.vna.write(find_command(self.model, Action.POLAR_LOG_MARKER))
+            self.vna.write(find_command(self.model, Action.AUTO_SCALE))
+            self.vna.write(find_command(self.model, Action.DATA_TO_MEM))
+            self.vna.write(find_command(self.model, Action.OUTPUT_FORMATTED_DATA))
+
+        with acq_trace.span('vna.read'):
+            output = self.vna.read_bytes(4 + 8 * self.trace_points())
+        return memoryview(output)[4:]  # skip the FORM2 header (#A + byte count)
+
+    def trace_points(self):  # points of the loaded sweep
+        if self.tables is not None:
+            return list_plan.table_points(self.tables[self.active_table])
+        return self.freq.points
+
+    def frequencies(self):  # frequency of every point of the current sweep in MHz
+        return plan_frequencies(self.freq)
+
+    def to_data(self, output_real, output_imag, theta, phi, data_type):
+        return trace_data(self.frequencies(), output_real, output_imag, theta, phi, data_type)
+
+    def is_calibrated_for(self, freq, if_bw=None):  # if_bw None accepts a calibration at any IF bandwidth
+        if isinstance(freq, list) and len(list_plan.tables(freq)) > 1:  # segmented lists are never corrected
+            return False
+        return self.using_correction and self.cal_plan == plan_key(freq) and (if_bw is None or self.cal_bw == if_bw)
+
+    def calibrate(self, freq=None, if_bw=None):
+        if isinstance(freq, list) and len(list_plan.tables(freq)) > 1:
+            raise Exception('A frequency list of {} list tables cannot be calibrated, a calibration only covers '
+                            'one table'.format(len(list_plan.tables(freq))))
         self.vna.write(find_command(self.model, Action.CAL_S11_1_PORT))
         input('Connect OPEN circuit to PORT 1. Press enter when ready...')
         self.vna.write(find_command(self.model, Action.CAL_S11_1_PORT_OPEN))
@@ -130,13 +234,49 @@ class session:
         self.vna.write(find_command(self.model, Action.CAL_S11_1_PORT_LOAD))
         self.vna.write(find_command(self.model, Action.SAVE_1_PORT_CAL))
         print('Calibration is complete!')
+        input('Reconnect the antenna to PORT 1. Press enter when ready...')
+        self.using_correction = True
+        if freq is not None:
+            self.cal_plan = plan_key(freq)
+        self.cal_bw = if_bw
+
+    def read_cal_coefficients(self):  # FORM2 payloads of the error coefficient arrays of the active calibration
+        arrays = []
+        for i in range(1, CAL_COEFS + 1):
+            self.vna.write(find_command(self.model, Action.OUTPUT_CAL_COEFS, i))
+            arrays.append(bytes(memoryview(self.vna.read_bytes(4 + 8 * self.trace_points()))[4:]))
+        return arrays
+
+    def load_cal_coefficients(self, arrays, freq, if_bw):  # calibrates from arrays of read_cal_coefficients()
+        self.vna.write(find_command(self.model, Action.CAL_S11_1_PORT))
+        for i in range(0, len(arrays)):
+            header = find_command(self.model, Action.INPUT_CAL_COEFS, i + 1).encode('ascii')
+            self.vna.write_raw(header + b'#A' + pack('>H', len(arrays[i])) + arrays[i])
+        self.vna.write(find_command(self.model, Action.SAVE_CAL_COEFS))
+        self.using_correction = True
+        self.cal_plan = plan_key(freq)
+        self.cal_bw = if_bw
+
+    def save_register(self, register):  # saves the instrument state and calibration to a save/recall register
+        self.vna.write(find_command(self.model, Action.SAVE_REGISTER, register))
+
+    def recall_register(self, register, freq, if_bw):
+        """Recalls a register saved by save_register() with a calibration of
+        freq at if_bw. The whole instrument state is recalled, setup() has
+        to be repeated afterwards.
+        """
+        self.vna.write(find_command(self.model, Action.RECALL_REGISTER, register))
+        self.identify()
         self.using_correction = True
+        self.cal_plan = plan_key(freq)
+        self.cal_bw = if_bw
 
     def rst_avg(self, data_type):  # the S11 and S21 commands automatically trigger an averaging reset in the VNA
-        if data_type == 'S11':
-            self.vna.write(find_command(self.model, Action.S11))
-        elif data_type == 'S21':
-            self.vna.write(find_command(self.model, Action.S21))
+        with acq_trace.span('vna.rst_avg'):
+            if data_type == 'S11':
+                self.vna.write(find_command(self.model, Action.S11))
+            elif data_type == 'S21':
+                self.vna.write(find_command(self.model, Action.S21))
 
 
 def phase(rect_coord):
@@ -0,0 +1,143 @@
+################################################################################
+#
+#  Description:
+#      Timing model of the VNA. The base table holds the averaging and
+#      get_data delays measured with tests/avg_timing.py at 8 and 16 sweeps
+#      per average and an IF bandwidth of 3700 Hz. The averaging delay is the
+#      wait before a trace is read, it is never shorter than the measured
+#      value of the table row; above 16 averages it grows as fitted from the
+#      two measurements (a fixed overhead plus one sweep time per average).
+#      Other bandwidths add the extra settling time per point to every sweep.
+#      Frequency lists longer than one list table (see list_plan) are measured
+#      table by table, every further table costs reprogramming the table, one
+#      averaging delay and one get_data.
+#
+#  Status:
+#
+#
+#  Dependencies:
+#
+#
+#  Built with Python Version: 3.8.5
+#
+################################################################################
+import list_plan
+
+BASE_IF_BW = 3700
+IF_BWS = [10, 30, 100, 300, 1000, 3000, 3700]  # bandwidths accepted by syntaxes.if_bw()
+LIST_TABLE_WRITE = .03   # estimated seconds per segment written by session.load_table()
+LIST_TABLE_SWITCH = .25  # estimated seconds for clearing the table and re-selecting list mode
+MAX_LINEAR_POINTS = 1601  # longest linear sweep in the base table
+
+
+def sweep_points(freq):  # number of points in a frequency plan, freq is a list or a vna_comms.lin_freq
+    if isinstance(freq, list):
+        return len(freq)
+    return freq.points
+
+
+# returns list w/ 3 numbers in seconds, [averaging delay, get_data delay (S11), get_data delay (S21)]
+# as measured at BASE_IF_BW
+def base_delay(is_list, points, avg):
+    if is_list:
+        if points <= 5:
+            if avg <= 8:
+                return [2.19, 1.202, 1.26]
+            return [3.98, 1.202, 1.26]
+        elif points <= 10:
+            if avg <= 8:
+                return [3.02, 1.296, 1.35]
+            return [5.80, 1.296, 1.35]
+        elif points <= 15:
+            if avg <= 8:
+                return [3.11, 1.36, 1.42]
+            return [5.95, 1.36, 1.42]
+        elif points <= 20:
+            if avg <= 8:
+                return [3.36, 1.417, 1.489]
+            return [6.48, 1.417, 1.489]
+        elif points <= 25:
+            if avg <= 8:
+                return [3.26, 1.477, 1.547]
+            return [6.35, 1.477, 1.547]
+        else:
+            if avg <= 8:
+                return [3.58, 1.52, 1.61]
+            return [6.76, 1.52, 1.61]
+    else:
+        if points <= 201:
+            if avg <= 8:
+                return [3.79, 1.71, 2.03]
+            return [7.30, 1.71, 2.03]
+        elif points <= 401:
+            if avg <= 8:
+                return [4.23, 2.15, 2.73]
+            return [7.99, 2.15, 2.73]
+        elif points <= 801:
+            if avg <= 8:
+                return [5.49, 3.01, 4.09]
+            return [10.39, 3.01, 4.09]
+        elif points <= MAX_LINEAR_POINTS:
+            if avg <= 8:
+                return [8.51, 4.72, 6.74]
+            return [16.06, 4.72, 6.74]
+    raise Exception('No VNA timing for a linear sweep of {} points, at most {} are supported'.format(
+        points, MAX_LINEAR_POINTS))
+
+
+def vna_delay(freq, avg, if_bw=BASE_IF_BW):
+    if isinstance(freq, list):
+        return list_delay(list_plan.tables(freq), avg, if_bw)
+    return plan_delay(False, sweep_points(freq), avg, if_bw)
+
+
+def table_delay(table, avg, if_bw=BASE_IF_BW):
+    # a table of up to 30 points is timed like the measured list sweeps, a larger one (multi-point segments)
+    # like a linear sweep with as many points, the few tables above 1601 points (of at most 1632) like 1601
+    points = list_plan.table_points(table)
+    return plan_delay(points <= list_plan.MAX_SEGMENTS, min(points, MAX_LINEAR_POINTS), avg, if_bw)
+
+
+def switch_time(table):  # reprogramming a list table of the VNA
+    return LIST_TABLE_SWITCH + LIST_TABLE_WRITE * len(table)
+
+
+def list_delay(tables, avg, if_bw=BASE_IF_BW):
+    """[averaging delay, get_data delay (S11), get_data delay (S21)] of a
+    list plan split into tables. The averaging delay is that of one table
+    (the wait before a trace is read), the get_data delays cover the whole
+    trace: reading the loaded table and loading, averaging and reading every
+    other one. Tables are loaded in turn, so on average every table but one
+    is reprogrammed per trace.
+    """
+    delays = [table_delay(t, avg, if_bw) for t in tables]
+    avg_delay = max(d[0] for d in delays)
+    switches = sum(switch_time(t) for t in tables) * (len(tables) - 1) / len(tables)
+    extra = switches + avg_delay * (len(tables) - 1)
+    return [avg_delay, sum(d[1] for d in delays) + extra, sum(d[2] for d in delays) + extra]
+
+
+def plan_delay(is_list, points, avg, if_bw=BASE_IF_BW):
+    delay = base_delay(is_list, points, avg)
+    measured = delay[0] + measured_sweeps(avg) * (sweep_time(points, if_bw) - sweep_time(points, BASE_IF_BW))
+    delay[0] = max(measured, fitted_delay(is_list, points, avg, if_bw))
+    return delay
+
+
+def measured_sweeps(avg):  # averaging factor the base table row used for avg was measured at
+    if avg <= 8:
+        return 8
+    return 16
+
+
+def fitted_delay(is_list, points, avg, if_bw=BASE_IF_BW):
+    # the measurements at 8 and 16 averages give the time per sweep and the overhead of the averaging delay
+    low = base_delay(is_list, points, 8)[0]
+    high = base_delay(is_list, points, 16)[0]
+    per_sweep = (high - low) / 8
+    overhead = low - 8 * per_sweep
+    return overhead + avg * (per_sweep + sweep_time(points, if_bw) - sweep_time(points, BASE_IF_BW))
+
+
+def sweep_time(points, if_bw):  # time the receiver spends settling on the points of one sweep
+    return points / if_bw